@@ -1,5 +1,9 @@
 from lora.parse import get_args
+import numpy as np
+from os.path import join
 from lora.utils import print_params, sim
+from lora.runner import run_replications
+from lora.parallel import run_clusters
 
 def main(args):
     # import agruments
@@ -21,20 +25,62 @@ def main(args):
     algo = str(args.Algo)
     exp_name = str(args.exp_name)
     logdir = str(args.logdir)
+    engine = str(args.engine)
+    replications = int(args.replications)
+    workers = int(args.workers)
+    metrics = str(args.metrics)
+    reception = str(args.reception)
+    kernels = args.kernels
+    traffic = str(args.traffic)
+    background = str(args.background)
+    clusters = bool(args.clusters)
+    interferenceThreshold = float(args.interferenceThreshold)
+    grid = list(map(int, args.grid.split()))
+    blockSize = int(args.blockSize)
     
     # print simulation parameters
     print("\n=================================================")
     print_params(nrNodes, nrIntNodes, nrBS, initial, radius, distribution, avgSendTime, horTime, packetLength, 
-                sfSet, freqSet, powSet, captureEffect, interSFInterference, info_mode, algo)
+                sfSet, freqSet, powSet, captureEffect, interSFInterference, info_mode, algo, engine)
     
     assert initial in ["UNIFORM", "RANDOM"], "Initial mode must be UNIFORM, RANDOM."
     assert info_mode in ["NO", "PARTIAL", "FULL"], "Initial mode must be NO, PARTIAL, or FULL."
     assert algo in ["exp3", "exp3s"], "Learning algorithm must be exp3 or exp3s."
+    assert engine in ["simpy", "heap", "vectorized", "batched"], "Simulation engine must be simpy, heap, vectorized or batched."
+    assert metrics in ["csv", "npz"], "Metrics format must be csv or npz."
+    assert reception in ["eager", "lazy"], "Reception model must be eager or lazy."
+    assert kernels in [None, "numpy", "numba"], "Kernels must be numpy or numba."
+    assert traffic in ["node", "poisson"], "Traffic model must be node or poisson."
+    assert background in ["node", "aggregate"], "Background model must be node or aggregate."
+    assert not (clusters and replications > 1), "Clusters and replications cannot be combined."
     
     
+    config = dict(nrNodes=nrNodes, nrIntNodes=nrIntNodes, nrBS=nrBS, initial=initial, radius=radius, distribution=distribution,
+                  avgSendTime=avgSendTime, horTime=horTime, packetLength=packetLength, sfSet=sfSet, freqSet=freqSet, powSet=powSet,
+                  captureEffect=captureEffect, interSFInterference=interSFInterference, info_mode=info_mode, algo=algo,
+                  logdir=logdir, exp_name=exp_name, engine=engine, metrics=metrics, reception=reception, kernels=kernels, traffic=traffic, background=background,
+                  interferenceThreshold=interferenceThreshold, grid=grid, blockSize=blockSize)
+
+    # running the interference clusters in parallel
+    if clusters:
+        results = run_clusters(config, workers)
+        np.savez(join(logdir, exp_name, "clusters.npz"), **results)
+        print ("================== Clusters ==================")
+        print ("# Clusters = {}".format(len(results['clusterNodes'])))
+        print ("# Ratio = {}".format(results['prr']))
+        return results
+    
+    # running replications (seeds 42, 43, ...)
+    if replications > 1:
+        results = run_replications(config, range(42, 42 + replications), workers)
+        np.savez(join(logdir, exp_name, "replications.npz"), **results)
+        print ("================== Replications ==================")
+        print ("# Ratio = {} +/- {}".format(results['prr_mean'], results['prr_ci']))
+        return results
+
     # running simulation
     bsDict, nodeDict = sim(nrNodes, nrIntNodes, nrBS, initial, radius, distribution, avgSendTime, horTime,
-    packetLength, sfSet, freqSet, powSet, captureEffect, interSFInterference, info_mode, algo, logdir, exp_name)
+    packetLength, sfSet, freqSet, powSet, captureEffect, interSFInterference, info_mode, algo, logdir, exp_name, engine, metrics=metrics, reception=reception, kernels=kernels, traffic=traffic, background=background, interferenceThreshold=interferenceThreshold, grid=grid, blockSize=blockSize)
 
     return bsDict, nodeDict
 
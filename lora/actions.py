@@ -0,0 +1,84 @@
+""" LPWAN Simulator: action tables
+============================================
+Utilities (:mod:`lora.actions`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   actionTable              -- Shared table of the actions of an action set.
+   bucketTable              -- Shared frequency buckets and SF/power indices of the actions at a BS.
+
+The actions of a node are all the (sf, freq, pTX) combinations of its sets.
+Most nodes have the same sets, so the tables are interned: nodes (and their
+packets) with the same sets share one read-only structured array and one
+tuple of actions instead of building their own list. The link budget of a
+packet (see myPacket.linkTable) is split the same way: the parts which do
+not depend on the distance are shared, and a packet only stores the
+received power of each transmit power at each of its base stations.
+"""
+import numpy as np
+from .loratools import getAffectedFreqBuckets
+
+__all__ = ['ACTION_DTYPE', 'actionTable', 'bucketTable']
+
+# fields of an action
+ACTION_DTYPE = np.dtype([('sf', np.int64), ('freq', np.int64), ('pTX', np.int64)])
+
+# interned tables, keyed by the (sfSet, freqSet, powSet) signature
+ACTION_TABLES = {}
+
+# interned bucket tables, keyed by (setActions, freqBuckets, bw)
+BUCKET_TABLES = {}
+
+def actionTable(sfSet, freqSet, powSet):
+    """ Shared table of the actions of an action set.
+    Parameters
+    ----------
+    sfSet: list
+        set of spreading factors
+    freqSet: list
+        set of channels (kHz)
+    powSet: list
+        set of transmit powers (dBm)
+    Returns
+    -------
+    actions: structured ndarray (read-only)
+        One record (sf, freq, pTX) per action, in the order sf, freq, pTX.
+    setActions: tuple
+        The same actions as (sf, freq, pTX) tuples.
+    """
+    key = (tuple(sfSet), tuple(freqSet), tuple(powSet))
+    if key not in ACTION_TABLES:
+        setActions = tuple((sf, freq, pTX) for sf in key[0] for freq in key[1] for pTX in key[2])
+        actions = np.array(list(setActions), dtype=ACTION_DTYPE)
+        actions.flags.writeable = False
+        ACTION_TABLES[key] = (actions, setActions)
+    return ACTION_TABLES[key]
+
+def bucketTable(setActions, freqBuckets, bw):
+    """ Shared part of the link budgets of the actions at a base station.
+    Parameters
+    ----------
+    setActions: tuple
+        actions (sf, freq, pTX) of the node
+    freqBuckets: list
+        frequency buckets of the BS
+    bw: int
+        bandwidth (kHz)
+    Returns
+    -------
+    links: tuple
+        For each action: frequency bucket, its index in freqBuckets (-1 if
+        outside), SF index and index of its pTX in powers.
+    powers: tuple
+        Transmit powers of the actions.
+    """
+    key = (tuple(setActions), tuple(freqBuckets), bw)
+    if key not in BUCKET_TABLES:
+        bucketIndex = {freq: i for i, freq in enumerate(freqBuckets)}
+        powers = tuple(dict.fromkeys(pTX for sf, freq, pTX in setActions))
+        links = []
+        for sf, freq, pTX in setActions:
+            bucket = getAffectedFreqBuckets(freq, bw)[0]
+            links.append((bucket, bucketIndex.get(bucket, -1), sf - 7, powers.index(pTX)))
+        BUCKET_TABLES[key] = (tuple(links), powers)
+    return BUCKET_TABLES[key]
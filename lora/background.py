@@ -0,0 +1,176 @@
+""" LPWAN Simulator: aggregated background traffic
+============================================
+Utilities (:mod:`lora.background`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   BackgroundTraffic        -- Aggregate interference of the non-learning nodes.
+   backgroundProcess        -- SimPy process of the background traffic.
+   actionLaw                -- Probabilities of the action of a packet of a node.
+
+The UNIFORM and RANDOM nodes do not learn: the only effect of their packets
+on the SMART nodes is the power they add to the signal levels of the base
+stations while they are on air. The background traffic replaces them by one
+interference process per (BS, frequency bucket, SF). Each node contributes
+its packet rate (one packet per Exp(period) wait and period, i.e.
+1/(2 period)) times the probability of each action to the class of the
+bucket and SF of the action at every BS in its proximity, together with its
+received power there. The merged process is Poisson with the summed rate; an
+arrival picks its class and its power with one uniform variate (cumulative
+weights of the contributions sorted by class), adds the power to the signal
+level of the class at its BS and removes it after the airtime of the packet.
+As a packet of a node, it holds a demodulator of the BS from its critical
+section to its end if it is received at that time (see myBS.makeCritical).
+
+The background packets get no ACK and are not counted in the statistics of
+the nodes, which cover the SMART nodes.
+"""
+import numpy as np
+
+__all__ = ['BackgroundTraffic', 'backgroundProcess', 'actionLaw']
+
+def actionLaw(node):
+    """ Probabilities of the action of a packet of a node.
+    A RANDOM node draws new probabilities after each packet (see
+    myNode.updateProb), so its actions are uniform on average.
+    Parameters
+    ----------
+    node: myNode
+        Non-learning node.
+    Returns
+    -------
+    prob: array
+        Probability of each action of the node.
+    """
+    if node.node_mode == "RANDOM":
+        return np.full(node.nrActions, 1/node.nrActions)
+    return np.array(node.prob)
+
+class BackgroundTraffic():
+    """ LPWAN Simulator: background traffic
+    Contributions of the nodes to the interference classes (BS, frequency
+    bucket, SF), sorted by class.
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] nodes: list of the non-learning nodes
+    \param [IN] bsDict: dictionary of BSs
+    \param [IN] logDistParams: log shadowing channel parameters
+    \param [IN] airtimes: durations of the packets (see lora.timing)
+    \param [IN] rng: random generator (e.g. the background stream of lora.rng)
+    \param [IN] blockSize: number of variates drawn at once
+
+    """
+    def __init__(self, nodes, bsDict, logDistParams, airtimes, rng, blockSize=4096):
+        self.rng = rng
+        self.blockSize = blockSize
+        self.bsids = list(bsDict.keys())
+        bsPos = {bsid: b for b, bsid in enumerate(self.bsids)}
+        bs, bucket, sf, freq, bw, power, lost, weight, tcritical, airtime = [[] for k in range(10)]
+        for node in nodes:
+            pkt = node.packet
+            actionLinks, bucketIdx, powermW, pRX, belowSensi = pkt.linkTable(bsDict, logDistParams)
+            law = actionLaw(node) / (2 * node.period) # packets per ms of each action
+            sfIdx = np.array([link[2] for link in actionLinks])
+            powerIdx = np.array([link[3] for link in actionLinks])
+            actionFreq = np.array([a[1] for a in node.setActions])
+            durations = np.array([airtimes.lookup(s + 7, pkt.bw) for s in range(6)])
+            for i, bsid in enumerate(pkt.bsids):
+                keep = (bucketIdx[:, i] >= 0) & (law > 0)
+                bs.append(np.full(keep.sum(), bsPos[bsid]))
+                bucket.append(bucketIdx[keep, i])
+                sf.append(sfIdx[keep])
+                freq.append(actionFreq[keep])
+                bw.append(np.full(keep.sum(), pkt.bw))
+                power.append(powermW[powerIdx[keep], i])
+                lost.append(belowSensi[powerIdx[keep], sfIdx[keep], i])
+                weight.append(law[keep])
+                tcritical.append(durations[sfIdx[keep], 0])
+                airtime.append(durations[sfIdx[keep], 1])
+        bs, bucket, sf, freq, bw = [np.concatenate(x).astype(np.int64) if x else np.zeros(0, dtype=np.int64) for x in (bs, bucket, sf, freq, bw)]
+        lost = np.concatenate(lost) if lost else np.zeros(0, dtype=bool)
+        power, weight, tcritical, airtime = [np.concatenate(x) if x else np.zeros(0) for x in (power, weight, tcritical, airtime)]
+
+        # contributions sorted by class
+        order = np.lexsort((sf, bucket, bs))
+        self.bs, self.bucket, self.sf = bs[order], bucket[order], sf[order]
+        self.power, self.isLost = power[order], lost[order]
+        self.keys = [(int(f), int(b), int(s) + 7) for f, b, s in zip(freq[order], bw[order], self.sf)] # demodulator of each contribution
+        self.tcritical = tcritical[order]
+        self.trest = airtime[order] - self.tcritical
+        self.airtime = airtime[order]
+        self.cumRate = np.cumsum(weight[order])
+        self.rate = self.cumRate[-1] if len(self.cumRate) else 0.0 # arrivals per ms
+
+        # rate of each class (BS, bucket, SF)
+        first = np.flatnonzero(np.r_[True, np.diff(self.bs) | np.diff(self.bucket) | np.diff(self.sf)]) if len(order) else np.zeros(0, dtype=np.int64)
+        self.classes = np.column_stack((self.bs[first], self.bucket[first], self.sf[first]))
+        self.classRate = np.add.reduceat(weight[order], first) if len(first) else np.zeros(0)
+        self.pos = blockSize
+
+    def refill(self):
+        """ Draw the next block of inter-arrival times and picks."""
+        self.gaps = self.rng.standard_exponential(self.blockSize)/self.rate
+        self.picks = self.rng.random(self.blockSize) * self.rate
+        self.pos = 0
+
+    def next(self):
+        """ Next background packet.
+        Returns
+        -------
+        gap: float
+            Time until the packet starts (ms).
+        e: int
+            Contribution (class and power) of the packet.
+        """
+        if self.pos == self.blockSize:
+            self.refill()
+        gap, x = self.gaps[self.pos], self.picks[self.pos]
+        self.pos += 1
+        return gap, min(int(self.cumRate.searchsorted(x, side='right')), len(self.cumRate) - 1)
+
+    def inject(self, bsDict, e):
+        """ The packet of a contribution starts: add its power at its BS."""
+        bsDict[self.bsids[self.bs[e]]].addInterference(self.bucket[e], self.sf[e], self.power[e])
+
+    def demodulate(self, bsDict, e):
+        """ The packet of a contribution (above the sensitivity) enters its critical section.
+        Returns
+        -------
+        held: bool
+            The packet holds a demodulator of its BS.
+        """
+        return bsDict[self.bsids[self.bs[e]]].demodulateInterference(self.bucket[e], self.sf[e], self.power[e], self.keys[e])
+
+    def release(self, bsDict, e, held):
+        """ The packet of a contribution ends: remove its power (and free its demodulator)."""
+        bsDict[self.bsids[self.bs[e]]].removeInterference(self.bucket[e], self.sf[e], self.power[e], self.keys[e] if held else None)
+
+def backgroundProcess(env, background, bsDict):
+    """ Inject the packets of the background traffic.
+    Parameters
+    ----------
+    env : simpy environement
+        Simulation environment.
+    background: BackgroundTraffic
+        Aggregate interference of the non-learning nodes.
+    bsDict: dict
+        list of BSs.
+    Returns
+    -------
+    """
+    if background.rate == 0:
+        return
+    def critical(e):
+        held = background.demodulate(bsDict, e)
+        env.timeout(background.trest[e]).callbacks.append(lambda event: background.release(bsDict, e, held))
+
+    while True:
+        gap, e = background.next()
+        yield env.timeout(gap)
+        background.inject(bsDict, e)
+        if background.isLost[e]: # below the sensitivity, never demodulated
+            env.timeout(background.airtime[e]).callbacks.append(lambda event, e=e: background.release(bsDict, e, False))
+        else:
+            env.timeout(background.tcritical[e]).callbacks.append(lambda event, e=e: critical(e))
@@ -0,0 +1,304 @@
+""" LPWAN Simulator: batched replications
+============================================
+Utilities (:mod:`lora.batched`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   ReplicaBatch             -- Seeds and summaries of a batch of replications.
+   ReplicaStreams           -- Random streams of the nodes of all the replications.
+   runBatched               -- Simulate replications of the same network together, with learning.
+
+The replications of a network share its geometry: only the random streams
+(see lora.rng) differ. The engine adds a replica dimension to the state of
+the nodes: node n of replication r is the virtual node r*N + n, so the
+probabilities, log-weights and counters are (R*N)-long arrays and the
+frequency buckets of replication r are the bucket groups shifted by r times
+the number of groups. The packets are drawn window by window and evaluated
+by lora.vectorized.windowStep, all the buckets of all the replications at
+once.
+
+The windows are at most half a period long and a packet and its ACK are
+shorter than the rest of the period, so the next packet of a node starts
+in a later window than the completion of the previous one. After each
+window, the packets completed in it (at the end of their ACK, as in
+completeTransmission) update the counters and, if they were received, the
+weights and probabilities of their node with the batch kernels of
+lora.learning (rewards and rules of myNode.updateProb) before it draws its
+next action: the learning sees the packets in the same order as the
+discrete-event engines, and a checkpoint holds the packets completed
+before it. A replication draws the same variates from the
+streams of its seed as a run of sim() with this seed and the node traffic
+model: with one base station, it sends the same packets with the same
+outcomes. With several base stations, the discrete-event engines keep a
+packet at the later BSs while the ACKs of the earlier ones are sent, which
+the bulk evaluation ignores (as lora.vectorized): the packets then
+interfere a little less and the reception ratio is slightly higher.
+"""
+import numpy as np
+from .bsFunctions import writeResults
+from .stats import NetworkStats
+from .timing import AirtimeTable
+from .rng import RandomStreams
+from .population import MODES
+from .learning import exp3Update, exp3sUpdate, exp3Prob, pruneProb
+from .vectorized import linkTables, windowStep
+
+__all__ = ['ReplicaBatch', 'ReplicaStreams', 'runBatched']
+
+class ReplicaBatch():
+    """ LPWAN Simulator: batch of replications
+    Seeds of the replications simulated together and their summaries (same
+    keys as lora.runner.runReplication), filled by runBatched.
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] seeds: seed of each replication
+
+    """
+    def __init__(self, seeds):
+        self.seeds = [int(seed) for seed in seeds]
+        self.summaries = []
+
+class ReplicaStreams():
+    """ LPWAN Simulator: random streams of a batch
+    One RandomStreams per replication; row r*N + n is the row n of the
+    streams of replication r.
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] seeds: seed of each replication
+    \param [IN] keys: id of each node
+    \param [IN] blockSize: number of variates drawn at once (see RandomStreams)
+
+    """
+    def __init__(self, seeds, keys, blockSize=32):
+        self.nrNodes = len(keys)
+        self.streams = [RandomStreams(seed, self.nrNodes, blockSize) for seed in seeds]
+        for streams in self.streams:
+            for row, key in enumerate(keys):
+                streams.seedNode(row, key)
+
+    def draw(self, rows, method):
+        """ Next variate of each virtual node of rows (distinct) with a method of RandomStreams."""
+        rows = np.asarray(rows, dtype=np.int64)
+        values = np.zeros(len(rows))
+        replica = rows // self.nrNodes
+        order = np.argsort(replica, kind='stable')
+        bounds = np.searchsorted(replica[order], np.arange(len(self.streams) + 1))
+        for r, streams in enumerate(self.streams):
+            idx = order[bounds[r]:bounds[r+1]]
+            if len(idx):
+                values[idx] = getattr(streams, method)(rows[idx] - r * self.nrNodes)
+        return values
+
+    def exponentialArray(self, rows):
+        """ Next standard exponential variate of each virtual node of rows."""
+        return self.draw(rows, 'exponentialArray')
+
+    def uniformArray(self, rows):
+        """ Next uniform variate of each virtual node of rows."""
+        return self.draw(rows, 'uniformArray')
+
+    def uniformMatrix(self, rows, nrActions, width):
+        """ Next nrActions uniform variates of each virtual node of rows (as RandomStreams.uniformVector), padded with 0."""
+        values = np.zeros((len(rows), width))
+        for k in range(int(np.max(nrActions, initial=0))):
+            sel = np.flatnonzero(nrActions > k)
+            values[sel, k] = self.uniformArray(rows[sel])
+        return values
+
+def runBatched(nodeDict, bsDict, simtime, logDistParams, algo, batch, checkpoint=None):
+    """ Simulate the replications of a batch together, with learning.
+    Parameters
+    ----------
+    nodeDict: dict
+        list of nodes (they take the final state of the first replication).
+    bsDict: dict
+        list of BSs.
+    simtime: float
+        Simulation time in ms.
+    logDistParams: list
+        channel params
+    algo: string
+        learning algorithm
+    batch: ReplicaBatch
+        Seeds of the replications, receives their summaries.
+    checkpoint: dict
+        Results of the first replication to save every 100 hours: fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e, sink.
+    Returns
+    -------
+    """
+    # nodes without a BS in range cannot send anything
+    nodes = [node for node in nodeDict.values() if node.proximateBS]
+    interval = 100 * 3600000
+    nCheckpoints = int(np.ceil(simtime / interval)) - 1 # checkpoints strictly before simtime
+    if not nodes:
+        empty = np.zeros(nCheckpoints)
+        batch.summaries = [{'ratio': empty, 'energy': empty, 'transmitted': empty, 'received': empty,
+                            'prob': np.zeros((nCheckpoints, 0, 0)), 'prr': np.array(0.0), 'final': np.zeros(3)} for seed in batch.seeds]
+        return
+    bsList = list(bsDict.values())
+    bs0 = bsList[0]
+    interactionMatrix = np.asarray(bs0.interactionMatrix, dtype=float)
+    tables = linkTables(nodes, bsList, logDistParams)
+    N = len(nodes)
+    K = tables['sfIdx'].shape[1]
+    R = len(batch.seeds)
+
+    # virtual node v = r*N + n: node n of replication r
+    V = R * N
+    nodeOf = np.tile(np.arange(N), R)
+    replicaOf = np.repeat(np.arange(R), N)
+    population = nodes[0].population
+    popRows = np.array([node.row for node in nodes], dtype=np.int64)
+    period = np.array([node.period for node in nodes])[nodeOf]
+    nrActions = np.array([node.nrActions for node in nodes])[nodeOf]
+    mode = population.mode[popRows][nodeOf]
+    isSmart = mode == MODES.index("SMART")
+    isRandom = mode == MODES.index("RANDOM")
+    fullMode = np.array([node.info_mode == "FULL" for node in nodes], dtype=bool)[nodeOf]
+    learningRate = population.learningRate[popRows][nodeOf]
+    alpha = population.alpha[popRows][nodeOf]
+    valid = np.arange(K) < nrActions[:, None]
+
+    # initial probabilities (as myNode), uniform weights
+    streams = ReplicaStreams(batch.seeds, [node.nodeid for node in nodes], population.streams.blockSize)
+    if nodes[0].initial == "RANDOM":
+        prob = streams.uniformMatrix(np.arange(V), nrActions, K)
+        prob /= np.sum(prob, axis=1, keepdims=True)
+    else:
+        prob = np.where(valid, 1/nrActions[:, None], 0.0)
+    logWeight = np.where(valid, 0.0, -np.inf)
+
+    # windows of at most half a period, aligned on the checkpoints
+    assert 2 * np.max(tables['air']) < np.min(period) / 2, "A packet and its ACK must be shorter than half a period."
+    perInterval = int(np.ceil(interval / (np.min(period) / 2)))
+    window = interval / perInterval
+    ckTransmitted = np.zeros((R, nCheckpoints + 1))
+    ckReceived = np.zeros((R, nCheckpoints + 1))
+    ckEnergy = np.zeros((R, nCheckpoints + 1))
+    tracked = [n for n, node in enumerate(nodes) if node.node_mode != "UNIFORM"]
+    width = max([nodes[n].nrActions for n in tracked], default=0)
+    ckProb = np.zeros((R, nCheckpoints, len(tracked), width))
+    lastAction = np.full(V, -1, dtype=np.int64)
+
+    packetsTransmitted = np.zeros(V, dtype=np.int64)
+    packetsSuccessful = np.zeros(V, dtype=np.int64)
+    energy = np.zeros(V)
+    transmitTime = np.zeros(V)
+    nextStart = period * streams.exponentialArray(np.arange(V))
+    # sent packets whose ACK completes after the end of their window
+    waiting = {f: np.zeros(0, dtype=np.int64 if f in ['node', 'action'] else bool if f in ['success', 'clean'] else float)
+               for f in ['node', 'action', 'completion', 'success', 'clean', 'energy']}
+
+    carry = None
+    nTx = 0
+    holders = [[] for _ in range(R * len(bsList))] # (end, bucket group, sf) of packets using a demodulator, per replication and BS
+    nrDemodulators = [bs.nDemodulator for bs in bsList] * R
+    step = 0
+    frontier = 0.0
+    while frontier < simtime:
+        step += 1
+        previous, frontier = frontier, min((step // perInterval) * interval + (step % perInterval) * window, simtime)
+
+        # draw the packets starting in the window (at most one per virtual node)
+        txNode = np.flatnonzero(nextStart < frontier)
+        txStart = nextStart[txNode]
+        txUniform = streams.uniformArray(txNode)
+        nextStart[txNode] += period[txNode] * (1 + streams.exponentialArray(txNode))
+        order = np.argsort(txStart, kind='stable')
+        txNode, txStart, txUniform = txNode[order], txStart[order], txUniform[order]
+        # inverse CDF of the current probabilities (as ActionSampler)
+        cumProb = np.where(valid[txNode], np.cumsum(prob[txNode], axis=1), np.inf)
+        total = cumProb[np.arange(len(txNode)), nrActions[txNode] - 1]
+        txAction = np.sum((txUniform * total)[:, None] >= cumProb, axis=1)
+        txAction = np.minimum(txAction, nrActions[txNode] - 1)
+        lastAction[txNode] = txAction
+        txId = nTx + np.arange(len(txNode))
+        nTx += len(txNode)
+
+        tx = {'id': txId, 'node': txNode, 'base': nodeOf[txNode], 'replica': replicaOf[txNode], 'start': txStart, 'action': txAction}
+        carry, finished = windowStep(tables, carry, tx, holders, nrDemodulators, interactionMatrix, bs0.captureThreshold, previous, frontier)
+        finished = {f: np.concatenate((waiting[f], finished[f])) for f in finished}
+
+        # packets completed in the window (after their ACK, as completeTransmission)
+        ready = finished['completion'] <= frontier
+        waiting = {f: finished[f][~ready] for f in finished}
+        dNode, completion, success, clean, dEnergy = [finished[f][ready] for f in ['node', 'completion', 'success', 'clean', 'energy']]
+        inTime = completion < simtime
+        counted = success & inTime & (clean | ~fullMode[dNode])
+        packetsTransmitted[dNode[inTime]] += 1
+        packetsSuccessful[dNode[counted]] += 1
+        energy[dNode[inTime]] += dEnergy[inTime]
+        transmitTime[dNode[counted]] += tables['rectime'][nodeOf[dNode[counted]]]
+        ck = replicaOf[dNode[inTime]] * (nCheckpoints + 1) + np.minimum((completion[inTime] // interval).astype(np.int64), nCheckpoints)
+        ckTransmitted += np.bincount(ck, minlength=R * (nCheckpoints + 1)).reshape(R, -1)
+        ckReceived += np.bincount(ck, weights=counted[inTime], minlength=R * (nCheckpoints + 1)).reshape(R, -1)
+        ckEnergy += np.bincount(ck, weights=dEnergy[inTime], minlength=R * (nCheckpoints + 1)).reshape(R, -1)
+
+        # learning of the nodes whose packet was received (see myNode.updateProb)
+        update = success & inTime
+        uNode, uAction = dNode[update], finished['action'][ready][update]
+        reward = np.where(isSmart[uNode], 1/prob[uNode, uAction], 0.0)
+        reward[fullMode[uNode] & ~clean[update]] *= 0.5
+        if algo == "exp3":
+            exp3Update(logWeight, nrActions, uNode, uAction, reward, learningRate)
+        elif algo == "exp3s":
+            exp3sUpdate(logWeight, nrActions, uNode, uAction, reward, learningRate, alpha)
+        uSmart, uRandom = uNode[isSmart[uNode]], uNode[isRandom[uNode]]
+        prob[uSmart] = exp3Prob(logWeight, nrActions, uSmart, learningRate)
+        newProb = streams.uniformMatrix(uRandom, nrActions[uRandom], K)
+        prob[uRandom] = newProb / np.sum(newProb, axis=1, keepdims=True)
+        prob[uNode] = pruneProb(prob[uNode])
+
+        # probabilities at the checkpoints (the windows end on them)
+        c = step // perInterval
+        if step % perInterval == 0 and 1 <= c <= nCheckpoints:
+            ckProb[:, c-1] = prob.reshape(R, N, K)[:, tracked, :width]
+            if checkpoint is not None:
+                saveCheckpoint(nodeDict, nodes, prob[:N], lastAction[:N], packetsTransmitted[:N], packetsSuccessful[:N], energy[:N],
+                               transmitTime[:N], ckTransmitted[0, :c].sum(), ckReceived[0, :c].sum(), ckEnergy[0, :c].sum(), **checkpoint)
+
+    # summaries of the replications (see lora.runner.runReplication)
+    nTransmitted = np.cumsum(ckTransmitted, axis=1)
+    nRecvd = np.cumsum(ckReceived, axis=1)
+    totalEnergy = np.cumsum(ckEnergy, axis=1)
+    batch.summaries = []
+    for r in range(R):
+        final = np.array([packetsTransmitted[r*N:(r+1)*N].sum(), packetsSuccessful[r*N:(r+1)*N].sum(), energy[r*N:(r+1)*N].sum()])
+        batch.summaries.append({'ratio': nRecvd[r, :-1] / np.maximum(nTransmitted[r, :-1], 1),
+                                'energy': totalEnergy[r, :-1], 'transmitted': nTransmitted[r, :-1], 'received': nRecvd[r, :-1],
+                                'prob': ckProb[r], 'prr': np.array(final[1]/final[0]), 'final': final})
+
+    # final state of the nodes: first replication
+    setState(nodes, prob[:N], lastAction[:N], packetsTransmitted[:N], packetsSuccessful[:N], energy[:N], transmitTime[:N])
+    population.logWeight[popRows, :K] = logWeight[:N]
+
+def setState(nodes, prob, lastAction, packetsTransmitted, packetsSuccessful, energy, transmitTime):
+    """ Copy the probabilities, last actions and counters of a replication into the nodes."""
+    for n, node in enumerate(nodes):
+        node.prob[:] = prob[n, :node.nrActions]
+        node.sampler.invalidate()
+        node.packetsTransmitted = packetsTransmitted[n]
+        node.packetsSuccessful = packetsSuccessful[n]
+        node.energy = energy[n]
+        node.transmitTime = transmitTime[n]
+        node.packetNumber = packetsTransmitted[n]
+        if lastAction[n] >= 0:
+            node.packet.choosenAction = lastAction[n]
+            node.packet.sf, node.packet.freq, node.packet.pTX = node.setActions[lastAction[n]]
+
+def saveCheckpoint(nodeDict, nodes, prob, lastAction, packetsTransmitted, packetsSuccessful, energy, transmitTime,
+                   nTransmitted, nRecvd, totalEnergy, fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e, sink=None):
+    """ Write the results of the first replication at a checkpoint in the files of the save* processes."""
+    setState(nodes, prob, lastAction, packetsTransmitted, packetsSuccessful, energy, transmitTime)
+    pkt = nodes[0].packet
+    airtimes = AirtimeTable.fromPacket(pkt)
+    stats = NetworkStats(sfSet, freqSet, [airtimes.lookup(sf, pkt.bw)[1] for sf in sfSet])
+    stats.transmitted, stats.received, stats.energy = int(nTransmitted), int(nRecvd), totalEnergy
+    for n in np.flatnonzero(lastAction >= 0):
+        sf, freq, pTX = nodes[n].setActions[lastAction[n]]
+        stats.moveNode((None, None), (sf, freq))
+    writeResults(nodeDict, fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e, sink, stats)
@@ -1,5 +1,88 @@
 import numpy as np
-from .loratools import dBmTomW
+from . import kernels
+
+class TransmissionTable():
+    """ LPWAN Simulator: active transmissions at a base station
+    Preallocated table of the packets currently on air at a base station.
+    Each row holds one transmission; rows are recycled through a free list
+    and the arrays are doubled in place when the table is full.
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] capacity: initial number of rows
+
+    """
+    def __init__(self, capacity=64):
+        self.slots = {} # nodeid -> row
+        self.freeRows = list(range(capacity - 1, -1, -1))
+        self.nodeid = np.full(capacity, -1, dtype=np.int64)
+        self.sfIdx = np.zeros(capacity, dtype=np.int64)
+        self.bucketIdx = np.full(capacity, -1, dtype=np.int64)
+        self.power = np.zeros(capacity) # received power in mW
+        self.isCritical = np.zeros(capacity, dtype=bool)
+        self.isLost = np.zeros(capacity, dtype=bool)
+        self.isCollision = np.zeros(capacity, dtype=bool)
+
+    def grow(self):
+        """ Double the capacity of the table."""
+        capacity = len(self.nodeid)
+        self.nodeid = np.concatenate((self.nodeid, np.full(capacity, -1, dtype=np.int64)))
+        self.sfIdx = np.concatenate((self.sfIdx, np.zeros(capacity, dtype=np.int64)))
+        self.bucketIdx = np.concatenate((self.bucketIdx, np.full(capacity, -1, dtype=np.int64)))
+        self.power = np.concatenate((self.power, np.zeros(capacity)))
+        self.isCritical = np.concatenate((self.isCritical, np.zeros(capacity, dtype=bool)))
+        self.isLost = np.concatenate((self.isLost, np.zeros(capacity, dtype=bool)))
+        self.isCollision = np.concatenate((self.isCollision, np.zeros(capacity, dtype=bool)))
+        self.freeRows = list(range(2*capacity - 1, capacity - 1, -1)) + self.freeRows
+
+    def add(self, nodeid, sfIdx, bucketIdx, power, isLost, isCritical):
+        """ Store a new transmission.
+        Parameters
+        ----------
+        nodeid: int
+            ID of the node
+        sfIdx: int
+            SF index (sf - 7)
+        bucketIdx: int
+            Frequency bucket index at the BS, -1 if outside its buckets
+        power: float
+            Received power in mW
+        isLost: bool
+            Packet is already lost (e.g. below sensitivity)
+        isCritical: bool
+            Packet is in its critical section
+        Returns
+        row: int
+            Row of the transmission in the table.
+        -------
+        """
+        if not self.freeRows:
+            self.grow()
+        row = self.freeRows.pop()
+        self.slots[nodeid] = row
+        self.nodeid[row] = nodeid
+        self.sfIdx[row] = sfIdx
+        self.bucketIdx[row] = bucketIdx
+        self.power[row] = power
+        self.isCritical[row] = isCritical
+        self.isLost[row] = isLost
+        self.isCollision[row] = False
+        return row
+
+    def remove(self, nodeid):
+        """ Release the row of a transmission."""
+        row = self.slots.pop(nodeid)
+        self.nodeid[row] = -1
+        self.bucketIdx[row] = -1
+        self.isCritical[row] = False
+        self.freeRows.append(row)
+        return row
+
+    def criticalInBucket(self, bucketIdx):
+        """ Rows of the critical and not yet lost transmissions in a bucket."""
+        return np.flatnonzero((self.bucketIdx == bucketIdx) & self.isCritical & ~self.isLost)
+
 class myBS():
     """ LPWAN Simulator: base station
     Base station class
@@ -27,13 +110,24 @@ class myBS():
         # packet and ack
         self.packets = {}
         self.ack = {}
-        self.packetsInBucket = {}
         self.signalLevel = {}
+        self.bucketIndex = {}
+        self.freqBuckets = list(freqSet)
+
+        # signal level of each (frequency bucket, SF): Neumaier-compensated sums of the
+        # received powers, exactly 0 when no packet is on air (see accumulate)
+        self.signal = np.zeros((len(self.freqBuckets), 6))
+        self.signalSum = np.zeros((len(self.freqBuckets), 6))
+        self.signalError = np.zeros((len(self.freqBuckets), 6))
+        self.signalCount = np.zeros((len(self.freqBuckets), 6), dtype=np.int64)
 
         self.sfSet = sfSet
-        for freq in freqSet:
-            self.packetsInBucket[freq] = {}
-            self.signalLevel[freq] = np.zeros((6,1))
+        for i, freq in enumerate(freqSet):
+            self.bucketIndex[freq] = i
+            self.signalLevel[freq] = self.signal[i].reshape((6,1)) # view
+
+        # active transmissions (the table is authoritative while a packet is on air)
+        self.table = TransmissionTable()
         
         # measurement params
         self.demodulator = set()
@@ -46,19 +140,98 @@ class myBS():
         nodeid: int
             ID of the node
         packet: packet
-            packet from node
+            packet from node (shared by its proximate BSs)
         Returns
         packets: list of packet
             List of packets at BS.
         -------
         """
-        for fbucket in packet.signalLevel.keys():
-            #print("before-" + str(self.signalLevel[fbucket]))
-            self.signalLevel[fbucket] = self.signalLevel[fbucket] + packet.signalLevel[fbucket]
-            #print("after-" + str(self.signalLevel[fbucket]))
-            self.evaluateFreqBucket(fbucket)
-            self.packetsInBucket[fbucket][nodeid] = packet
-        self.packets[nodeid] = packet
+        i = packet.bsIndex[self.bsid] # entry of the BS in the vectors of the packet
+        bucketIdx = int(packet.bucketIdx[i])
+        power = packet.powermW[i] if bucketIdx >= 0 else 0.0
+        self.table.add(nodeid, packet.sfIdx, bucketIdx, power, packet.isLost[i], packet.isCritical[i])
+        if bucketIdx >= 0:
+            self.accumulate(bucketIdx, packet.sfIdx, power, 1)
+            self.evaluateFreqBucket(bucketIdx)
+        self.packets[nodeid] = (packet, i)
+
+    def accumulate(self, bucketIdx, sfIdx, power, count):
+        """ Add (or remove) a received power to the signal level of a bucket.
+        The level is a Neumaier-compensated sum, so removing the packets does not
+        leave rounding residues, and it is reset to 0 when no packet is left.
+        Parameters
+        ----------
+        bucketIdx: int
+            Frequency bucket index
+        sfIdx: int
+            SF index (sf - 7)
+        power: float
+            Received power in mW (negative to remove a packet)
+        count: int
+            1 to add a packet, -1 to remove it
+        Returns
+        -------
+        """
+        n = self.signalCount[bucketIdx, sfIdx] + count
+        self.signalCount[bucketIdx, sfIdx] = n
+        if n == 0:
+            self.signalSum[bucketIdx, sfIdx] = self.signalError[bucketIdx, sfIdx] = self.signal[bucketIdx, sfIdx] = 0.0
+            return
+        s = float(self.signalSum[bucketIdx, sfIdx])
+        t = s + power
+        if abs(s) >= abs(power):
+            error = self.signalError[bucketIdx, sfIdx] + ((s - t) + power)
+        else:
+            error = self.signalError[bucketIdx, sfIdx] + ((power - t) + s)
+        self.signalSum[bucketIdx, sfIdx] = t
+        self.signalError[bucketIdx, sfIdx] = error
+        self.signal[bucketIdx, sfIdx] = t + error
+    
+    def addInterference(self, bucketIdx, sfIdx, power):
+        """ A background packet (see lora.background) starts in a bucket.
+        Parameters
+        ----------
+        bucketIdx: int
+            Frequency bucket index
+        sfIdx: int
+            SF index (sf - 7)
+        power: float
+            Received power in mW
+        Returns
+        -------
+        """
+        self.accumulate(bucketIdx, sfIdx, power, 1)
+        self.evaluateFreqBucket(bucketIdx)
+
+    def demodulateInterference(self, bucketIdx, sfIdx, power, key):
+        """ A background packet enters its critical section (as in makeCritical).
+        Parameters
+        ----------
+        bucketIdx: int
+            Frequency bucket index
+        sfIdx: int
+            SF index (sf - 7)
+        power: float
+            Received power in mW
+        key: tuple
+            Demodulator (freq, bw, sf) of the packet
+        Returns
+        held: bool
+            The packet is received and holds a demodulator.
+        -------
+        """
+        level = self.signal[bucketIdx]
+        lostFlag, collisionFlag = kernels.evaluateLink(power, level[sfIdx], np.dot(self.interactionMatrix[sfIdx], level), self.captureThreshold)
+        if not lostFlag and len(self.demodulator) <= self.nDemodulator and key not in self.demodulator:
+            self.demodulator.add(key)
+            return True
+        return False
+
+    def removeInterference(self, bucketIdx, sfIdx, power, key=None):
+        """ A background packet ends in a bucket (and frees its demodulator key if it holds it)."""
+        if key is not None:
+            self.demodulator.remove(key)
+        self.accumulate(bucketIdx, sfIdx, -power, -1)
     
     def resetACK(self):
         self.ack = {}
@@ -76,43 +249,35 @@ class myBS():
             ACK from BS.
         -------
         """
-        for fbucket in packet.signalLevel.keys():
-            self.evaluateFreqBucket(fbucket)
+        bucketIdx = packet.bucketIdx[packet.bsIndex[self.bsid]]
+        if bucketIdx >= 0:
+            self.evaluateFreqBucket(bucketIdx)
             self.successNo += 1
         self.ack[self.successNo] = packet
 
             
-    def evaluateFreqBucket(self, fbucket):
-        """ Packet from node enters critical section.
+    def evaluateFreqBucket(self, bucketIdx):
+        """ Evaluate all critical packets of a frequency bucket at once.
         Parameters
         ----------
-        fbucket: list
-            List of frequency buckets
+        bucketIdx: int
+            Frequency bucket index
         
         Returns
-        isLost: bools
-            Packet is lost or not.
         -------
         """
-        signalInBucket = np.dot(self.interactionMatrix, self.signalLevel[fbucket])
-        for nodeid, pkt in self.packetsInBucket[fbucket].items():
-            if not pkt.isLost and pkt.isCritical:
-                if self.captureThreshold != 0:
-                    if (1 + self.captureThreshold)*(pkt.signalLevel[fbucket][pkt.sf - 7]) < self.captureThreshold * self.signalLevel[fbucket][pkt.sf - 7]:
-                        pkt.isLost = True # CE
-                    else:
-                        if (1 + self.captureThreshold)*(pkt.signalLevel[fbucket][pkt.sf - 7]) < signalInBucket[pkt.sf - 7]:
-                            pkt.isLost = True # InterSF
-                        else:
-                            if (pkt.signalLevel[fbucket][pkt.sf - 7]) < self.signalLevel[fbucket][pkt.sf - 7]:
-                                pkt.isCollision = True # collision
-                else:
-                    if pkt.signalLevel[fbucket][pkt.sf - 7] < self.signalLevel[fbucket][pkt.sf - 7]:
-                        pkt.isLost = True # collision
-                        pkt.isCollision = True # collision
-                    else:
-                        if pkt.signalLevel[fbucket][pkt.sf - 7] < signalInBucket[pkt.sf - 7]:
-                            pkt.isLost = True # interSF
+        table = self.table
+        rows = table.criticalInBucket(bucketIdx)
+        if len(rows) == 0:
+            return
+        signal = self.signal[bucketIdx]
+        signalInBucket = np.dot(self.interactionMatrix, signal)
+        sfIdx = table.sfIdx[rows]
+        own = table.power[rows]
+        # capture effect, interSF and collision rules (see kernels.evaluateBucket)
+        lost, collision = kernels.evaluateBucket(own, signal[sfIdx], signalInBucket[sfIdx], self.captureThreshold)
+        table.isLost[rows[lost]] = True
+        table.isCollision[rows[collision]] = True
 
     def makeCritical(self, nodeid):
         """ Packet from node enters critical section.
@@ -126,18 +291,17 @@ class myBS():
             Packet is lost and/or collision and/or critical or not.
         -------
         """
-        pkt = self.packets[nodeid]
-        if not pkt.isLost:
-            if self.evaluatePacket(nodeid)[0] and len(self.demodulator) <= self.nDemodulator and (pkt.freq, pkt.bw, pkt.sf) not in self.demodulator:
+        pkt, i = self.packets[nodeid]
+        row = self.table.slots[nodeid]
+        if not self.table.isLost[row]:
+            received, clean = self.evaluatePacket(nodeid)
+            if received and len(self.demodulator) <= self.nDemodulator and (pkt.freq, pkt.bw, pkt.sf) not in self.demodulator:
                 self.demodulator.add((pkt.freq, pkt.bw, pkt.sf))
-                pkt.isCritical = True
-                if self.evaluatePacket(nodeid)[1]:
-                    pkt.isCollision = False
-                else:
-                    pkt.isCollision = True
+                self.table.isCritical[row] = True
+                self.table.isCollision[row] = not clean
             else:
-                pkt.isLost = True
-                pkt.isCritical = False
+                self.table.isLost[row] = True
+                self.table.isCritical[row] = False
                 
     def evaluatePacket(self, nodeid):
         """ Evaluate packet by consider the capture effect and inter-SF interference conditions.
@@ -151,50 +315,21 @@ class myBS():
             Packet is lost and/or collision or not.
         -------
         """
-        pkt = self.packets[nodeid]
-        if pkt.isLost:
+        table = self.table
+        row = table.slots[nodeid]
+        if table.isLost[row]:
             return False
-        else:
-            lostFlag = False
-            collisionFlag = False
-            for fbucket in pkt.signalLevel.keys():
-                # print("Receiver power from node "+str(nodeid)+" is "+ str(pkt.signalLevel[fbucket][pkt.sf - 7]))
-                # print("Total power at bs is " + str(self.signalLevel[fbucket][pkt.sf - 7]))
-                signalInBucket = np.dot(self.interactionMatrix[pkt.sf - 7].reshape(1,6), self.signalLevel[fbucket])
-                # print("Total power of signal in Frequency is " + str(signalInBucket))
-                # packet is lost of not due to capture effect and interSF collision
-                
-                # with Capture Effect
-                if self.captureThreshold !=0:
-                    # Capture effect
-                    if (1 + self.captureThreshold)*(pkt.signalLevel[fbucket][pkt.sf - 7]) < self.captureThreshold * self.signalLevel[fbucket][pkt.sf - 7]:
-                        lostFlag = True
-                        collisionFlag = True
-                        # print ("Packet from node "+ str(nodeid) +" is lost due to Capture effect!")  
-                    else:
-                        # interSF collision
-                        if (1 + self.captureThreshold)*(pkt.signalLevel[fbucket][pkt.sf - 7]) < signalInBucket:
-                            lostFlag = True
-                            # print ("Packet from node "+ str(nodeid) +" is lost due to InterSF collision!") 
-                        else:
-                            # packet received but collied
-                            if (pkt.signalLevel[fbucket][pkt.sf - 7]) < self.signalLevel[fbucket][pkt.sf - 7]:
-                                collisionFlag = True
-                                # print ("Packet from node "+ str(nodeid) +" is received but collied!")
-                
-                # without Capture effect
-                else:
-                    # packet is collision or not
-                    if pkt.signalLevel[fbucket][pkt.sf - 7] < self.signalLevel[fbucket][pkt.sf - 7]:
-                        lostFlag = True
-                        collisionFlag = True
-                        # print ("Packet from node "+ str(nodeid) +" is lost due to collision (w/o Capture Effect)")  
-                    else:
-                        # interSF collision
-                        if pkt.signalLevel[fbucket][pkt.sf - 7] < signalInBucket:
-                            lostFlag = True
-                            # print ("Packet from node "+ str(nodeid) +" is lost due to InterSF collision (w/o Capture Effect)!") 
-            return [not lostFlag, not collisionFlag]
+        lostFlag = False
+        collisionFlag = False
+        if table.bucketIdx[row] >= 0:
+            level = self.signal[table.bucketIdx[row]]
+            sfIdx = table.sfIdx[row]
+            own = table.power[row]
+            signal = level[sfIdx]
+            signalInBucket = np.dot(self.interactionMatrix[sfIdx], level)
+            # packet is lost of not due to capture effect and interSF collision (see kernels.evaluateLink)
+            lostFlag, collisionFlag = kernels.evaluateLink(own, signal, signalInBucket, self.captureThreshold)
+        return [not lostFlag, not collisionFlag]
 
     def removePacket(self, nodeid):
         """ Stop sending a packet to the base station i.e. Remove it from all relevant lists.
@@ -208,15 +343,140 @@ class myBS():
             Packet is critical and is not lost.
         -------
         """
-        pkt = self.packets[nodeid]
+        pkt, i = self.packets[nodeid]
+        row = self.table.slots[nodeid]
+        # copy the outcome back to the entry of the BS in the packet
+        isCritical = pkt.isCritical[i] = self.table.isCritical[row]
+        isLost = pkt.isLost[i] = self.table.isLost[row]
+        pkt.isCollision[i] = self.table.isCollision[row]
         # if packet was being demodulated, free the demodulator
-        if pkt.isCritical and (pkt.freq, pkt.bw, pkt.sf) in self.demodulator:
+        if isCritical and (pkt.freq, pkt.bw, pkt.sf) in self.demodulator:
             # only successfully demodulated packets i.e. Those that are critical are considered to be received
             self.demodulator.remove((pkt.freq, pkt.bw, pkt.sf))
-        for fbucket in pkt.signalLevel.keys():
-            self.signalLevel[fbucket] = self.signalLevel[fbucket] - pkt.signalLevel[fbucket]
-            # rounding problem - float 64
-            self.signalLevel[fbucket][self.signalLevel[fbucket]< 1e-27] = 0
-            foo = self.packetsInBucket[fbucket].pop(nodeid)
-        foo = self.packets.pop(nodeid)
-        return pkt.isCritical and not pkt.isLost
\ No newline at end of file
+        bucketIdx = self.table.bucketIdx[row]
+        if bucketIdx >= 0:
+            self.accumulate(bucketIdx, pkt.sfIdx, -self.table.power[row], -1)
+        self.table.remove(nodeid)
+        self.packets.pop(nodeid)
+        return bool(isCritical and not isLost)
+
+class ArrivalLog():
+    """ LPWAN Simulator: signal levels of a frequency bucket
+    Signal level of a frequency bucket just after each arrival, kept while
+    critical packets of the bucket may read it. Entries are appended only if
+    a packet reads them and the entries read by none are dropped when the
+    log is full.
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] capacity: initial number of entries
+
+    """
+    def __init__(self, capacity=64):
+        self.levels = np.zeros((capacity, 6))
+        self.base = 0 # index of the first stored entry since the start
+        self.size = 0
+        self.readers = {} # nodeid -> index of the first entry read by the packet
+
+    def append(self, level):
+        """ Log the signal level after an arrival (if a packet reads it)."""
+        if not self.readers:
+            return
+        if self.size == len(self.levels):
+            self.compact()
+        self.levels[self.size] = level
+        self.size += 1
+
+    def mark(self, nodeid):
+        """ The packet of the node reads the entries from now on."""
+        self.readers[nodeid] = self.base + self.size
+
+    def read(self, nodeid):
+        """ Entries logged since the mark of the packet of the node."""
+        start = self.readers.pop(nodeid) - self.base
+        return self.levels[start:self.size]
+
+    def compact(self):
+        """ Drop the entries read by no packet, double the capacity if still full."""
+        first = min(self.readers.values()) - self.base
+        keep = self.size - first
+        levels = self.levels if 2*keep <= len(self.levels) else np.zeros((2*len(self.levels), 6))
+        levels[:keep] = self.levels[first:self.size]
+        self.levels = levels
+        self.base += first
+        self.size = keep
+
+class myLazyBS(myBS):
+    """ LPWAN Simulator: base station with lazy interference evaluation
+    Same reception rules as myBS, but a critical packet is evaluated only
+    once, when it is removed. Arrivals only log the signal level of their
+    bucket (see ArrivalLog); the level only grows at arrivals, so the worst
+    interference seen by a packet is the largest of the levels at the start
+    of its critical section and after each arrival until its end.
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] bsid: id of the base station
+    \param [IN] position: position of the base station in format [x y]
+    \param [IN] interactionMatrix: interaction matrix for a pair of SF
+    \param [IN] nDemodulator: number of demodulators for each BS
+
+    """
+    def __init__(self, bsid, position, interactionMatrix, nDemodulator, ackLength, freqSet, sfSet, captureThreshold):
+        super().__init__(bsid, position, interactionMatrix, nDemodulator, ackLength, freqSet, sfSet, captureThreshold)
+        self.logs = [ArrivalLog() for freq in self.freqBuckets]
+
+    def addPacket(self, nodeid, packet):
+        """ Send a packet to the base station (log the new signal level of its bucket)."""
+        i = packet.bsIndex[self.bsid] # entry of the BS in the vectors of the packet
+        bucketIdx = int(packet.bucketIdx[i])
+        power = packet.powermW[i] if bucketIdx >= 0 else 0.0
+        self.table.add(nodeid, packet.sfIdx, bucketIdx, power, packet.isLost[i], packet.isCritical[i])
+        if bucketIdx >= 0:
+            self.accumulate(bucketIdx, packet.sfIdx, power, 1)
+            self.logs[bucketIdx].append(self.signal[bucketIdx])
+        self.packets[nodeid] = (packet, i)
+
+    def addInterference(self, bucketIdx, sfIdx, power):
+        """ A background packet starts in a bucket (log the new signal level of the bucket)."""
+        self.accumulate(bucketIdx, sfIdx, power, 1)
+        self.logs[bucketIdx].append(self.signal[bucketIdx])
+
+    def addACK(self, nodeid, packet):
+        """ Send an ACK to the node."""
+        if packet.bucketIdx[packet.bsIndex[self.bsid]] >= 0:
+            self.successNo += 1
+        self.ack[self.successNo] = packet
+
+    def makeCritical(self, nodeid):
+        """ Packet from node enters critical section (and reads the log of its bucket)."""
+        super().makeCritical(nodeid)
+        row = self.table.slots[nodeid]
+        if self.table.isCritical[row] and not self.table.isLost[row] and self.table.bucketIdx[row] >= 0:
+            self.logs[self.table.bucketIdx[row]].mark(nodeid)
+
+    def removePacket(self, nodeid):
+        """ Evaluate the packet against the worst interference of its critical section and remove it."""
+        table = self.table
+        row = table.slots[nodeid]
+        bucketIdx = table.bucketIdx[row]
+        if bucketIdx >= 0 and nodeid in self.logs[bucketIdx].readers:
+            levels = self.logs[bucketIdx].read(nodeid)
+            if len(levels):
+                sfIdx = table.sfIdx[row]
+                own = table.power[row]
+                signal = levels[:, sfIdx].max()
+                signalInBucket = np.dot(levels, self.interactionMatrix[sfIdx]).max()
+                if self.captureThreshold != 0:
+                    ce = (1 + self.captureThreshold)*own < self.captureThreshold * signal # CE
+                    interSF = not ce and (1 + self.captureThreshold)*own < signalInBucket # InterSF
+                    collision = not ce and not interSF and own < signal # collision
+                    lost = ce or interSF
+                else:
+                    collision = own < signal # collision
+                    lost = collision or own < signalInBucket # interSF
+                table.isLost[row] |= lost
+                table.isCollision[row] |= collision
+        return super().removePacket(nodeid)
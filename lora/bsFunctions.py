@@ -4,17 +4,188 @@ Utilities (:mod:`lora.bsFunctions`)
 ============================================
 .. autosummary::
    :toctree: generated/
+   startTransmission        -- Start a packet at all BSs in range.
+   enterCritical            -- Make the packet critical at all BSs in range.
+   releasePacket            -- Remove the packet from a BS and send the ACK.
+   completeTransmission     -- Update the node after a packet.
+   sendPacket               -- Send one packet (SimPy sub-process).
    transmitPacket           -- Transmission process with discret event simulation.
+   appendLine               -- Append a line to a result file.
    cuckooClock              -- Notify the simulation time (for each 1k hours).
-   saveProb                 -- Save the probability profile of each node.
+   writeProb, writeRatio, writeEnergy, writeTraffic -- One checkpoint of each result.
+   writeResults             -- One checkpoint of all the results.
+   saveResults              -- Save all the results with a single process.
 """    
 import os
-import random
 import numpy as np
 from os.path import join
-from .loratools import airtime, dBmTomW
+from .loratools import airtime, packetEnergy
 # Transmit
-def transmitPacket(env, node, bsDict, logDistParams, algo):
+def startTransmission(node, bsDict, logDistParams, stats=None, airtimes=None):
+    """ Start a new packet from node to all BSs in the list.
+    Parameters
+    ----------
+    node: my Node
+        LoRa node.
+    bsDict: dict
+        list of BSs.
+    logDistParams: list
+        channel params
+    stats: NetworkStats
+        network statistics to update (see lora.stats)
+    airtimes: AirtimeTable
+        durations of the packets (see lora.timing)
+    Returns
+    -------
+    Tcritical: float
+        Time until the start of the critical section.
+    """
+    # update settings if any
+    node.updateTXSettings()
+    node.resetACK()
+    node.packetNumber += 1
+    packet = node.packet
+    old = (packet.sf, packet.freq)
+
+    # draw the action once and send the packet to each base-station in range and those we may affect
+    packet.updateTXSettings(bsDict, logDistParams, node.prob, node.drawAction())
+    for bsid in packet.bsids:
+        bsDict[bsid].addPacket(node.nodeid, packet)
+        bsDict[bsid].resetACK()
+
+    if stats is not None:
+        stats.moveNode(old, (packet.sf, packet.freq))
+    if airtimes is not None:
+        return airtimes.lookup(node.packet.sf, node.packet.bw)[0]
+    return (2**node.packet.sf/node.packet.bw)*(node.packet.preambleLength - 5) # time until the start of the critical section
+
+def enterCritical(node, bsDict, Tcritical, airtimes=None):
+    """ Make the packet critical on all nearby basestations.
+    Parameters
+    ----------
+    node: my Node
+        LoRa node.
+    bsDict: dict
+        list of BSs.
+    Tcritical: float
+        Time until the start of the critical section.
+    airtimes: AirtimeTable
+        durations of the packets (see lora.timing)
+    Returns
+    -------
+    Trest: float
+        Time until the rest of the message completes.
+    """
+    for bsid in node.proximateBS.keys():
+        bsDict[bsid].makeCritical(node.nodeid)
+
+    if airtimes is not None:
+        return airtimes.lookup(node.packet.sf, node.packet.bw)[1] - Tcritical
+    return airtime((node.packet.sf, node.packet.rdd, node.packet.bw, node.packet.packetLength, node.packet.preambleLength, node.packet.syncLength, node.packet.headerEnable, node.packet.crc)) - Tcritical # time until the rest of the message completes
+
+def releasePacket(node, bsDict, bsid, airtimes=None):
+    """ Remove the packet from a BS and send the ACK if it was received.
+    Parameters
+    ----------
+    node: my Node
+        LoRa node.
+    bsDict: dict
+        list of BSs.
+    bsid: int
+        id of the BS
+    airtimes: AirtimeTable
+        durations of the packets (see lora.timing)
+    Returns
+    -------
+    ACKrest: float
+        Time until the ACK completes, None if the packet is not received.
+    """
+    if bsDict[bsid].removePacket(node.nodeid):
+        bsDict[bsid].addACK(node.nodeid, node.packet)
+        if airtimes is not None:
+            return airtimes.lookup(node.packet.sf, node.packet.bw)[1] # time until the ACK completes
+        return airtime((node.packet.sf, node.packet.rdd, node.packet.bw, node.packet.packetLength, node.packet.preambleLength, node.packet.syncLength, node.packet.headerEnable, node.packet.crc))# time until the ACK completes
+    return None
+
+def completeTransmission(node, algo, successfulRx, stats=None):
+    """ Update the counters and the probability of the node after a packet.
+    Parameters
+    ----------
+    node: my Node
+        LoRa node.
+    algo: string
+        learning algorithm
+    successfulRx: bool
+        At least one BS received the packet.
+    stats: NetworkStats
+        network statistics to update (see lora.stats)
+    Returns
+    -------
+    """
+    nRecvd = node.packetsSuccessful
+    energy = packetEnergy(node.packet.rectime, node.packet.pTX)
+    node.packetsTransmitted += 1
+    node.energy += energy
+    if successfulRx:
+        if node.info_mode in ["NO", "PARTIAL"]:
+            node.packetsSuccessful += 1
+            node.transmitTime += node.packet.rectime
+        elif node.info_mode == "FULL":
+            if not node.ack[0].collisionAt(0):
+                node.packetsSuccessful += 1
+                node.transmitTime += node.packet.rectime
+        node.updateProb(algo)
+    if stats is not None:
+        stats.addPacket(energy, node.packetsSuccessful - nRecvd)
+
+def sendPacket(env, node, bsDict, logDistParams, algo, stats=None, airtimes=None):
+    """ Send one packet from node to all BSs in the list (SimPy sub-process).
+    Parameters
+    ----------
+    env : simpy environement
+        Simulation environment.
+    node: my Node
+        LoRa node.
+    bsDict: dict
+        list of BSs.
+    logDistParams: list
+        channel params
+    algo: string
+        learning algorithm
+    stats: NetworkStats
+        network statistics to update (see lora.stats)
+    airtimes: AirtimeTable
+        durations of the packets (see lora.timing)
+    Returns
+    -------
+    rest: float
+        Time until the next period of the node.
+    """
+    # wait until critical section starts
+    Tcritical = startTransmission(node, bsDict, logDistParams, stats, airtimes)
+    yield env.timeout(Tcritical)
+    
+    # make the packet critical on all nearby basestations
+    Trest = enterCritical(node, bsDict, Tcritical, airtimes)
+    yield env.timeout(Trest)
+    
+    successfulRx = False
+    ACKrest = 0
+    
+    # transmit ACK
+    for bsid in node.proximateBS.keys():
+        ACK = releasePacket(node, bsDict, bsid, airtimes)
+        if ACK is not None:
+            ACKrest = ACK
+            yield env.timeout(ACKrest)
+            node.addACK(bsDict[bsid].bsid, node.packet)
+            successfulRx = True
+            
+    # update probability        
+    completeTransmission(node, algo, successfulRx, stats)
+    return float(node.period)-Tcritical-Trest-ACKrest
+
+def transmitPacket(env, node, bsDict, logDistParams, algo, stats=None, airtimes=None):
     """ Transmit a packet from node to all BSs in the list.
     Parameters
     ----------
@@ -28,73 +199,39 @@ def transmitPacket(env, node, bsDict, logDistParams, algo):
         channel params
     algo: string
         learning algorithm
+    stats: NetworkStats
+        network statistics to update (see lora.stats)
+    airtimes: AirtimeTable
+        durations of the packets (see lora.timing)
     Returns
     -------
     """
     while True:
         # The inter-packet waiting time. Assumed to be exponential here.
-        yield env.timeout(random.expovariate(1/float(node.period)))
-        
-        # update settings if any
-        node.updateTXSettings()
-        node.resetACK()
-        node.packetNumber += 1
+        yield env.timeout(node.interArrival())
         
-        # send a virtual packet to each base-station in range and those we may affect
-        for bsid, dist in node.proximateBS.items():
-            prob_temp = [node.prob[x] for x in node.prob]
-            node.packets[bsid].updateTXSettings(bsDict, logDistParams, prob_temp)
-            bsDict[bsid].addPacket(node.nodeid, node.packets[bsid])
-            bsDict[bsid].resetACK()
-        
-        # print("Start transmitting packet at t= {}".format(int(1+env.now/(node.period))) + " from node {}".format(node.nodeid))
-        # print(node.prob)
-        # print(node.weight)
-        # for pkid in bsDict[bsid].packets.keys():    
-        #     print(pkid, bsDict[bsid].packets[pkid].sf, bsDict[bsid].packets[pkid].freq, bsDict[bsid].packets[pkid].pTX)                   
-        
-        # wait until critical section starts
-        Tcritical = (2**node.packets[0].sf/node.packets[0].bw)*(node.packets[0].preambleLength - 5) # time until the start of the critical section
-        yield env.timeout(Tcritical)
-        
-        # make the packet critical on all nearby basestations
-        for bsid in node.proximateBS.keys():
-            bsDict[bsid].makeCritical(node.nodeid)
-            
-        Trest = airtime((node.packets[0].sf, node.packets[0].rdd, node.packets[0].bw, node.packets[0].packetLength, node.packets[0].preambleLength, node.packets[0].syncLength, node.packets[0].headerEnable, node.packets[0].crc)) - Tcritical # time until the rest of the message completes
-        yield env.timeout(Trest)
-        
-        successfulRx = False
-        ACKrest = 0
-        
-        # transmit ACK
-        for bsid in node.proximateBS.keys():
-            #print("=====> eval bs {}".format(bsid))
-            if bsDict[bsid].removePacket(node.nodeid):
-                bsDict[bsid].addACK(node.nodeid, node.packets[bsid])
-                ACKrest = airtime((node.packets[0].sf, node.packets[0].rdd, node.packets[0].bw, node.packets[0].packetLength, node.packets[0].preambleLength, node.packets[0].syncLength, node.packets[0].headerEnable, node.packets[0].crc))# time until the ACK completes
-                yield env.timeout(ACKrest)
-                node.addACK(bsDict[bsid].bsid, node.packets[bsid])
-                successfulRx = True
-                
-        # update probability        
-        node.packetsTransmitted += 1
-        node.energy += node.packets[0].rectime * dBmTomW(node.packets[0].pTX) * (3.0) /1e6 # V = 3.0     # voltage XXX
-        if successfulRx:
-            if node.info_mode in ["NO", "PARTIAL"]:
-                node.packetsSuccessful += 1
-                node.transmitTime += node.packets[0].rectime
-            elif node.info_mode == "FULL": 
-                if not node.ack[0].isCollision:
-                    node.packetsSuccessful += 1
-                    node.transmitTime += node.packets[0].rectime
-            node.updateProb(algo)
-        #print("Probability of action from node " +str(node.nodeid)+ " at (t+1)= {}".format(int(1+env.now/(6*60*1000))))
-        #print(node.prob)
-        #print(node.weight)
+        rest = yield from sendPacket(env, node, bsDict, logDistParams, algo, stats, airtimes)
         # wait to next period
-        yield env.timeout(float(node.period)-Tcritical-Trest-ACKrest)
-        #input()
+        yield env.timeout(rest)
+
+def appendLine(filename, line):
+    """ Append a line to a result file (no newline at the end of the file).
+    Parameters
+    ----------
+    filename: string
+        file name
+    line: string
+        line to append
+    Returns
+    -------
+    """
+    if os.path.isfile(filename):
+        res = "\n" + line
+    else:
+        res = line
+    with open(filename, "a") as myfile:
+        myfile.write(res)
+    myfile.close()
 
 def cuckooClock(env):
     """ Notifies the simulation time.
@@ -109,105 +246,95 @@ def cuckooClock(env):
         yield env.timeout(1000 * 3600000)
         print("Running {} kHrs".format(env.now/(1000 * 3600000)))
 
-def saveProb(env, nodeDict, fname, simu_dir):
+def writeProb(nodeDict, fname, simu_dir, sink=None):
     """ Save probabilities every to file
     Parameters
     ----------
-    env : simpy environement
-        Simulation environment.
     nodeDict:dict
         list of nodes.
     fname: string
         file name structure
     simu_dir: string
         folder
+    sink: MetricsSink
+        buffer the values instead of appending to the CSV files (see lora.metrics)
     Returns
     -------
     """
-    while True:
-        yield env.timeout(100 * 3600000)
-        # write prob to file
-        for nodeid in nodeDict.keys():
-             if nodeDict[nodeid].node_mode != "UNIFORM":
-                filename = join(simu_dir, str('prob_'+ fname) + '_id_' + str(nodeid) + '.csv')
-                save = str(list(nodeDict[nodeid].prob.values()))[1:-1]
-                if os.path.isfile(filename):
-                    res = "\n" + save
-                else:
-                    res = save
-                with open(filename, "a") as myfile:
-                    myfile.write(res)
-                myfile.close()
-
-def saveRatio(env, nodeDict, fname, simu_dir):
+    if sink is not None:
+        sink.addProb(nodeDict)
+        return
+    # write prob to file
+    for nodeid in nodeDict.keys():
+         if nodeDict[nodeid].node_mode != "UNIFORM":
+            filename = join(simu_dir, str('prob_'+ fname) + '_id_' + str(nodeid) + '.csv')
+            appendLine(filename, str(nodeDict[nodeid].prob.tolist())[1:-1])
+
+def writeRatio(nodeDict, fname, simu_dir, sink=None, stats=None):
     """ Save packet reception ratio to file
     Parameters
     ----------
-    env : simpy environement
-        Simulation environment.
     nodeDict:dict
         list of nodes.
     fname: string
         file name structure
     simu_dir: string
         folder
+    sink: MetricsSink
+        buffer the values instead of appending to the CSV files (see lora.metrics)
+    stats: NetworkStats
+        read the totals instead of summing over the nodes (see lora.stats)
     Returns
     -------
     """
-    while True:
-        yield env.timeout(100 * 3600000)
-        # write packet reception ratio to file
-        nTransmitted = 0
-        nRecvd = 0
-        PacketReceptionRatio = 0
+    # write packet reception ratio to file
+    nTransmitted = 0
+    nRecvd = 0
+    PacketReceptionRatio = 0
+    if stats is not None:
+        nTransmitted, nRecvd = stats.transmitted, stats.received
+    else:
         nTransmitted = sum(nodeDict[nodeid].packetsTransmitted for nodeid in nodeDict.keys())
         nRecvd = sum(nodeDict[nodeid].packetsSuccessful for nodeid in nodeDict.keys())
-        PacketReceptionRatio = nRecvd/nTransmitted
-        filename = join(simu_dir, str('ratio_'+ fname) + '.csv')
-        if os.path.isfile(filename):
-            res = "\n" + str(PacketReceptionRatio)
-        else:
-            res = str(PacketReceptionRatio)
-        with open(filename, "a") as myfile:
-            myfile.write(res)
-        myfile.close()
-
-def saveEnergy(env, nodeDict, fname, simu_dir):
+    PacketReceptionRatio = nRecvd/nTransmitted
+    if sink is not None:
+        sink.add(ratio=PacketReceptionRatio)
+        return
+    appendLine(join(simu_dir, str('ratio_'+ fname) + '.csv'), str(PacketReceptionRatio))
+
+def writeEnergy(nodeDict, fname, simu_dir, sink=None, stats=None):
     """ Save energy to file
     Parameters
     ----------
-    env : simpy environement
-        Simulation environment.
     nodeDict:dict
         list of nodes.
     fname: string
         file name structure
     simu_dir: string
         folder
+    sink: MetricsSink
+        buffer the values instead of appending to the CSV files (see lora.metrics)
+    stats: NetworkStats
+        read the totals instead of summing over the nodes (see lora.stats)
     Returns
     -------
     """
-    while True:
-        yield env.timeout(100 * 3600000)
-        # compute and wirte energy consumption to file
+    # compute and wirte energy consumption to file
+    if stats is not None:
+        totalEnergy, nTransmitted, nRecvd = stats.energy, stats.transmitted, stats.received
+    else:
         totalEnergy = sum(nodeDict[nodeid].energy for nodeid in nodeDict.keys())
         nTransmitted = sum(nodeDict[nodeid].packetsTransmitted for nodeid in nodeDict.keys())
         nRecvd = sum(nodeDict[nodeid].packetsSuccessful for nodeid in nodeDict.keys())
-        filename = join(simu_dir, str('energy_'+ fname) + '.csv')
-        if os.path.isfile(filename):
-            res = "\n" + str(totalEnergy) + " " + str(nTransmitted) + " " + str(nRecvd)
-        else:
-            res = str(totalEnergy) + " " + str(nTransmitted) + " " + str(nRecvd)
-        with open(filename, "a") as myfile:
-            myfile.write(res)
-        myfile.close()
-
-def saveTraffic(env, nodeDict, fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e):
+    if sink is not None:
+        sink.add(energy=totalEnergy, transmitted=nTransmitted, received=nRecvd)
+        return
+    appendLine(join(simu_dir, str('energy_'+ fname) + '.csv'), str(totalEnergy) + " " + str(nTransmitted) + " " + str(nRecvd))
+
+def writeTraffic(nodeDict, fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e, sink=None, stats=None):
     """ Save norm traffic and throughput to file
     Parameters
     ----------
-    env : simpy environement
-        Simulation environment.
     nodeDict:dict
         list of nodes.
     fname: string
@@ -218,36 +345,90 @@ def saveTraffic(env, nodeDict, fname, simu_dir, sfSet, freqSet, lambda_i, lambda
         set of possible sf
     freqSet: list
         set of possible freq
+    sink: MetricsSink
+        buffer the values instead of appending to the CSV files (see lora.metrics)
+    stats: NetworkStats
+        read the (SF, channel) occupancy instead of scanning the nodes (see lora.stats)
     Returns
     -------
     """
-    while True:
-        yield env.timeout(100 * 3600000)
-        # compute and wirte traffic and throughtput to file
-        # total_Ts = sum(nodeDict[nodeid].transmitTime for nodeid in nodeDict.keys())
+    # compute and wirte traffic and throughtput to file
+    # total_Ts = sum(nodeDict[nodeid].transmitTime for nodeid in nodeDict.keys())
+    if stats is not None:
+        Gsc, Tsc = stats.traffic(lambda_i, lambda_e)
+    else:
         Gsc = np.zeros((len(sfSet),len(freqSet)))
         Tsc = np.zeros((len(sfSet),len(freqSet)))
         Gsc += lambda_e
 
         for nodeid in nodeDict.keys():
-            if nodeDict[nodeid].packets[0].sf != None:
-                if nodeDict[nodeid].packets[0].freq != None:
-                    si = sfSet.index(nodeDict[nodeid].packets[0].sf) 
-                    ci = freqSet.index((nodeDict[nodeid].packets[0].freq))
+            if nodeDict[nodeid].packet.sf != None:
+                if nodeDict[nodeid].packet.freq != None:
+                    si = sfSet.index(nodeDict[nodeid].packet.sf) 
+                    ci = freqSet.index((nodeDict[nodeid].packet.freq))
                     Gsc[si, ci] += lambda_i
-        
+
         for i in range(len(sfSet)):
-            Gsc[i, :] *= airtime((sfSet[i], nodeDict[0].packets[0].rdd, nodeDict[0].packets[0].bw, nodeDict[0].packets[0].packetLength, nodeDict[0].packets[0].preambleLength, nodeDict[0].packets[0].syncLength, nodeDict[0].packets[0].headerEnable, nodeDict[0].packets[0].crc))
+            Gsc[i, :] *= airtime((sfSet[i], nodeDict[0].packet.rdd, nodeDict[0].packet.bw, nodeDict[0].packet.packetLength, nodeDict[0].packet.preambleLength, nodeDict[0].packet.syncLength, nodeDict[0].packet.headerEnable, nodeDict[0].packet.crc))
 
         for i in range(len(sfSet)):
             for j in range(len(freqSet)):
                 Tsc[i][j] = Gsc[i][j] * np.exp(-2* Gsc[i][j]) 
 
-        filename = join(simu_dir, str('traffic_'+ fname) + '.csv')
-        if os.path.isfile(filename):
-            res = "\n" + str(sum(sum(Gsc))) + " " + str(sum(sum(Tsc)))
-        else:
-            res = str(sum(sum(Gsc))) + " " + str(sum(sum(Tsc)))
-        with open(filename, "a") as myfile:
-            myfile.write(res)
-        myfile.close()
\ No newline at end of file
+    if sink is not None:
+        sink.add(traffic=[sum(sum(Gsc)), sum(sum(Tsc))])
+        return
+    appendLine(join(simu_dir, str('traffic_'+ fname) + '.csv'), str(sum(sum(Gsc))) + " " + str(sum(sum(Tsc))))
+
+def writeResults(nodeDict, fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e, sink=None, stats=None):
+    """ Save probabilities, ratio, energy and traffic (one checkpoint)
+    Parameters
+    ----------
+    nodeDict:dict
+        list of nodes.
+    fname: string
+        file name structure
+    simu_dir: string
+        folder
+    sfSet: list
+        set of possible sf
+    freqSet: list
+        set of possible freq
+    sink: MetricsSink
+        buffer the values instead of appending to the CSV files (see lora.metrics)
+    stats: NetworkStats
+        network statistics (see lora.stats)
+    Returns
+    -------
+    """
+    writeProb(nodeDict, fname, simu_dir, sink)
+    writeRatio(nodeDict, fname, simu_dir, sink, stats)
+    writeEnergy(nodeDict, fname, simu_dir, sink, stats)
+    writeTraffic(nodeDict, fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e, sink, stats)
+
+def saveResults(env, nodeDict, fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e, sink=None, stats=None):
+    """ Save probabilities, ratio, energy and traffic every 100 hours (one timer for all the results)
+    Parameters
+    ----------
+    env : simpy environement
+        Simulation environment.
+    nodeDict:dict
+        list of nodes.
+    fname: string
+        file name structure
+    simu_dir: string
+        folder
+    sfSet: list
+        set of possible sf
+    freqSet: list
+        set of possible freq
+    sink: MetricsSink
+        buffer the values instead of appending to the CSV files (see lora.metrics)
+    stats: NetworkStats
+        network statistics (see lora.stats)
+    Returns
+    -------
+    """
+    while True:
+        yield env.timeout(100 * 3600000)
+        writeResults(nodeDict, fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e, sink, stats)
@@ -0,0 +1,284 @@
+""" LPWAN Simulator: numeric kernels
+============================================
+Utilities (:mod:`lora.kernels`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   useKernels               -- Select the NumPy or the Numba kernels.
+   evaluateBucket           -- Capture-effect and inter-SF rules for the critical packets of a bucket.
+   evaluateLink             -- Capture-effect and inter-SF rules for one packet.
+   exp3RowUpdate            -- EXP3 weight update of one node.
+   exp3sRowUpdate           -- EXP3.S weight update of one node.
+   exp3RowProb              -- Probabilities of one node from its weights.
+   rxPower                  -- Received power (log-distance model).
+   packetAirtime            -- Airtime of a packet.
+
+The small loop-shaped computations of the simulation work on plain arrays
+and scalars. Each kernel exists in two versions: the NumPy one is the
+reference (same operations, in the same order, as myBS, myNode.updateProb
+and loratools) and the Numba one is compiled with @njit. Sums are taken
+from left to right in both versions so that they give the same bits. The Numba kernels
+are selected at import time when Numba is installed; useKernels("numpy")
+or useKernels("numba") switches all of them at once, e.g. to compare the
+run times. Callers read the kernels as attributes of this module
+(kernels.evaluateBucket(...)) so that they follow the switch.
+"""
+import numpy as np
+from . import loratools
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+__all__ = ['useKernels', 'evaluateBucket', 'evaluateLink', 'exp3RowUpdate', 'exp3sRowUpdate', 'exp3RowProb',
+           'rxPower', 'packetAirtime', 'BACKEND']
+
+# NumPy kernels
+
+def evaluateBucketNumpy(own, signal, inter, captureThreshold):
+    """ Capture-effect and inter-SF rules of myBS.evaluateFreqBucket.
+    Parameters
+    ----------
+    own : 1D ndarray of floats
+        Received power of each packet in mW.
+    signal, inter : 1D ndarray of floats
+        Total power at the SF of each packet and inter-SF power.
+    captureThreshold: float
+        Capture threshold (0 without capture effect).
+    Returns
+    -------
+    lost, collision: 1D ndarray of bools
+        The packet is lost, the packet collided.
+    """
+    if captureThreshold != 0:
+        ce = (1 + captureThreshold)*own < captureThreshold * signal # CE
+        interSF = ~ce & ((1 + captureThreshold)*own < inter) # InterSF
+        collision = ~ce & ~interSF & (own < signal) # collision
+        return ce | interSF, collision
+    collision = own < signal # collision
+    interSF = ~collision & (own < inter) # interSF
+    return collision | interSF, collision
+
+def evaluateLinkNumpy(own, signal, inter, captureThreshold):
+    """ Capture-effect and inter-SF rules of myBS.evaluatePacket.
+    Parameters
+    ----------
+    own, signal, inter : float
+        Received power of the packet, total power at its SF and inter-SF power (mW).
+    captureThreshold: float
+        Capture threshold (0 without capture effect).
+    Returns
+    -------
+    lostFlag, collisionFlag: bool
+    """
+    lostFlag = False
+    collisionFlag = False
+    # with Capture Effect
+    if captureThreshold != 0:
+        if (1 + captureThreshold)*own < captureThreshold * signal:
+            lostFlag = True
+            collisionFlag = True
+        elif (1 + captureThreshold)*own < inter:
+            lostFlag = True
+        elif own < signal:
+            collisionFlag = True
+    # without Capture effect
+    else:
+        if own < signal:
+            lostFlag = True
+            collisionFlag = True
+        elif own < inter:
+            lostFlag = True
+    return lostFlag, collisionFlag
+
+def exp3RowUpdateNumpy(logWeight, row, K, action, reward, learningRate):
+    """ EXP3 weight update of one node (see learning.exp3Update).
+    Parameters
+    ----------
+    logWeight : 2D ndarray of floats
+        Log-weights of the population, updated in place.
+    row, K, action: int
+        Row of the node, number of actions and chosen action.
+    reward, learningRate: float
+        Estimated reward of the action and learning rate of the node.
+    Returns
+    -------
+    """
+    logWeight[row, action] += (learningRate * float(reward))/K
+    logWeight[row] -= np.max(logWeight[row])
+
+def exp3sRowUpdateNumpy(logWeight, row, K, action, reward, learningRate, alpha):
+    """ EXP3.S weight update of one node (see learning.exp3sUpdate).
+    Parameters
+    ----------
+    logWeight : 2D ndarray of floats
+        Log-weights of the population, updated in place.
+    row, K, action: int
+        Row of the node, number of actions and chosen action.
+    reward, learningRate, alpha: float
+        Estimated reward of the action, learning rate and weight sharing parameter of the node.
+    Returns
+    -------
+    """
+    logW = logWeight[row].copy()
+    logSum = np.logaddexp.reduce(logW)
+    logW[action] += (learningRate * float(reward))/K
+    with np.errstate(divide='ignore'):
+        logShare = np.log(np.exp(1) * alpha / K) + logSum
+    logW = np.logaddexp(logW, logShare)
+    logW[K:] = -np.inf
+    logWeight[row] = logW - np.max(logW)
+
+def exp3RowProbNumpy(logWeight, row, K, learningRate):
+    """ Probabilities of one node (see learning.exp3Prob).
+    Parameters
+    ----------
+    logWeight : 2D ndarray of floats
+        Log-weights of the population.
+    row, K: int
+        Row and number of actions of the node.
+    learningRate: float
+        Learning rate of the node.
+    Returns
+    -------
+    prob : 1D ndarray of floats
+        Probabilities of the K actions.
+    """
+    weight = np.exp(logWeight[row])
+    total = np.cumsum(weight)[-1] # left to right as the Numba loop (np.sum is pairwise)
+    prob = (1 - learningRate) * weight/total + learningRate/K
+    return prob[:K]
+
+def rxPowerNumpy(pTX, distance, gamma, Lpld0, d0):
+    """ Received power in dBm (see loratools.getRXPower)."""
+    return loratools.getRXPower(pTX, distance, (gamma, Lpld0, d0))
+
+def packetAirtimeNumpy(sf, rdd, bw, packetLength, preambleLength, syncLength, headerEnable, crc):
+    """ Airtime of a packet in ms (see loratools.airtime)."""
+    return loratools.airtime((sf, rdd, bw, packetLength, preambleLength, syncLength, headerEnable, crc))
+
+NUMPY_KERNELS = {'evaluateBucket': evaluateBucketNumpy, 'evaluateLink': evaluateLinkNumpy,
+                 'exp3RowUpdate': exp3RowUpdateNumpy, 'exp3sRowUpdate': exp3sRowUpdateNumpy,
+                 'exp3RowProb': exp3RowProbNumpy, 'rxPower': rxPowerNumpy, 'packetAirtime': packetAirtimeNumpy}
+
+# Numba kernels (same operations as the NumPy ones, written as loops)
+
+if njit is not None:
+    @njit(cache=True)
+    def evaluateBucketNumba(own, signal, inter, captureThreshold):
+        n = len(own)
+        lost = np.zeros(n, dtype=np.bool_)
+        collision = np.zeros(n, dtype=np.bool_)
+        for i in range(n):
+            if captureThreshold != 0:
+                if (1 + captureThreshold)*own[i] < captureThreshold * signal[i]:
+                    lost[i] = True
+                elif (1 + captureThreshold)*own[i] < inter[i]:
+                    lost[i] = True
+                elif own[i] < signal[i]:
+                    collision[i] = True
+            else:
+                if own[i] < signal[i]:
+                    lost[i] = True
+                    collision[i] = True
+                elif own[i] < inter[i]:
+                    lost[i] = True
+        return lost, collision
+
+    @njit(cache=True)
+    def evaluateLinkNumba(own, signal, inter, captureThreshold):
+        lostFlag = False
+        collisionFlag = False
+        if captureThreshold != 0:
+            if (1 + captureThreshold)*own < captureThreshold * signal:
+                lostFlag = True
+                collisionFlag = True
+            elif (1 + captureThreshold)*own < inter:
+                lostFlag = True
+            elif own < signal:
+                collisionFlag = True
+        else:
+            if own < signal:
+                lostFlag = True
+                collisionFlag = True
+            elif own < inter:
+                lostFlag = True
+        return lostFlag, collisionFlag
+
+    @njit(cache=True)
+    def exp3RowUpdateNumba(logWeight, row, K, action, reward, learningRate):
+        logWeight[row, action] += (learningRate * reward)/K
+        logWeight[row] -= np.max(logWeight[row])
+
+    @njit(cache=True)
+    def exp3sRowUpdateNumba(logWeight, row, K, action, reward, learningRate, alpha):
+        width = logWeight.shape[1]
+        logSum = logWeight[row, 0]
+        for j in range(1, width):
+            logSum = np.logaddexp(logSum, logWeight[row, j])
+        logW = logWeight[row].copy()
+        logW[action] += (learningRate * reward)/K
+        share = np.exp(1) * alpha / K
+        logShare = (np.log(share) if share > 0 else -np.inf) + logSum
+        for j in range(width):
+            logW[j] = np.logaddexp(logW[j], logShare) if j < K else -np.inf
+        logWeight[row] = logW - np.max(logW)
+
+    @njit(cache=True)
+    def exp3RowProbNumba(logWeight, row, K, learningRate):
+        weight = np.exp(logWeight[row])
+        total = 0.0
+        for j in range(len(weight)):
+            total += weight[j]
+        prob = (1 - learningRate) * weight/total + learningRate/K
+        return prob[:K]
+
+    @njit(cache=True)
+    def rxPowerNumba(pTX, distance, gamma, Lpld0, d0):
+        return pTX - Lpld0 - 10.0*gamma*np.log10(distance/d0)
+
+    @njit(cache=True)
+    def packetAirtimeNumba(sf, rdd, bw, packetLength, preambleLength, syncLength, headerEnable, crc):
+        DE = 1 # low data rate optimization enabled
+        Tsym = (2.0**sf)/bw
+        Tpream = (preambleLength + syncLength)*Tsym
+        payloadSymbNB = 8 + max(np.ceil((8.0*packetLength-4.0*sf+28+16*crc-20*headerEnable)/(4.0*(sf-2*DE)))*(rdd+4), 0)
+        return Tpream + payloadSymbNB * Tsym
+
+    NUMBA_KERNELS = {'evaluateBucket': evaluateBucketNumba, 'evaluateLink': evaluateLinkNumba,
+                     'exp3RowUpdate': exp3RowUpdateNumba, 'exp3sRowUpdate': exp3sRowUpdateNumba,
+                     'exp3RowProb': exp3RowProbNumba, 'rxPower': rxPowerNumba, 'packetAirtime': packetAirtimeNumba}
+else:
+    NUMBA_KERNELS = None
+
+def useKernels(backend=None):
+    """ Select the kernels of the module.
+    Parameters
+    ----------
+    backend: string
+        "numpy", "numba" or None (Numba if it is installed).
+    Returns
+    -------
+    backend: string
+        The selected backend.
+    """
+    if backend is None:
+        backend = "numba" if NUMBA_KERNELS is not None else "numpy"
+    assert backend in ["numpy", "numba"], "Kernels must be numpy or numba."
+    if backend == "numba" and NUMBA_KERNELS is None:
+        raise ImportError("Numba is required for the numba kernels.")
+    globals().update(NUMBA_KERNELS if backend == "numba" else NUMPY_KERNELS)
+    globals()['BACKEND'] = backend
+    return backend
+
+# the NumPy kernels until useKernels() runs
+evaluateBucket = evaluateBucketNumpy
+evaluateLink = evaluateLinkNumpy
+exp3RowUpdate = exp3RowUpdateNumpy
+exp3sRowUpdate = exp3sRowUpdateNumpy
+exp3RowProb = exp3RowProbNumpy
+rxPower = rxPowerNumpy
+packetAirtime = packetAirtimeNumpy
+BACKEND = "numpy"
+useKernels()
@@ -0,0 +1,133 @@
+""" LPWAN Simulator: learning kernels
+============================================
+Utilities (:mod:`lora.learning`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   exp3Update               -- EXP3 weight update for a batch of nodes.
+   exp3sUpdate              -- EXP3.S weight update for a batch of nodes.
+   exp3Prob                 -- Probabilities of a batch of nodes from their weights.
+   pruneProb                -- Force the small probabilities to 0 and normalize.
+
+The kernels work in place on the N x K log-weight matrix of a node
+population. Each call updates a batch of (node, action, reward) triples, the
+nodes of a batch must be distinct. Rows are padded past the number of
+actions of their node (log-weight -inf, probability 0). Log-weights are
+shifted so that their maximum is 0 after every update, which keeps them
+bounded however long the simulation runs.
+"""
+import numpy as np
+
+__all__ = ['exp3Update', 'exp3sUpdate', 'exp3Prob', 'pruneProb']
+
+def actionMask(nrActions, width):
+    """ Boolean matrix of the valid actions of each node.
+    Parameters
+    ----------
+    nrActions : 1D ndarray of ints
+        Number of actions of each node.
+    width: int
+        Number of columns.
+    Returns
+    -------
+    mask : 2D ndarray of bools
+    """
+    return np.arange(width) < np.reshape(nrActions, (-1, 1))
+
+def exp3Update(logWeight, nrActions, nodes, actions, rewards, learningRate):
+    """ EXP3 weight update: w[a] *= exp(learningRate * reward / K). Costs O(K) per node.
+    Parameters
+    ----------
+    logWeight : 2D ndarray of floats
+        Log-weights of the population, updated in place.
+    nrActions : 1D ndarray of ints
+        Number of actions of each node of the population.
+    nodes : 1D ndarray of ints
+        Rows of the updated nodes.
+    actions : 1D ndarray of ints
+        Chosen action of each node.
+    rewards : 1D ndarray of floats
+        Estimated reward of the chosen action.
+    learningRate : 1D ndarray of floats
+        Learning rate of each node of the population.
+    Returns
+    -------
+    """
+    nodes = np.asarray(nodes)
+    logWeight[nodes, actions] += (learningRate[nodes] * np.asarray(rewards, dtype=float))/nrActions[nodes]
+    logWeight[nodes] -= np.max(logWeight[nodes], axis=1, keepdims=True)
+
+def exp3sUpdate(logWeight, nrActions, nodes, actions, rewards, learningRate, alpha):
+    """ EXP3.S weight update: w[j] = w[j] * exp(learningRate * reward[j] / K) + (e * alpha / K) * sum(w).
+    The sum is taken over the weights before the update. Costs O(K) per node.
+    Parameters
+    ----------
+    logWeight : 2D ndarray of floats
+        Log-weights of the population, updated in place.
+    nrActions : 1D ndarray of ints
+        Number of actions of each node of the population.
+    nodes : 1D ndarray of ints
+        Rows of the updated nodes.
+    actions : 1D ndarray of ints
+        Chosen action of each node.
+    rewards : 1D ndarray of floats
+        Estimated reward of the chosen action.
+    learningRate : 1D ndarray of floats
+        Learning rate of each node of the population.
+    alpha : 1D ndarray of floats
+        Weight sharing parameter of each node of the population.
+    Returns
+    -------
+    """
+    nodes = np.asarray(nodes)
+    K = nrActions[nodes]
+    logW = logWeight[nodes]
+    logSum = np.logaddexp.reduce(logW, axis=1)
+    logW[np.arange(len(nodes)), actions] += (learningRate[nodes] * np.asarray(rewards, dtype=float))/K
+    with np.errstate(divide='ignore'):
+        logShare = np.log(np.exp(1) * alpha[nodes] / K) + logSum
+    logW = np.logaddexp(logW, logShare[:, None])
+    logW[~actionMask(K, logW.shape[1])] = -np.inf
+    logWeight[nodes] = logW - np.max(logW, axis=1, keepdims=True)
+
+def exp3Prob(logWeight, nrActions, nodes, learningRate):
+    """ Probabilities (1 - learningRate) * w / sum(w) + learningRate / K of a batch of nodes.
+    Parameters
+    ----------
+    logWeight : 2D ndarray of floats
+        Log-weights of the population.
+    nrActions : 1D ndarray of ints
+        Number of actions of each node of the population.
+    nodes : 1D ndarray of ints
+        Rows of the nodes.
+    learningRate : 1D ndarray of floats
+        Learning rate of each node of the population.
+    Returns
+    -------
+    prob : 2D ndarray of floats
+        Probabilities, one row per node.
+    """
+    nodes = np.asarray(nodes)
+    K = nrActions[nodes]
+    lr = learningRate[nodes][:, None]
+    weight = np.exp(logWeight[nodes])
+    total = np.cumsum(weight, axis=1)[:, -1:] # left to right as kernels.exp3RowProb
+    prob = (1 - lr) * weight/total + lr/K[:, None]
+    prob[~actionMask(K, prob.shape[1])] = 0
+    return prob
+
+def pruneProb(prob, threshold=0.0005):
+    """ Trick: force the small probabilities (< threshold) to 0 and normalize each row.
+    Parameters
+    ----------
+    prob : ndarray of floats
+        Probabilities, one row per node (or a single row), modified in place.
+    threshold: float
+        Smallest kept probability.
+    Returns
+    -------
+    prob : ndarray of floats
+    """
+    prob[prob < threshold] = 0
+    prob /= np.sum(prob, axis=-1, keepdims=True)
+    return prob
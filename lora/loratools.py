@@ -17,8 +17,10 @@ Utilities (:mod:`lorawan.loratools`)
    getDistanceFromPL        -- Get distance from power lost
    getDistanceFromPower     -- Get distance from TX and RX powers
    getFreqBucketsFromSet    -- Get frequencies set
+   getAffectedFreqBuckets   -- Get the frequency buckets used by a channel
    placeRandomly            -- Place a node (bs) randomly
-   placeRandomlyInRange     -- Place randomly nodes in a range
+   placeInRings             -- Place nodes directly in the SF rings
+   packetEnergy             -- Energy spent to send a packet
    getMaxTransmitDistance   -- Get maximum transmit distance (for US)
    
 With some codes from CommPy library: http://veeresht.github.com/CommPy
@@ -28,9 +30,8 @@ and LoRaSim library: https://github.com/adwaitnd/lorasim
 
 # Import Library
 import numpy as np
-import math
 import random
-__all__ = ['dec2bitarray', 'bitarray2dec', 'dec2bitmatrix', 'hamming_dist', 'euclid_dist', 'upsample','dBmTomW', 'dBmTonW', 'getRXPower', 'getTXPower', 'getDistanceFromPL', 'getDistanceFromPower', 'getFreqBucketsFromSet', 'airtime', 'getMaxTransmitDistance']
+__all__ = ['dec2bitarray', 'bitarray2dec', 'dec2bitmatrix', 'hamming_dist', 'euclid_dist', 'upsample','dBmTomW', 'dBmTonW', 'getRXPower', 'getTXPower', 'getDistanceFromPL', 'getDistanceFromPower', 'getFreqBucketsFromSet', 'getAffectedFreqBuckets', 'airtime', 'packetEnergy', 'getMaxTransmitDistance']
 
 def dec2bitarray(in_number, bit_width):
     """
@@ -282,6 +283,27 @@ def getFreqBucketsFromSet(nbChannels):
     freqBuckets.extend(np.linspace(minfreq, maxfreq, nbChannels, dtype=int))
     return freqBuckets
 
+def getAffectedFreqBuckets(freq, bw):
+    """ Get the list of affected frequency buckets from [fc-bw/2 fc+bw/2].
+    Parameters
+    ----------
+    freq : int
+        Center frequency in kHz.
+    bw: int
+        Bandwidth in kHz.
+    Returns
+    -------
+    fRange: list
+        List of frequencies that effected by the using frequency
+    """
+    low = freq - bw/2 # Note: this is approx due to integer division for 125
+    high = freq + bw/2 # Note: this is approx due to integer division for 125
+    lowBucketStart = int(low - (low % 200) + 100)
+    highBucketEnd = int(high + 200 - (high % 200) - 100)
+
+    # the +1 ensures that the last value is included in the set
+    return range(lowBucketStart, highBucketEnd + 1, 200)
+
 def placeRandomly(number, locArray, xRange, yRange):
     """ Place location of a node (or bs) randomly
     Parameters
@@ -302,22 +324,47 @@ def placeRandomly(number, locArray, xRange, yRange):
         y = random.uniform(yRange[0], yRange[1])
         locArray[n,:] = [n, x, y]
         
+def nearestBS(points, bsLoc, chunk=65536):
+    """ Index of the nearest base station of each point.
+    Parameters
+    ----------
+    points : 2D ndarray
+        Points, one row [x y] per point.
+    bsLoc: 2D ndarray
+        Base stations, one row [x y] per BS.
+    chunk: int
+        Number of points processed at once.
+    Returns
+    -------
+    nearest: 1D ndarray of ints
+    """
+    nearest = np.zeros(len(points), dtype=np.int64)
+    for start in range(0, len(points), chunk):
+        block = points[start:start+chunk]
+        d2 = (block[:, 0:1] - bsLoc[:, 0])**2 + (block[:, 1:2] - bsLoc[:, 1])**2
+        nearest[start:start+chunk] = np.argmin(d2, axis=1)
+    return nearest
 
-def placeRandomlyInRange(number, nrIntNodes, locArray, xRange, yRange, refLoc, bestValue,
-                         radius, transmitParams, maxPtx, distribution, distMatrix):
-    """ Place node randomly in a range
+def placeInRings(number, locArray, xRange, yRange, refLoc, bestValue,
+                 radius, transmitParams, maxPtx, distribution, distMatrix):
+    """ Place nodes directly in the SF rings around the base stations.
+    The ring of SF index i is the annulus distMatrix[i-1] <= d <= min(distMatrix[i], radius)
+    around the nearest BS. The number of nodes of each ring follows the distribution
+    (largest remainder, the counts add up to number). For each ring, a BS is drawn
+    uniformly, the radius by inverse CDF and the angle uniformly; points outside the
+    range or closer to another BS are drawn again, so the nodes are uniform over the rings.
     Parameters
     ----------
     number : int
-        Number of nodes (or BSs).
-    nrIntNodes: int
-        Number of intelligent nodes
+        Number of nodes.
+    locArray: array
+        Location array (number x 14), filled in place.
     xRange: [xmin xmax]
         Range of a node in x-axis.
     yRange: [ymin ymax]
         Range of a node in y-axis.
     refLoc: array
-        Location of a BS
+        Location of the BSs
     bestValue: list
         Best Dist, bestSF, bestBW from a node to BS 
     radius: float
@@ -335,33 +382,51 @@ def placeRandomlyInRange(number, nrIntNodes, locArray, xRange, yRange, refLoc, b
     locArray: array
         Location array.
     """
-    temp = 0
-    for idx in range(len(distribution)):
-        number_nodes = int(number * distribution[idx])
-        for n in range(number_nodes):
-            while True:
-                # This could technically turn into an infinite loop but that shouldn't ever practically happen.
-                # add check here later
-                x = random.uniform(xRange[0], xRange[1])
-                y = random.uniform(yRange[0], yRange[1])
-                #print(x, y)
-                rdd, packetLength, preambleLength, syncLength, headerEnable, crc = transmitParams
-                bestDist, bestSF, bestBW = bestValue
-                if idx == 0:
-                    if np.any(np.sum(np.square(refLoc[:,1:3] - np.array([x,y]).reshape(1,2)), axis=1) <= radius**2):
-                        if np.any(np.sum(np.square(refLoc[:,1:3] - np.array([x,y]).reshape(1,2)), axis=1) <= distMatrix[idx]**2):
-                            locArray[n+temp,:] = [n+temp, x, y, bestSF, rdd, bestBW, packetLength, preambleLength, syncLength, headerEnable, crc, maxPtx, 0, 0]
-                            break
-                else:
-                    if np.any(np.sum(np.square(refLoc[:,1:3] - np.array([x,y]).reshape(1,2)), axis=1) <= radius**2):
-                        if np.any(np.sum(np.square(refLoc[:,1:3] - np.array([x,y]).reshape(1,2)), axis=1) <= distMatrix[idx]**2):
-                            if np.any(np.sum(np.square(refLoc[:,1:3] - np.array([x,y]).reshape(1,2)), axis=1) >= distMatrix[idx-1]**2):
-                                locArray[n+temp,:] = [n+temp, x, y, bestSF, rdd, bestBW, packetLength, preambleLength, syncLength, headerEnable, crc, maxPtx, 0, 0]
-                                break
-        temp += number_nodes
+    rdd, packetLength, preambleLength, syncLength, headerEnable, crc = transmitParams
+    bestDist, bestSF, bestBW = bestValue
+    bsLoc = np.asarray(refLoc[:, 1:3], dtype=float)
+
+    # number of nodes of each ring (largest remainder)
+    quota = number * np.asarray(distribution, dtype=float) / np.sum(distribution)
+    counts = np.floor(quota).astype(np.int64)
+    order = np.argsort(counts - quota, kind='stable')
+    counts[order[:number - np.sum(counts)]] += 1
+
+    start = 0
+    for idx, count in enumerate(counts):
+        if count == 0:
+            continue
+        inner = 0 if idx == 0 else distMatrix[idx-1]
+        outer = min(distMatrix[idx], radius)
+        if inner >= outer:
+            raise ValueError("No room for SF{} nodes: the ring [{}, {}] m is empty.".format(idx + 7, inner, outer))
+        points = np.zeros((0, 2))
+        draws = 0
+        while len(points) < count:
+            if draws > 1000 * count + 10**6:
+                raise ValueError("Cannot place SF{} nodes: the ring is (almost) outside the simulation area or closer to other BSs.".format(idx + 7))
+            size = max(2 * (count - len(points)), 1024)
+            draws += size
+            home = np.random.randint(len(bsLoc), size=size)
+            r = np.sqrt(np.random.uniform(inner**2, outer**2, size))
+            theta = np.random.uniform(0, 2*np.pi, size)
+            candidates = bsLoc[home] + r[:, None] * np.stack((np.cos(theta), np.sin(theta)), axis=1)
+            valid = ((candidates[:, 0] >= xRange[0]) & (candidates[:, 0] <= xRange[1]) &
+                     (candidates[:, 1] >= yRange[0]) & (candidates[:, 1] <= yRange[1]))
+            if len(bsLoc) > 1:
+                valid[valid] = nearestBS(candidates[valid], bsLoc) == home[valid]
+            points = np.concatenate((points, candidates[valid]))
+        rows = np.arange(start, start + count)
+        locArray[rows, :] = [0, 0, 0, bestSF, rdd, bestBW, packetLength, preambleLength, syncLength, headerEnable, crc, maxPtx, 0, 0]
+        locArray[rows, 0] = rows
+        locArray[rows, 1:3] = points[:count]
+        start += count
+    return locArray
 
 def airtime(phyParams):
     """ Computes the airtime of a packet in second.
+    Each parameter can be an array (the airtimes are then broadcast, e.g.
+    sf of shape (6, 1) and bw of shape (1, 2) give a 6 x 2 table).
     Parameters
     ----------
     sf : int [7...12]
@@ -382,7 +447,7 @@ def airtime(phyParams):
         enable crc or not
     Returns
     -------
-    Tpream + Tpayload: float
+    Tpream + Tpayload: float or array
         The time on air of a packer in second.
     """
     DE = 1       # low data rate optimization enabled (=1) or not (=0)
@@ -396,10 +461,25 @@ def airtime(phyParams):
 
     Tsym = (2.0**sf)/bw
     Tpream = (preabmleLength + syncLength)*Tsym
-    payloadSymbNB = 8 + max(math.ceil((8.0*packetLength-4.0*sf+28+16*crc-20*headerEnable)/(4.0*(sf-2*DE)))*(rdd+4),0)
+    payloadSymbNB = 8 + np.maximum(np.ceil((8.0*packetLength-4.0*sf+28+16*crc-20*headerEnable)/(4.0*(sf-2*DE)))*(rdd+4),0)
     Tpayload = payloadSymbNB * Tsym
     return Tpream + Tpayload
 
+def packetEnergy(rectime, pTX):
+    """ Energy spent to send a packet (3 V supply).
+    Parameters
+    ----------
+    rectime : float or array
+        Airtime of the packet in ms.
+    pTX : float or array
+        Transmit power in dBm.
+    Returns
+    -------
+    energy: float or array
+        Energy in J.
+    """
+    return rectime * dBmTomW(pTX) * (3.0) /1e6 # V = 3.0     # voltage XXX
+
 def getMaxTransmitDistance(RXSensi, maxPtx, logDistParams, phyParams):
     """ Get the best range for for allowed power from the the transmit time and bandwidth used.
     This is dependent on the packet length as the max transmission size is also limited.
@@ -413,7 +493,7 @@ def getMaxTransmitDistance(RXSensi, maxPtx, logDistParams, phyParams):
     logDistParams: list in format [gamma, Lpld0, d0]
         Parameters for log shadowing channel model.
     phyParams: list in format [rdd, packetlen, hearder_enable, preabmle_len, crc]
-        Parameters for the packet.
+        Parameters for the packet (packetlen can be an array: the packet is valid if all the lengths are).
     Returns
     -------
     distMatrix: float
@@ -438,11 +518,11 @@ def getMaxTransmitDistance(RXSensi, maxPtx, logDistParams, phyParams):
     LplMatrix = np.concatenate((Lpl125.reshape((6,1)), Lpl250.reshape((6,1))), axis=1)
     distMatrix =np.dot(d0, np.power(10, np.divide(LplMatrix - Lpld0, 10*gamma)))
     
-    packetAirtimeValid = np.zeros((6,2))
-    for i in range(6):
-        # set packet airtime valid <= 400
-        packetAirtimeValid[i,0] = (airtime((i+7, rdd, 125, packetLength, preambleLength, syncLength, headerEnable, crc)) <= 9999)
-        packetAirtimeValid[i,1] = (airtime((i+7, rdd, 250, packetLength, preambleLength, syncLength, headerEnable, crc)) <= 9999)
+    # set packet airtime valid <= 400 (one airtime table for all the SFs, BWs and packet lengths)
+    sf = np.arange(7, 13).reshape((6, 1, 1))
+    bw = np.array([125, 250]).reshape((1, 2, 1))
+    packetLength = np.reshape(packetLength, (1, 1, -1))
+    packetAirtimeValid = np.all(airtime((sf, rdd, bw, packetLength, preambleLength, syncLength, headerEnable, crc)) <= 9999, axis=2)
     Index = np.argmax(np.multiply(distMatrix, packetAirtimeValid))
     
     sfInd, bwInd = np.unravel_index(Index, (6,2))
@@ -0,0 +1,154 @@
+""" LPWAN Simulator: metrics sink
+============================================
+Utilities (:mod:`lora.metrics`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   MetricsSink              -- Buffer the checkpoints and write them in chunks.
+   readMetrics              -- Read the chunks of an experiment.
+   exportCSV                -- Write the metrics in the CSV layout of the save processes.
+
+With metrics="npz", the save processes do not append to one CSV file per
+node and per metric at every checkpoint. They add one row per checkpoint
+to in-memory columns (prob: nodes x actions matrix of the non-uniform
+nodes, ratio, energy, transmitted, received, traffic), which are written
+every chunkSize checkpoints to simu_dir/metrics_<fname>_<chunk>.npz.
+"""
+import os
+import numpy as np
+from glob import glob
+from os.path import join
+
+__all__ = ['MetricsSink', 'readMetrics', 'exportCSV']
+
+def chunkFiles(simu_dir, fname):
+    """ Chunk files of an experiment, in order."""
+    return sorted(glob(join(simu_dir, 'metrics_' + fname + '_[0-9]*.npz')))
+
+class MetricsSink():
+    """ LPWAN Simulator: metrics sink
+    In-memory columns of the checkpoints of a simulation, flushed in chunks
+    to .npz files. The chunks of a previous run with the same fname are
+    removed when the sink is created.
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] simu_dir: folder of the experiment
+    \param [IN] fname: file name structure
+    \param [IN] chunkSize: number of checkpoints per file
+
+    """
+    def __init__(self, simu_dir, fname, chunkSize=100):
+        self.simu_dir = simu_dir
+        self.fname = fname
+        self.chunkSize = chunkSize
+        self.columns = {}
+        self.nrChunks = 0
+        self.probNodes = None
+        for filename in chunkFiles(simu_dir, fname):
+            os.remove(filename)
+
+    def add(self, **values):
+        """ Add one row to each of the given columns."""
+        for name, value in values.items():
+            self.columns.setdefault(name, []).append(np.asarray(value))
+        if max(len(rows) for rows in self.columns.values()) >= self.chunkSize:
+            self.flush()
+
+    def addProb(self, nodeDict):
+        """ Add the probabilities of the non-uniform nodes."""
+        if self.probNodes is None:
+            nodes = [node for node in nodeDict.values() if node.node_mode != "UNIFORM"]
+            self.probNodes = nodes
+            self.probStatic = {'prob_nodeid': np.array([node.nodeid for node in nodes], dtype=np.int64),
+                               'prob_nrActions': np.array([node.nrActions for node in nodes], dtype=np.int64)}
+            populations = set(id(node.population) for node in nodes)
+            if len(populations) == 1:
+                # all nodes in one population: a single gather
+                self.probRows = np.array([node.row for node in nodes], dtype=np.int64)
+            else:
+                self.probRows = None
+        nodes = self.probNodes
+        if self.probRows is not None:
+            prob = nodes[0].population.prob[self.probRows]
+        else:
+            width = max([node.nrActions for node in nodes], default=0)
+            prob = np.zeros((len(nodes), width))
+            for i, node in enumerate(nodes):
+                prob[i, :node.nrActions] = node.prob
+        self.add(prob=prob)
+
+    def flush(self):
+        """ Write the buffered rows to the next chunk file."""
+        if not any(self.columns.values()):
+            return
+        arrays = {name: np.stack(rows) for name, rows in self.columns.items() if rows}
+        if 'prob' in arrays:
+            arrays.update(self.probStatic)
+        np.savez(join(self.simu_dir, 'metrics_' + self.fname + '_' + '%05d' % self.nrChunks + '.npz'), **arrays)
+        self.nrChunks += 1
+        self.columns = {}
+
+    def close(self):
+        """ Write the remaining rows."""
+        self.flush()
+
+def readMetrics(simu_dir, fname):
+    """ Read the chunks of an experiment.
+    Parameters
+    ----------
+    simu_dir: string
+        folder
+    fname: string
+        file name structure
+    Returns
+    -------
+    metrics: dict
+        Columns (one row per checkpoint), and prob_nodeid, prob_nrActions.
+    """
+    columns = {}
+    metrics = {}
+    for filename in chunkFiles(simu_dir, fname):
+        with np.load(filename) as chunk:
+            for name in chunk.files:
+                if name.startswith('prob_'):
+                    metrics[name] = chunk[name]
+                else:
+                    columns.setdefault(name, []).append(chunk[name])
+    for name, parts in columns.items():
+        metrics[name] = np.concatenate(parts)
+    return metrics
+
+def writeLines(filename, lines):
+    """ Write lines as the save processes do (no newline at the end of the file)."""
+    with open(filename, "w") as myfile:
+        myfile.write("\n".join(lines))
+
+def exportCSV(simu_dir, fname, outdir=None):
+    """ Write the metrics of an experiment in the CSV layout of the save processes
+    (prob_..._id_X.csv, ratio_....csv, energy_....csv and traffic_....csv).
+    Parameters
+    ----------
+    simu_dir: string
+        folder of the chunks
+    fname: string
+        file name structure
+    outdir: string
+        folder of the CSV files (simu_dir if None)
+    Returns
+    -------
+    """
+    outdir = simu_dir if outdir is None else outdir
+    metrics = readMetrics(simu_dir, fname)
+    if 'prob' in metrics:
+        for i, (nodeid, nrActions) in enumerate(zip(metrics['prob_nodeid'], metrics['prob_nrActions'])):
+            writeLines(join(outdir, str('prob_'+ fname) + '_id_' + str(nodeid) + '.csv'),
+                       [str(row.tolist())[1:-1] for row in metrics['prob'][:, i, :nrActions]])
+    if 'ratio' in metrics:
+        writeLines(join(outdir, str('ratio_'+ fname) + '.csv'), [str(value) for value in metrics['ratio'].tolist()])
+    if 'energy' in metrics:
+        writeLines(join(outdir, str('energy_'+ fname) + '.csv'),
+                   [str(e) + " " + str(t) + " " + str(r) for e, t, r in zip(metrics['energy'].tolist(), metrics['transmitted'].tolist(), metrics['received'].tolist())])
+    if 'traffic' in metrics:
+        writeLines(join(outdir, str('traffic_'+ fname) + '.csv'), [str(g) + " " + str(t) for g, t in metrics['traffic'].tolist()])
@@ -2,6 +2,11 @@ from __future__ import division
 import numpy as np
 from .loratools import getDistanceFromPower
 from .packet import myPacket
+from .population import MODES, NodePopulation, column
+from .actions import actionTable
+from .sampler import ActionSampler
+from .learning import pruneProb
+from . import kernels
 
 class myNode():
     """ LPWAN Simulator: node
@@ -18,11 +23,35 @@ class myNode():
     \param [IN] logDistParams: log shadowing channel parameters
     \param [IN] sensi: sensitivity matrix
     \param [IN] nSF: number of spreading factors
+    \param [IN] population: node population storing the state of the node (a private one if None)
+    \param [IN] bsIndex: spatial index of bsList (see lora.spatial)
     
     """
+    __slots__ = ['population', 'row', 'nodeid', 'info_mode', 'bw', 'pTXmax', 'sensi', 'proximateBS', 'freqSet',
+                 'powerSet', 'sfSet', 'actions', 'setActions', 'initial', 'sampler', 'packet', 'ack']
+
+    # state stored in the population arrays
+    x = column('x')
+    y = column('y')
+    period = column('period')
+    nrActions = column('nrActions')
+    learning_rate = column('learningRate')
+    alpha = column('alpha')
+    packetNumber = column('packetNumber')
+    packetsTransmitted = column('packetsTransmitted')
+    packetsSuccessful = column('packetsSuccessful')
+    transmitTime = column('transmitTime')
+    energy = column('energy')
+
     def __init__(self, nodeid, position, transmitParams, initial, sfSet, freqSet, powSet, bsList,
-                 interferenceThreshold, logDistParams, sensi, node_mode, info_mode, horTime, algo, simu_dir, fname):
+                 interferenceThreshold, logDistParams, sensi, node_mode, info_mode, horTime, algo, simu_dir, fname,
+                 population=None, bsIndex=None):
+        if population is None:
+            population = NodePopulation(1, len(sfSet)*len(freqSet)*len(powSet))
+        self.population = population
+        self.row = population.allocate()
         self.nodeid = nodeid # id
+        population.streams.seedNode(self.row, nodeid) # random streams of the node
         self.x, self.y = position # location
         if node_mode == 0:
             self.node_mode = initial
@@ -37,7 +66,7 @@ class myNode():
         self.sensi = sensi
         
         # generate proximateBS
-        self.proximateBS = self.generateProximateBS(bsList, interferenceThreshold, logDistParams)
+        self.proximateBS = self.generateProximateBS(bsList, interferenceThreshold, logDistParams, bsIndex)
     
         # set of actions
         self.freqSet = freqSet
@@ -48,28 +77,29 @@ class myNode():
         else:
             self.sfSet = self.generateHoppingSfFromDistance(sfSet, logDistParams)
         
-        self.setActions = [(self.sfSet[i], self.freqSet[j], self.powerSet[k]) for i in range(len(self.sfSet)) for j in range(len(self.freqSet)) for k in range(len(self.powerSet))]
+        self.actions, self.setActions = actionTable(self.sfSet, self.freqSet, self.powerSet) # shared by the nodes with the same sets
         self.nrActions = len(self.setActions)
         self.initial = initial
         
         # learning algorithm
         if algo == 'exp3':
             self.learning_rate = np.minimum(1, np.sqrt((self.nrActions*np.log(self.nrActions))/((horTime)*(np.exp(1.0)-1))))
-            self.alpha = None
+            self.alpha = 0
         elif algo == 'exp3s':
             self.learning_rate = np.minimum(1, np.sqrt((self.nrActions*np.log(self.nrActions*horTime))/horTime))
             self.alpha = 1/horTime 
         # weight and prob for learning
-        self.weight = {x: 1 for x in range(0, self.nrActions)}
+        self.population.logWeight[self.row, :self.nrActions] = 0 # weights equal to 1
         if self.initial=="RANDOM":
-            prob = np.random.rand(self.nrActions)
+            prob = population.streams.uniformVector(self.row, self.nrActions)
             prob = prob/sum(prob)   
         else:
             prob = (1/self.nrActions) * np.ones(self.nrActions)      
-        self.prob = {x: prob[x] for x in range(0, self.nrActions)}
+        self.prob[:] = prob
+        self.sampler = ActionSampler(self.prob) # tables rebuilt when the probabilities change
 
         # generate packet and ack
-        self.packets = self.generatePacketsToBS(transmitParams, logDistParams)
+        self.packet = self.generatePacket(transmitParams, logDistParams)
         self.ack = {}
         
         # measurement params
@@ -78,7 +108,27 @@ class myNode():
         self.packetsSuccessful = 0
         self.transmitTime = 0
         self.energy = 0
-    def generateProximateBS(self, bsList, interferenceThreshold, logDistParams):
+
+    @property
+    def node_mode(self):
+        """Mode of the node: UNIFORM, RANDOM or SMART"""
+        return MODES[self.population.mode[self.row]]
+
+    @node_mode.setter
+    def node_mode(self, mode):
+        self.population.mode[self.row] = MODES.index(mode)
+
+    @property
+    def weight(self):
+        """Weights of the actions (relative to the largest weight)"""
+        return np.exp(self.population.logWeight[self.row, :self.nrActions])
+
+    @property
+    def prob(self):
+        """Probabilities of the actions (view of the population row)"""
+        return self.population.prob[self.row, :self.nrActions]
+
+    def generateProximateBS(self, bsList, interferenceThreshold, logDistParams, bsIndex=None):
         """ Generate dictionary of base-stations in proximity.
         Parameters
         ----------
@@ -88,6 +138,8 @@ class myNode():
             Interference threshold
         logDistParams: list
             Channel parameters
+        bsIndex: BSGridIndex
+            Spatial index of bsList (full scan if None)
         Returns
         -------
         proximateBS: list
@@ -95,17 +147,21 @@ class myNode():
         """
 
         maxInterferenceDist = getDistanceFromPower(self.pTXmax, interferenceThreshold, logDistParams)
-        dist = np.sqrt((bsList[:,1] - self.x)**2 + (bsList[:,2] - self.y)**2)
-        index = np.nonzero(dist <= maxInterferenceDist)
+        if bsIndex is None:
+            dist = np.sqrt((bsList[:,1] - self.x)**2 + (bsList[:,2] - self.y)**2)
+            index = np.nonzero(dist <= maxInterferenceDist)[0]
+            dist = dist[index]
+        else:
+            index, dist = bsIndex.query(self.x, self.y, maxInterferenceDist)
 
         proximateBS = {} # create empty dictionary
-        for i in index[0]:
-            proximateBS[int(bsList[i,0])] = dist[i]
+        for i, d in zip(index, dist):
+            proximateBS[int(bsList[i,0])] = d
 
         return proximateBS
     
-    def generatePacketsToBS(self, transmitParams, logDistParams):
-        """ Generate dictionary of base-stations in proximity.
+    def generatePacket(self, transmitParams, logDistParams):
+        """ Generate the packet of the node, shared by the base-stations in proximity.
         Parameters
         ----------
         transmitParams : list
@@ -114,14 +170,10 @@ class myNode():
             Channel parameters
         Returns
         -------
-        packets: packet
-            packets at BS
+        packet: packet
+            packet to the BSs
         """
-        packets = {} # empty dictionary to store packets originating at a node
-        
-        for bsid, dist in self.proximateBS.items():
-            packets[bsid] = myPacket(self.nodeid, bsid, dist, transmitParams, logDistParams, self.sensi, self.setActions, self.nrActions, self.sfSet, self.prob) #choosenAction)
-        return packets
+        return myPacket(self.nodeid, self.proximateBS, transmitParams, logDistParams, self.sensi, self.setActions, self.nrActions, self.sfSet, self.prob) #choosenAction)
     #print("probability of node " +str(self.nodeid)+" is: " +str(self.prob))
 
     def generateHoppingSfFromDistance(self, sfSet, logDistParams):
@@ -166,52 +218,56 @@ class myNode():
         -------
     
         """
-        prob = [self.prob[x] for x in self.prob]
-        weight = [self.weight[x] for x in self.weight]
-        reward = np.zeros(self.nrActions)
+        population = self.population
+        action = self.packet.choosenAction
+        reward = 0
         # compute reward
         if self.node_mode == "SMART":
             # no and partial information case:
             if self.info_mode in ["NO", "PARTIAL"]:
                 # with ACK -> 1, no ACK -> 0
                     if self.ack:
-                        reward[self.packets[0].choosenAction] = 1/prob[self.packets[0].choosenAction]
-                    else:
-                        reward[self.packets[0].choosenAction] = 0
+                        reward = 1/self.prob[action]
             # full information case:
             else:
                 if self.ack:
-                    if not self.ack[0].isCollision:
-                        reward[self.packets[0].choosenAction] = 1/prob[self.packets[0].choosenAction]
+                    if not self.ack[0].collisionAt(0):
+                        reward = 1/self.prob[action]
                     else:
-                        reward[self.packets[0].choosenAction] = 0.5/prob[self.packets[0].choosenAction]
-                else:
-                    reward[self.packets[0].choosenAction] = 0
+                        reward = 0.5/self.prob[action]
         
         # update weight
-        for j in range(0, self.nrActions):
-            if algo == "exp3":
-                weight[j] *= np.exp((self.learning_rate * reward[j])/self.nrActions)
-            elif algo == "exp3s":
-                weight[j] *= np.exp((self.learning_rate * reward[j])/self.nrActions)
-                weight[j] += ((np.exp(1) * self.alpha)/self.nrActions) * sum(weight)
+        if algo == "exp3":
+            kernels.exp3RowUpdate(population.logWeight, self.row, self.nrActions, action, reward, population.learningRate[self.row])
+        elif algo == "exp3s":
+            kernels.exp3sRowUpdate(population.logWeight, self.row, self.nrActions, action, reward, population.learningRate[self.row], population.alpha[self.row])
         
         # update prob
         if self.node_mode == "SMART":
-            for j in range(0, self.nrActions):
-                prob[j] = (1-self.learning_rate) * (weight[j]/sum(weight)) + (self.learning_rate/self.nrActions)
+            prob = kernels.exp3RowProb(population.logWeight, self.row, self.nrActions, population.learningRate[self.row])
         elif self.node_mode == "RANDOM":
-            prob = np.random.rand(self.nrActions)
+            prob = population.streams.uniformVector(self.row, self.nrActions)
             prob = prob/sum(prob)
         else:
             prob = (1/self.nrActions) * np.ones(self.nrActions)
         
         # trick: force the small value (<1/5000) to 0 and normalize
-        prob = np.array(prob)
-        prob[prob<0.0005] = 0
-        prob = prob/sum(prob)
-        self.weight = {x: weight[x] for x in range(0, self.nrActions)} 
-        self.prob = {x: prob[x] for x in range(0, self.nrActions)}
+        prob = pruneProb(prob)
+        if not np.array_equal(prob, self.prob):
+            self.prob[:] = prob
+            self.sampler.invalidate()
+        
+    def interArrival(self):
+        """Waiting time until the next packet (exponential, mean period)"""
+        return self.period * self.population.streams.exponential(self.row)
+
+    def drawUniform(self):
+        """Next uniform variate of the node (e.g. to draw an action)"""
+        return self.population.streams.uniform(self.row)
+
+    def drawAction(self):
+        """Action of the next packet, drawn from the probabilities of the node"""
+        return self.sampler.sample(self.drawUniform())
         
     def resetACK(self):
         """Reset ACK"""
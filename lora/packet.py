@@ -1,16 +1,19 @@
-from numpy import zeros, random, where
-from .loratools import getRXPower, dBmTomW, airtime
+import numpy as np
+from .loratools import dBmTomW, airtime
+from .actions import bucketTable
+from . import kernels
 
 class myPacket():
     """ LPWAN Simulator: packet
-    Base station class
+    Transmission of a node, shared by the base stations in its proximity.
+    The action is drawn once per transmission; the values which depend on the
+    BS are vectors with one entry per proximate BS (in the order of bsids).
    
     |category /LoRa
     |keywords lora
     
     \param [IN] nodeid: id of the node
-    \param [IN] bsid: id of the base station
-    \param [IN] dist: distance between node and bs
+    \param [IN] proximateBS: proximate base stations {bsid: distance between node and bs}
     \param [IN] transmitParams: physical layer parameters
                 [sf, rdd, bw, packetLength, preambleLength, syncLength, headerEnable, crc, pTX, period] 
     \param [IN] logDistParams: log shadowing channel parameters
@@ -20,11 +23,16 @@ class myPacket():
     \param [IN] sfSet: set of spreading factors
     \param [IN] prob: probability
     """
+    __slots__ = ['nodeid', 'bsids', 'bsIndex', 'dist', 'sf', 'rdd', 'bw', 'packetLength', 'preambleLength', 'syncLength',
+                 'headerEnable', 'crc', 'pTXmax', 'sensi', 'sfSet', 'setActions', 'nrActions', 'prob', 'choosenAction',
+                 'freq', 'pTX', 'rectime', 'pRX', 'links', 'bucket', 'bucketIdx', 'sfIdx', 'powermW', 'packetNumber',
+                 'isLost', 'isCritical', 'isCollision']
 
-    def __init__(self, nodeid, bsid, dist, transmitParams, logDistParams, sensi, setActions, nrActions, sfSet, prob): #choosenAction):
+    def __init__(self, nodeid, proximateBS, transmitParams, logDistParams, sensi, setActions, nrActions, sfSet, prob): #choosenAction):
         self.nodeid = nodeid
-        self.bsid = bsid
-        self.dist = dist
+        self.bsids = list(proximateBS.keys())
+        self.bsIndex = {bsid: i for i, bsid in enumerate(self.bsids)}
+        self.dist = np.array([proximateBS[bsid] for bsid in self.bsids], dtype=float)
         
         # params
         self.sf = int(transmitParams[0])
@@ -42,43 +50,29 @@ class myPacket():
         # learn strategy
         self.setActions = setActions
         self.nrActions = nrActions
-        self.prob = [prob[x] for x in prob]
+        self.prob = prob
         #self.choosenAction = choosenAction
         #self.sf, self.freq, self.pTX = self.setActions[self.choosenAction]
         self.sf = None
         self.freq= None
         self.pTX = self.pTXmax
         
-        #received params
+        #received params (one entry per proximate BS)
         self.rectime = airtime(transmitParams[0:8])
-        self.pRX = getRXPower(self.pTX, self.dist, logDistParams)
-        self.signalLevel = None
+        self.pRX = np.array([kernels.rxPower(self.pTX, d, *logDistParams) for d in self.dist])
+        self.links = None # link budget of each action (see linkTable)
+        self.bucket = None
+        self.bucketIdx = np.full(len(self.bsids), -1, dtype=np.int16)
+        self.sfIdx = None
+        self.powermW = np.zeros(len(self.bsids))
 
-        # measurement params
+        # measurement params (one entry per proximate BS)
         self.packetNumber = 0
-        self.isLost = False
-        self.isCritical = False
-        self.isCollision = False
-                
-    def computePowerDist(self, bsDict, logDistParams):
-        """ Get the power distribution .
-        Parameters
-        ----------
-        self : packet
-            Packet.
-        bsDict: dictionary
-            Dictionary of BSs
-        Returns
-        -------
-        signalLevel: dictionary
-            The power contribution of a packet in various frequency buckets for each BS
-    
-        """
-        signal = self.getPowerContribution()
-        signalLevel = {x:signal[x] for x in signal.keys() & bsDict[self.bsid].signalLevel.keys()}
-        return signalLevel
+        self.isLost = np.zeros(len(self.bsids), dtype=bool)
+        self.isCritical = np.zeros(len(self.bsids), dtype=bool)
+        self.isCollision = np.zeros(len(self.bsids), dtype=bool)
         
-    def updateTXSettings(self, bsDict, logDistParams, prob):
+    def updateTXSettings(self, bsDict, logDistParams, prob, action):
         """ Update the TX settings after frequency hopping.
         Parameters
         ----------
@@ -86,6 +80,10 @@ class myPacket():
             Dictionary of BSs
         logDistParams: list
             Channel parameters, e.x., log-shadowing model: (gamma, Lpld0, d0)]
+        prob: array
+            Probabilities of the actions
+        action: int
+            Chosen action (see lora.sampler)
         
         Returns
         isLost: bool
@@ -95,58 +93,57 @@ class myPacket():
         """
         self.packetNumber += 1
         self.prob = prob
-        self.choosenAction = random.choice(self.nrActions, p=self.prob)
+        self.choosenAction = action
         self.sf, self.freq, self.pTX = self.setActions[self.choosenAction]
-        self.pRX = getRXPower(self.pTX, self.dist, logDistParams)
         #print("probability of node " +str(self.nodeid)+" is: " +str(self.prob))
 
-        self.signalLevel = self.computePowerDist(bsDict, logDistParams)
-
-        if self.pRX >= self.sensi[self.sf-7, 1+int(self.bw/250)]:
-            self.isLost = False
-        else:
-            self.isLost = True
-            #print(self.pRX)
-            #print ("Node " + str(self.nodeid) + ": packet is lost (smaller than RSSI)!")
+        # received power and sensitivity only depend on the action
+        if self.links is None:
+            self.links = self.linkTable(bsDict, logDistParams)
+        actionLinks, bucketIdx, powermW, pRX, lost = self.links
+        self.bucket, _, self.sfIdx, powerIdx = actionLinks[self.choosenAction]
+        self.bucketIdx = bucketIdx[self.choosenAction]
+        self.powermW = powermW[powerIdx]
+        self.pRX = pRX[powerIdx]
+        self.isLost[:] = lost[powerIdx, self.sfIdx]
    
-        self.isCritical = False
-        
-    def getAffectedFreqBuckets(self):
-        """ Get the list of affected frequency buckets from [fc-bw/2 fc+bw/2].
-        Parameters
-        ----------
-        
-        Returns
-        fRange: list
-            List of frequencies that effected by the using frequency
-        -------
-        """
-        low = self.freq - self.bw/2 # Note: this is approx due to integer division for 125
-        high = self.freq + self.bw/2 # Note: this is approx due to integer division for 125
-        lowBucketStart = int(low - (low % 200) + 100)
-        highBucketEnd = int(high + 200 - (high % 200) - 100)
+        self.isCritical[:] = False
 
-        # the +1 ensures that the last value is included in the set
-        return range(lowBucketStart, highBucketEnd + 1, 200)
-            
-    def getPowerContribution(self):
-        """ Get the power contribution of a packet in various frequency buckets.
+    def linkTable(self, bsDict, logDistParams):
+        """ Link budget of each action at the proximate base stations.
         Parameters
         ----------
+        bsDict: dictionary
+            Dictionary of BSs
+        logDistParams: list
+            Channel parameters, e.x., log-shadowing model: (gamma, Lpld0, d0)]
 
         Returns
-        powDict: dic
-            Power distribution by frequency
+        actionLinks: tuple
+            For each action: frequency bucket, SF index and pTX index (shared, see actions.bucketTable).
+        bucketIdx: array (actions x BSs)
+            Index of the frequency bucket of each action at each BS (-1 if outside its buckets).
+        powermW, pRX: arrays (pTX x BSs)
+            Received power in mW and dBm.
+        lost: array (pTX x SF x BSs)
+            The packet is below the sensitivity (lost).
         -------
-    
         """
-        freqBuckets = self.getAffectedFreqBuckets()
-        powermW = dBmTomW(self.pRX)
-        #print(self.pRX, powermW)
-        signal = zeros((6,1))
-        full_setSF = [7, 8, 9, 10, 11, 12]
-        idx = full_setSF.index(self.sf)
-        #print(idx)
-        signal[idx] = powermW
-        #print(signal)
-        return {freqBuckets[0]:signal}
\ No newline at end of file
+        actionLinks, powers = bucketTable(self.setActions, (), self.bw)
+        nrBS = len(self.bsids)
+        bucketIdx = np.full((self.nrActions, nrBS), -1, dtype=np.int16)
+        powermW = np.zeros((len(powers), nrBS))
+        pRX = np.zeros((len(powers), nrBS))
+        for i, bsid in enumerate(self.bsids):
+            links, _ = bucketTable(self.setActions, bsDict[bsid].freqBuckets, self.bw)
+            bucketIdx[:, i] = [link[1] for link in links]
+            for p, pTX in enumerate(powers):
+                pRX[p, i] = kernels.rxPower(pTX, self.dist[i], *logDistParams)
+                powermW[p, i] = dBmTomW(pRX[p, i])
+        lost = pRX[:, None, :] < self.sensi[:, 1+int(self.bw/250)].reshape((1, -1, 1))
+        return actionLinks, bucketIdx, powermW, pRX, lost
+
+    def collisionAt(self, bsid):
+        """ The packet collided at a base station."""
+        return bool(self.isCollision[self.bsIndex[bsid]])
+        
\ No newline at end of file
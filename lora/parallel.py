@@ -0,0 +1,155 @@
+""" LPWAN Simulator: spatially decomposed runs
+============================================
+Utilities (:mod:`lora.parallel`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   runCluster               -- Run the simulation of one cluster and summarize it.
+   mergeClusters            -- Network summary of the clusters.
+   run_clusters             -- Run the clusters of a simulation on a process pool.
+
+A node only touches the signal levels of the base stations within its
+interference distance (its proximate BSs), so the network splits into
+clusters of nodes and base stations that never interact (see
+lora.spatial.interferenceClusters). Each cluster is simulated by its own
+sim() call, restricted to its nodes and base stations, in its own folder
+(logdir/exp_name/cluster_X), and the per-cluster summaries are merged at
+the end. The random streams of a node only depend on the seed and its id
+(see lora.rng), so with the node traffic model the nodes send the same
+packets with the same outcomes as in a single run of the whole network.
+Clusters sharing a node are the same cluster: there is no synchronization
+between processes: rather than synchronizing the clusters at the nodes
+they share, the clusters are merged, so a network connected by overlapping
+base stations runs as one cluster. The interference distance follows from
+the interference threshold of sim() (-150 dBm by default, about 21 km,
+more than the default 10 km area): the decomposition needs a higher
+threshold or a larger area (grid) to find several clusters.
+"""
+import numpy as np
+from os.path import join
+from concurrent.futures import ProcessPoolExecutor
+from .utils import sim, makeScenario, resultName, LOG_DIST_PARAMS, INTERFERENCE_THRESHOLD, GRID
+from .loratools import getDistanceFromPower
+from .spatial import interferenceClusters
+from .runner import readCheckpoints
+
+__all__ = ['runCluster', 'mergeClusters', 'run_clusters']
+
+def runCluster(config, index, nodeIds, bsIds):
+    """ Run the simulation of one cluster.
+    Parameters
+    ----------
+    config: dict
+        Keyword arguments of sim().
+    index: int
+        Index of the cluster (folder cluster_index).
+    nodeIds, bsIds: arrays of ints
+        Ids of the nodes and base stations of the cluster.
+    Returns
+    -------
+    summary: dict
+        nodeid, transmitted, received, energy: values of each node at the end.
+        checkpoints: energy, transmitted and received packets at each checkpoint (checkpoints x 3).
+        probid, prob: ids and probabilities of the non-uniform nodes at each checkpoint (checkpoints x nodes x actions).
+    """
+    config = dict(config)
+    config['exp_name'] = join(config['exp_name'], 'cluster_' + str(index))
+    config['plot'] = False
+    bsDict, nodeDict = sim(nodeIds=nodeIds, bsIds=bsIds, **config)
+
+    simu_dir = join(config['logdir'], config['exp_name'])
+    simtime = config['horTime'] * config['avgSendTime']
+    nrCheckpoints = int(np.ceil(simtime / (100 * 3600000))) - 1
+    nodes = [node for node in nodeDict.values() if node.node_mode != "UNIFORM"]
+    ratio, energy, prob = readCheckpoints(simu_dir, resultName(config['nrIntNodes'], config['initial'], config['info_mode'], config['captureEffect'],
+                                                               config['interSFInterference']), config.get('metrics', 'csv'), nrCheckpoints, nodes)
+    return {'nodeid': np.array([node.nodeid for node in nodeDict.values()], dtype=np.int64),
+            'transmitted': np.array([node.packetsTransmitted for node in nodeDict.values()]),
+            'received': np.array([node.packetsSuccessful for node in nodeDict.values()]),
+            'energy': np.array([node.energy for node in nodeDict.values()]),
+            'checkpoints': energy,
+            'probid': np.array([node.nodeid for node in nodes], dtype=np.int64), 'prob': prob}
+
+def mergeClusters(summaries):
+    """ Network summary of the clusters.
+    Parameters
+    ----------
+    summaries: list of dict
+        Summaries of the clusters (see runCluster).
+    Returns
+    -------
+    results: dict
+        nodeid, transmitted, received, energy: values of each node at the end (sorted by id).
+        ratio, energy_total, transmitted_total, received_total: network values at each checkpoint.
+        probid, prob: probabilities of the non-uniform nodes at each checkpoint (sorted by id).
+        prr: packet reception ratio at the end.
+        final: number of transmitted and received packets, and energy at the end.
+    """
+    results = {}
+    nodeid = np.concatenate([summary['nodeid'] for summary in summaries])
+    order = np.argsort(nodeid)
+    results['nodeid'] = nodeid[order]
+    for key in ['transmitted', 'received', 'energy']:
+        results[key] = np.concatenate([summary[key] for summary in summaries])[order]
+
+    checkpoints = sum(summary['checkpoints'] for summary in summaries)
+    results['energy_total'] = checkpoints[:, 0]
+    results['transmitted_total'] = checkpoints[:, 1]
+    results['received_total'] = checkpoints[:, 2]
+    results['ratio'] = checkpoints[:, 2] / np.maximum(checkpoints[:, 1], 1)
+
+    probid = np.concatenate([summary['probid'] for summary in summaries])
+    width = max([summary['prob'].shape[2] for summary in summaries], default=0)
+    prob = np.concatenate([np.pad(summary['prob'], ((0, 0), (0, 0), (0, width - summary['prob'].shape[2])))
+                           for summary in summaries], axis=1)
+    order = np.argsort(probid)
+    results['probid'] = probid[order]
+    results['prob'] = prob[:, order]
+
+    nTransmitted = results['transmitted'].sum()
+    nRecvd = results['received'].sum()
+    results['prr'] = np.array(nRecvd/nTransmitted if nTransmitted else 0.0)
+    results['final'] = np.array([nTransmitted, nRecvd, results['energy'].sum()])
+    return results
+
+def run_clusters(config, workers=1):
+    """ Run a simulation split in clusters on a process pool.
+    Parameters
+    ----------
+    config: dict
+        Keyword arguments of sim() (except plot, nodeIds and bsIds).
+    workers: int
+        Number of worker processes (1: run in this process).
+    Returns
+    -------
+    results: dict
+        Network summary (see mergeClusters) and size of each cluster (clusterNodes, clusterBS).
+    """
+    config = dict(config)
+    config.setdefault('metrics', 'npz')
+    seed = config.get('seed', 42)
+    scenarioSeed = config.get('scenarioSeed')
+    scenario = makeScenario(config['nrNodes'], config['nrBS'], config['radius'], config['distribution'], config['packetLength'],
+                            config['powSet'], config['logdir'], seed if scenarioSeed is None else scenarioSeed, config.get('grid', GRID))
+    # interference distance of the nodes (see myNode.generateProximateBS)
+    radius = getDistanceFromPower(max(config['powSet']), config.get('interferenceThreshold', INTERFERENCE_THRESHOLD), LOG_DIST_PARAMS)
+    clusters = interferenceClusters(scenario['nodeLoc'][0:config['nrNodes'], :], scenario['BSLoc'][0:config['nrBS'], :],
+                                    radius, scenario['bestDist'])
+    print ("# clusters = {}".format(len(clusters)))
+    if len(clusters) == 1:
+        print ("Warning: the network forms a single cluster (interference distance {:.0f} m), it runs in this process".format(radius))
+        workers = 1
+
+    indices = range(len(clusters))
+    nodeIds = [nodes for nodes, bs in clusters]
+    bsIds = [bs for nodes, bs in clusters]
+    if workers == 1:
+        summaries = [runCluster(config, i, nodes, bs) for i, nodes, bs in zip(indices, nodeIds, bsIds)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            summaries = list(executor.map(runCluster, [config] * len(clusters), indices, nodeIds, bsIds))
+
+    results = mergeClusters(summaries)
+    results['clusterNodes'] = np.array([len(nodes) for nodes in nodeIds])
+    results['clusterBS'] = np.array([len(bs) for bs in bsIds])
+    return results
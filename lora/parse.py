@@ -29,6 +29,18 @@ def get_args():
     parser.add_argument("--Algo", required=True, type=str)
     parser.add_argument("--logdir", required=True, type=str)
     parser.add_argument("--exp_name", required=True, type=str)
+    parser.add_argument("--engine", type=str, default="simpy")
+    parser.add_argument("--replications", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--metrics", type=str, default="csv")
+    parser.add_argument("--reception", type=str, default="eager")
+    parser.add_argument("--kernels", type=str, default=None)
+    parser.add_argument("--traffic", type=str, default="node")
+    parser.add_argument("--background", type=str, default="node")
+    parser.add_argument("--clusters", type=int, default=0)
+    parser.add_argument("--interferenceThreshold", type=float, default=-150)
+    parser.add_argument("--grid", type=str, default="10000 10000")
+    parser.add_argument("--blockSize", type=int, default=32)
     
 #     parser = argload.ArgumentLoader(
 #         parser, to_reload=['nrNodes', 'nrIntNodes', 'nrBS', 'radius', 'AvgSendTime', 'horizonTime',
@@ -13,7 +13,7 @@ With some codes from extended LoRaSim library: https://github.com/adwaitnd/loras
 
 """
 # Import Library
-from numpy import zeros
+from numpy import array
 import matplotlib.pyplot as plt
 from .loratools import airtime
 from matplotlib.lines import Line2D
@@ -75,11 +75,7 @@ def plotAirtime(phyParams):
     bw_list = [125, 250, 500]
     sf_list = [7, 8, 9, 10, 11, 12]
     
-    time_in_air = zeros((len(bw_list), len(sf_list)))
-    
-    for i,bw in enumerate(bw_list):
-        for j,sf in enumerate(sf_list):
-            time_in_air[i,j] = airtime((sf, rdd, bw, packetLength, preambleLength, syncLength, headerEnable, crc))
+    time_in_air = airtime((array(sf_list).reshape((1, -1)), rdd, array(bw_list).reshape((-1, 1)), packetLength, preambleLength, syncLength, headerEnable, crc))
             
     fig, airtime_fig = plt.subplots(figsize=(12,6))
     
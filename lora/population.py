@@ -0,0 +1,87 @@
+""" LPWAN Simulator: node population
+============================================
+Utilities (:mod:`lora.population`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   NodePopulation           -- Structure-of-arrays storage of the node state.
+   column                   -- Property exposing a population column as a node attribute.
+"""
+import numpy as np
+from .rng import RandomStreams
+
+__all__ = ['MODES', 'NodePopulation', 'column']
+
+# node modes, in the order of their integer codes
+MODES = ["UNIFORM", "RANDOM", "SMART"]
+
+class NodePopulation():
+    """ LPWAN Simulator: node population
+    Contiguous arrays holding the state of all nodes. Row i of every array
+    belongs to the i-th node added to the population; the learning arrays
+    are N x K matrices where K is the largest number of actions of a node
+    (rows of nodes with fewer actions are padded with zeros).
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] nrNodes: number of nodes
+    \param [IN] nrActions: maximum number of actions of a node
+    \param [IN] streams: random streams of the nodes (see lora.rng, unseeded if None)
+
+    """
+    def __init__(self, nrNodes, nrActions, streams=None):
+        self.size = 0
+        self.streams = streams if streams is not None else RandomStreams(None, nrNodes)
+        self.x = np.zeros(nrNodes)
+        self.y = np.zeros(nrNodes)
+        self.period = np.zeros(nrNodes)
+        self.mode = np.zeros(nrNodes, dtype=np.int8)
+        self.nrActions = np.zeros(nrNodes, dtype=np.int64)
+
+        # learning (log-weights, see lora.learning)
+        self.logWeight = np.full((nrNodes, nrActions), -np.inf)
+        self.prob = np.zeros((nrNodes, nrActions))
+        self.learningRate = np.zeros(nrNodes)
+        self.alpha = np.zeros(nrNodes)
+
+        # measurement params
+        self.packetNumber = np.zeros(nrNodes, dtype=np.int64)
+        self.packetsTransmitted = np.zeros(nrNodes, dtype=np.int64)
+        self.packetsSuccessful = np.zeros(nrNodes, dtype=np.int64)
+        self.transmitTime = np.zeros(nrNodes)
+        self.energy = np.zeros(nrNodes)
+
+    def __len__(self):
+        return self.size
+
+    def allocate(self):
+        """ Reserve the next row for a node.
+        Returns
+        -------
+        row: int
+            Row of the node in the population arrays.
+        """
+        if self.size == len(self.x):
+            raise ValueError("Node population is full!")
+        row = self.size
+        self.size += 1
+        return row
+
+def column(name, doc=None):
+    """ Property reading and writing the row of a node in a population array.
+    Parameters
+    ----------
+    name : string
+        Name of the population array.
+    doc: string
+        Docstring of the property.
+    Returns
+    -------
+    property
+    """
+    def fget(self):
+        return getattr(self.population, name)[self.row]
+    def fset(self, value):
+        getattr(self.population, name)[self.row] = value
+    return property(fget, fset, doc=doc)
@@ -0,0 +1,117 @@
+""" LPWAN Simulator: random streams
+============================================
+Utilities (:mod:`lora.rng`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   RandomStreams            -- Seeded per-node random streams drawn in blocks.
+
+All the random draws of a simulation come from one SeedSequence. The
+network has its own streams (the external traffic and the aggregated
+background traffic, see lora.background) and every node has
+two independent ones, keyed by its id: one for the inter-arrival times and
+one for its choices (actions, random probabilities). A stream only depends
+on the seed and the id of the node, so the draws of a node are the same
+whatever the other nodes and the engine, and runs can be split between
+processes. The variates are drawn in blocks: a draw reads the next value
+of the block of the node and the block is refilled from its generator when
+it is exhausted. The blocks are drawn in sequence from the generators, so
+the variates do not depend on the block size; they take 16 * blockSize
+bytes per node (512 MB for a million nodes with the default 32 variates),
+a smaller block trades memory for more refills.
+"""
+import numpy as np
+
+__all__ = ['RandomStreams']
+
+# spawn keys of the streams
+NETWORK, ARRIVALS, CHOICES = 0, 1, 2
+
+class RandomStreams():
+    """ LPWAN Simulator: random streams
+    Blocks of standard exponential and uniform variates of each node
+    (row i of the arrays belongs to row i of the node population).
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] seed: seed of the simulation (None: fresh entropy)
+    \param [IN] nrNodes: number of nodes
+    \param [IN] blockSize: number of variates drawn at once (16 * blockSize bytes per node)
+
+    """
+    def __init__(self, seed, nrNodes, blockSize=32):
+        self.root = np.random.SeedSequence(seed)
+        self.blockSize = blockSize
+        self.network = np.random.default_rng(self.spawn(NETWORK, 0))
+        self.background = np.random.default_rng(self.spawn(NETWORK, 1))
+        self.keys = np.arange(nrNodes) # key (node id) of the streams of each row
+        self.arrivals = [None] * nrNodes # generators, created at the first refill
+        self.choices = [None] * nrNodes
+        self.exponentials = np.zeros((nrNodes, blockSize))
+        self.uniforms = np.zeros((nrNodes, blockSize))
+        self.expPos = np.full(nrNodes, blockSize, dtype=np.int64)
+        self.uniPos = np.full(nrNodes, blockSize, dtype=np.int64)
+
+    def spawn(self, kind, key):
+        """ Child SeedSequence of a stream (as SeedSequence.spawn, but keyed)."""
+        return np.random.SeedSequence(self.root.entropy, spawn_key=self.root.spawn_key + (kind, int(key)),
+                                      pool_size=self.root.pool_size)
+
+    def seedNode(self, row, key):
+        """ Key the streams of a row with the id of its node."""
+        self.keys[row] = key
+        self.arrivals[row] = self.choices[row] = None
+        self.expPos[row] = self.uniPos[row] = self.blockSize
+
+    def refillExponentials(self, row):
+        """ Draw the next block of inter-arrival times of a row."""
+        if self.arrivals[row] is None:
+            self.arrivals[row] = np.random.default_rng(self.spawn(ARRIVALS, self.keys[row]))
+        self.arrivals[row].standard_exponential(out=self.exponentials[row])
+        self.expPos[row] = 0
+
+    def refillUniforms(self, row):
+        """ Draw the next block of uniform variates of a row."""
+        if self.choices[row] is None:
+            self.choices[row] = np.random.default_rng(self.spawn(CHOICES, self.keys[row]))
+        self.choices[row].random(out=self.uniforms[row])
+        self.uniPos[row] = 0
+
+    def exponential(self, row):
+        """ Next standard exponential variate of a node."""
+        pos = self.expPos[row]
+        if pos == self.blockSize:
+            self.refillExponentials(row)
+            pos = 0
+        self.expPos[row] = pos + 1
+        return self.exponentials[row, pos]
+
+    def uniform(self, row):
+        """ Next uniform variate in [0, 1) of a node."""
+        pos = self.uniPos[row]
+        if pos == self.blockSize:
+            self.refillUniforms(row)
+            pos = 0
+        self.uniPos[row] = pos + 1
+        return self.uniforms[row, pos]
+
+    def uniformVector(self, row, size):
+        """ Next size uniform variates of a node."""
+        return np.array([self.uniform(row) for i in range(size)])
+
+    def exponentialArray(self, rows):
+        """ Next standard exponential variate of each node of rows (distinct)."""
+        for row in rows[self.expPos[rows] == self.blockSize]:
+            self.refillExponentials(row)
+        values = self.exponentials[rows, self.expPos[rows]]
+        self.expPos[rows] += 1
+        return values
+
+    def uniformArray(self, rows):
+        """ Next uniform variate of each node of rows (distinct)."""
+        for row in rows[self.uniPos[rows] == self.blockSize]:
+            self.refillUniforms(row)
+        values = self.uniforms[rows, self.uniPos[rows]]
+        self.uniPos[rows] += 1
+        return values
@@ -0,0 +1,191 @@
+""" LPWAN Simulator: replication runner
+============================================
+Utilities (:mod:`lora.runner`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   readCheckpoints          -- Read the checkpoints saved by a run.
+   runReplication           -- Run one replication and summarize it.
+   runBatch                 -- Run replications together with the batched engine.
+   aggregate                -- Mean and confidence interval over replications.
+   run_replications         -- Run replications on a process pool.
+
+Each replication is a call of sim() with its own seed, in its own folder
+(logdir/exp_name/seed_X). All replications share the locations generated
+with the first seed (or config['scenarioSeed']), see lora.scenario. Workers send back small NumPy summaries read from the result files
+instead of the node and BS dictionaries (by default the replications save
+their checkpoints with metrics="npz", see lora.metrics). With the batched
+engine, the replications of a worker run together in one sim() call
+(logdir/exp_name/batch_X, where X is the first seed, holds the results of
+the first one) and their summaries are built in memory (see lora.batched).
+"""
+import numpy as np
+from os.path import join, isfile
+from statistics import NormalDist
+from concurrent.futures import ProcessPoolExecutor
+from .utils import sim, resultName
+from .batched import ReplicaBatch
+from .metrics import readMetrics
+
+__all__ = ['readCheckpoints', 'runReplication', 'runBatch', 'aggregate', 'run_replications']
+
+def lastLines(filename, nrLines, delimiter=None):
+    """ Last lines of a result file as an array (the files are appended by every run)."""
+    if nrLines == 0 or not isfile(filename):
+        return np.zeros((0,))
+    return np.loadtxt(filename, delimiter=delimiter, ndmin=2)[-nrLines:]
+
+def readCheckpoints(simu_dir, fname, metrics, nrCheckpoints, nodes):
+    """ Read the checkpoints saved by a run.
+    Parameters
+    ----------
+    simu_dir: string
+        Folder of the run.
+    fname: string
+        Name of the result files of the run (see lora.utils.resultName).
+    metrics: string
+        Format of the checkpoints ("csv" or "npz").
+    nrCheckpoints: int
+        Number of checkpoints of the run.
+    nodes: list of nodes
+        Nodes whose probabilities are read.
+    Returns
+    -------
+    ratio: array
+        Packet reception ratio at each checkpoint.
+    energy: array (checkpoints x 3)
+        Energy, transmitted and received packets at each checkpoint.
+    prob: array (checkpoints x nodes x actions)
+        Probabilities of the nodes at each checkpoint.
+    """
+    width = max([node.nrActions for node in nodes], default=0)
+    if metrics == 'npz':
+        metrics = readMetrics(simu_dir, fname)
+        energy = np.stack([metrics.get(key, np.zeros(0)) for key in ['energy', 'transmitted', 'received']], axis=1)
+        ratio = metrics.get('ratio', np.zeros(0))
+        prob = metrics['prob'][:, :, :width] if 'prob' in metrics else np.zeros((0, len(nodes), width))
+    else:
+        energy = lastLines(join(simu_dir, 'energy_' + fname + '.csv'), nrCheckpoints).reshape(-1, 3)
+        ratio = lastLines(join(simu_dir, 'ratio_' + fname + '.csv'), nrCheckpoints).reshape(-1)
+        prob = np.zeros((nrCheckpoints, len(nodes), width))
+        for i, node in enumerate(nodes):
+            prob[:, i, :node.nrActions] = lastLines(join(simu_dir, 'prob_' + fname + '_id_' + str(node.nodeid) + '.csv'), nrCheckpoints, ',').reshape(nrCheckpoints, node.nrActions)
+    return ratio, energy, prob
+
+def runReplication(config, seed):
+    """ Run one replication of a simulation.
+    Parameters
+    ----------
+    config: dict
+        Keyword arguments of sim().
+    seed: int
+        Seed of the replication.
+    Returns
+    -------
+    summary: dict
+        ratio, energy, transmitted, received: values at each checkpoint (every 100 hours).
+        prob: probabilities of the non-uniform nodes at each checkpoint (checkpoints x nodes x actions).
+        prr: packet reception ratio at the end.
+        final: number of transmitted and received packets, and energy at the end.
+    """
+    config = dict(config)
+    config['exp_name'] = join(config['exp_name'], 'seed_' + str(seed))
+    config['plot'] = False
+    bsDict, nodeDict = sim(seed=seed, **config)
+
+    simu_dir = join(config['logdir'], config['exp_name'])
+    simtime = config['horTime'] * config['avgSendTime']
+    nrCheckpoints = int(np.ceil(simtime / (100 * 3600000))) - 1
+    nodes = [node for node in nodeDict.values() if node.node_mode != "UNIFORM"]
+    ratio, energy, prob = readCheckpoints(simu_dir, resultName(config['nrIntNodes'], config['initial'], config['info_mode'], config['captureEffect'],
+                                                               config['interSFInterference']), config.get('metrics', 'csv'), nrCheckpoints, nodes)
+
+    nTransmitted = sum(node.packetsTransmitted for node in nodeDict.values())
+    nRecvd = sum(node.packetsSuccessful for node in nodeDict.values())
+    return {'ratio': ratio,
+            'energy': energy[:, 0], 'transmitted': energy[:, 1], 'received': energy[:, 2], 'prob': prob,
+            'prr': np.array(nRecvd/nTransmitted if nTransmitted else 0.0),
+            'final': np.array([nTransmitted, nRecvd, sum(node.energy for node in nodeDict.values())])}
+
+def runBatch(config, seeds):
+    """ Run replications together with the batched engine.
+    Parameters
+    ----------
+    config: dict
+        Keyword arguments of sim() (engine "batched").
+    seeds: list of ints
+        Seed of each replication.
+    Returns
+    -------
+    summaries: list of dict
+        Summary of each replication (see runReplication).
+    """
+    seeds = [int(seed) for seed in seeds]
+    config = dict(config)
+    config['exp_name'] = join(config['exp_name'], 'batch_' + str(seeds[0]))
+    config['plot'] = False
+    batch = ReplicaBatch(seeds)
+    sim(seed=seeds[0], replicas=batch, **config)
+    return batch.summaries
+
+def aggregate(summaries, confidence=0.95):
+    """ Mean and confidence interval (normal approximation) of the replications.
+    Parameters
+    ----------
+    summaries: list of dict
+        Summaries of the replications (see runReplication).
+    confidence: float
+        Confidence level of the intervals.
+    Returns
+    -------
+    results: dict
+        For each key of the summaries: key_mean and key_ci (half-width of the interval).
+    """
+    z = NormalDist().inv_cdf(0.5 + confidence/2)
+    results = {}
+    for key in summaries[0].keys():
+        values = np.stack([summary[key] for summary in summaries])
+        results[key + '_mean'] = np.mean(values, axis=0)
+        if len(summaries) > 1:
+            results[key + '_ci'] = z * np.std(values, axis=0, ddof=1) / np.sqrt(len(summaries))
+        else:
+            results[key + '_ci'] = np.zeros_like(results[key + '_mean'])
+    return results
+
+def run_replications(config, seeds, workers=1, confidence=0.95):
+    """ Run replications of a simulation on a process pool.
+    Parameters
+    ----------
+    config: dict
+        Keyword arguments of sim() (except seed and plot).
+    seeds: list of ints
+        Seed of each replication.
+    workers: int
+        Number of worker processes (1: run in this process).
+    confidence: float
+        Confidence level of the intervals.
+    Returns
+    -------
+    results: dict
+        Mean and confidence interval of the summaries (see aggregate), and the seeds.
+    """
+    seeds = list(seeds)
+    config = dict(config)
+    config.setdefault('scenarioSeed', seeds[0]) # same locations for all the replications
+    config.setdefault('metrics', 'npz')
+    if config.get('engine') == "batched":
+        if workers == 1:
+            summaries = runBatch(config, seeds)
+        else:
+            chunks = [list(chunk) for chunk in np.array_split(seeds, min(workers, len(seeds)))] # one batch per worker
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                summaries = [summary for summaries in executor.map(runBatch, [config] * len(chunks), chunks) for summary in summaries]
+    elif workers == 1:
+        summaries = [runReplication(config, seed) for seed in seeds]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            summaries = list(executor.map(runReplication, [config] * len(seeds), seeds))
+
+    results = aggregate(summaries, confidence)
+    results['seeds'] = np.array(seeds)
+    return results
@@ -0,0 +1,84 @@
+""" LPWAN Simulator: action sampler
+============================================
+Utilities (:mod:`lora.sampler`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   ActionSampler            -- Draw the action of a node from its probabilities.
+
+The probabilities of a node only change when it learns (myNode.updateProb)
+and many of them are 0 after pruning, but an action is drawn for every
+packet. The sampler keeps a table of the support (actions with a non-zero
+probability) and rebuilds it only after the probabilities changed. Small
+supports use the cumulative probabilities (binary search, same draw as the
+inverse CDF of the full vector); supports of more than ALIAS_SUPPORT actions
+use a Walker alias table, which draws an action in O(1).
+"""
+import numpy as np
+
+__all__ = ['ActionSampler', 'ALIAS_SUPPORT']
+
+# smallest support using an alias table
+ALIAS_SUPPORT = 64
+
+class ActionSampler():
+    """ LPWAN Simulator: action sampler
+    Draw actions from the probabilities of a node with one uniform variate.
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] prob: probabilities of the actions (a view, read when the tables are rebuilt)
+
+    """
+    __slots__ = ['prob', 'support', 'cdf', 'threshold', 'alias', 'stale']
+
+    def __init__(self, prob):
+        self.prob = prob
+        self.support = None
+        self.cdf = None
+        self.threshold = None
+        self.alias = None
+        self.stale = True
+
+    def invalidate(self):
+        """ The probabilities changed: rebuild the tables at the next draw."""
+        self.stale = True
+
+    def rebuild(self):
+        """ Tables of the support of the current probabilities."""
+        self.support = np.flatnonzero(self.prob)
+        p = self.prob[self.support]
+        if len(p) < ALIAS_SUPPORT:
+            self.cdf = p.cumsum()
+            self.threshold = self.alias = None
+        else:
+            # Walker alias table (Vose's construction)
+            n = len(p)
+            scaled = p * (n / p.sum())
+            self.threshold = np.ones(n)
+            self.alias = np.arange(n)
+            small = [i for i in range(n) if scaled[i] < 1]
+            large = [i for i in range(n) if scaled[i] >= 1]
+            while small and large:
+                s, l = small.pop(), large.pop()
+                self.threshold[s] = scaled[s]
+                self.alias[s] = l
+                scaled[l] -= 1 - scaled[s]
+                (small if scaled[l] < 1 else large).append(l)
+            self.cdf = None
+        self.stale = False
+
+    def sample(self, u):
+        """ Action drawn with the uniform variate u in [0, 1)."""
+        if self.stale:
+            self.rebuild()
+        if self.alias is None:
+            cdf = self.cdf
+            k = min(int(cdf.searchsorted(u * cdf[-1], side='right')), len(cdf) - 1)
+        else:
+            x = u * len(self.alias)
+            k = int(x)
+            if x - k >= self.threshold[k]:
+                k = self.alias[k]
+        return int(self.support[k])
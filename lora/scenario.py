@@ -0,0 +1,107 @@
+""" LPWAN Simulator: scenario store
+============================================
+Utilities (:mod:`lora.scenario`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   scenarioKey              -- Hash of the parameters of a scenario.
+   scenarioPath             -- File of a scenario in a folder.
+   saveScenario             -- Write a scenario to a single .npy file.
+   loadScenario             -- Open a scenario file (memory-mapped).
+
+A scenario (locations of the BSs and nodes, distMatrix, best SF/BW and the
+parameters it was generated from) is stored as a one-record structured
+array in logdir/scenario_<key>.npy, where the key is a hash of every
+parameter that changes the locations. The file is written atomically and
+opened with mmap_mode='r', so the worker processes of a run share its pages.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+from os.path import join
+
+__all__ = ['scenarioKey', 'scenarioPath', 'saveScenario', 'loadScenario']
+
+# bump when the placement of the nodes changes
+SCENARIO_VERSION = 1
+
+def jsonValue(value):
+    """ JSON representation of numpy values."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("Cannot hash {!r}".format(value))
+
+def scenarioKey(params):
+    """ Hash of the parameters of a scenario.
+    Parameters
+    ----------
+    params: dict
+        Every parameter which changes the locations (including the seed).
+    Returns
+    -------
+    key: string
+        Hexadecimal SHA-1 of the parameters.
+    """
+    params = dict(params, version=SCENARIO_VERSION)
+    text = json.dumps(params, sort_keys=True, default=jsonValue)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+def scenarioPath(logdir, params):
+    """ File of the scenario of the parameters in a folder."""
+    return join(logdir, "scenario_" + scenarioKey(params) + ".npy")
+
+def saveScenario(filename, BSLoc, nodeLoc, distMatrix, bestDist, bestSF, bestBW, params):
+    """ Write a scenario to a single structured .npy file.
+    Parameters
+    ----------
+    filename: string
+        File of the scenario.
+    BSLoc: array
+        Location of the BSs (nrBS x 3).
+    nodeLoc: array
+        Location of the nodes (nrNodes x 14).
+    distMatrix: array
+        Maximum distance of each SF.
+    bestDist, bestSF, bestBW: float, int, int
+        Maximum distance and its SF and BW.
+    params: dict
+        Parameters of the scenario (stored as JSON).
+    Returns
+    -------
+    """
+    meta = json.dumps(dict(params, version=SCENARIO_VERSION), sort_keys=True, default=jsonValue).encode()
+    dtype = np.dtype([('BSLoc', float, np.shape(BSLoc)), ('nodeLoc', float, np.shape(nodeLoc)),
+                      ('distMatrix', float, np.shape(distMatrix)), ('bestDist', float), ('bestSF', np.int64),
+                      ('bestBW', np.int64), ('meta', 'S' + str(len(meta)))])
+    record = np.zeros(1, dtype=dtype)
+    record['BSLoc'][0] = BSLoc
+    record['nodeLoc'][0] = nodeLoc
+    record['distMatrix'][0] = distMatrix
+    record['bestDist'] = bestDist
+    record['bestSF'] = bestSF
+    record['bestBW'] = bestBW
+    record['meta'] = meta
+    # write next to the target and rename: concurrent writers of the same scenario are harmless
+    temp = filename + "." + str(os.getpid()) + ".tmp"
+    with open(temp, "wb") as f:
+        np.save(f, record)
+    os.replace(temp, filename)
+
+def loadScenario(filename):
+    """ Open a scenario file.
+    Parameters
+    ----------
+    filename: string
+        File of the scenario.
+    Returns
+    -------
+    scenario: dict
+        BSLoc, nodeLoc and distMatrix (read-only memory-mapped arrays), bestDist, bestSF, bestBW and meta (dict).
+    """
+    record = np.load(filename, mmap_mode='r')
+    return {'BSLoc': record['BSLoc'][0], 'nodeLoc': record['nodeLoc'][0], 'distMatrix': record['distMatrix'][0],
+            'bestDist': float(record['bestDist'][0]), 'bestSF': int(record['bestSF'][0]),
+            'bestBW': int(record['bestBW'][0]), 'meta': json.loads(record['meta'][0].decode())}
@@ -0,0 +1,221 @@
+""" LPWAN Simulator: Event scheduler
+============================================
+Utilities (:mod:`lora.scheduler`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   Event                    -- Typed event record.
+   EventScheduler           -- Heap-based discrete event scheduler (alternative to SimPy).
+
+The scheduler runs the same node/BS semantics as transmitPacket, but every
+step of a transmission is a plain event record in a binary heap instead of
+a SimPy timeout resuming a generator. Events are ordered by (time, sequence
+number), which is the order SimPy uses for timeouts, so for a fixed seed the
+events happen in the same order and both engines give the same results.
+With a Poisson source (see lora.traffic) the arrivals of all the nodes are
+SOURCE events of the source instead of one ARRIVAL/IDLE cycle per node.
+The packets of the aggregated background traffic (see lora.background) are
+BACKGROUND events, which add their power at a BS, BACKGROUND_CRITICAL and
+BACKGROUND_END events.
+"""
+from collections import namedtuple
+from heapq import heappush, heappop
+from .bsFunctions import startTransmission, enterCritical, releasePacket, completeTransmission
+
+Event = namedtuple('Event', ['time', 'seq', 'kind', 'target'])
+
+# event kinds
+ARRIVAL = 0     # inter-packet wait is over, start a packet
+CRITICAL = 1    # critical section of the packet starts
+END = 2         # packet is completely sent
+ACK = 3         # ACK from a BS is completely received
+IDLE = 4        # wait to the next period is over
+PERIODIC = 5    # periodic task (clock, saving results)
+SOURCE = 6      # next arrival of a Poisson source
+BACKGROUND = 7  # a background packet starts
+BACKGROUND_CRITICAL = 8 # critical section of a background packet starts
+BACKGROUND_END = 9 # a background packet ends
+
+class TransmissionState():
+    """ LPWAN Simulator: state of the packet being sent by a node
+    Replaces the local variables of the transmitPacket generator.
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] node: node sending the packet
+    \param [IN] index: index of the node in its Poisson source (None: the node has its own arrivals)
+
+    """
+    def __init__(self, node, index=None):
+        self.node = node
+        self.index = index
+        self.bsids = list(node.proximateBS.keys())
+        self.bsPos = 0
+        self.Tcritical = 0
+        self.Trest = 0
+        self.ACKrest = 0
+        self.successfulRx = False
+
+class EventScheduler():
+    """ LPWAN Simulator: event scheduler
+    Heap-based discrete event scheduler
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] bsDict: dictionary of BSs
+    \param [IN] logDistParams: log shadowing channel parameters
+    \param [IN] algo: learning algorithm
+    \param [IN] stats: network statistics to update (see lora.stats)
+    \param [IN] airtimes: durations of the packets (see lora.timing)
+
+    """
+    def __init__(self, bsDict, logDistParams, algo, stats=None, airtimes=None):
+        self.bsDict = bsDict
+        self.logDistParams = logDistParams
+        self.algo = algo
+        self.stats = stats
+        self.airtimes = airtimes
+        self.now = 0
+        self.queue = []
+        self.seq = 0
+        self.source = None
+        self.states = None
+        self.background = None
+        self.handlers = {ARRIVAL: self.onArrival, CRITICAL: self.onCritical, END: self.onEnd,
+                         ACK: self.onACK, IDLE: self.onIdle, PERIODIC: self.onPeriodic,
+                         SOURCE: self.onSource, BACKGROUND: self.onBackground,
+                         BACKGROUND_CRITICAL: self.onBackgroundCritical, BACKGROUND_END: self.onBackgroundEnd}
+
+    def schedule(self, delay, kind, target):
+        """ Schedule an event after a delay.
+        Parameters
+        ----------
+        delay: float
+            Delay from now in ms.
+        kind: int
+            Kind of the event.
+        target: object
+            Object the event applies to.
+        Returns
+        -------
+        """
+        if delay < 0:
+            raise ValueError("Negative delay {}".format(delay)) # as simpy.Environment.timeout
+        heappush(self.queue, Event(self.now + delay, self.seq, kind, target))
+        self.seq += 1
+
+    def addNode(self, node):
+        """ Start the transmission process of a node."""
+        self.onIdle(TransmissionState(node))
+
+    def addSource(self, source):
+        """ Start the arrivals of a Poisson source (see lora.traffic)."""
+        self.source = source
+        self.states = [TransmissionState(node, i) for i, node in enumerate(source.nodes)]
+        gap, i = source.next()
+        self.schedule(gap, SOURCE, self.states[i])
+
+    def addBackground(self, background):
+        """ Start the aggregated background traffic (see lora.background)."""
+        self.background = background
+        if background.rate > 0:
+            gap, e = background.next()
+            self.schedule(gap, BACKGROUND, e)
+
+    def addPeriodic(self, interval, callback):
+        """ Call callback() every interval ms."""
+        self.schedule(interval, PERIODIC, (interval, callback))
+
+    def run(self, until):
+        """ Process the events until the simulation time is reached.
+        Parameters
+        ----------
+        until: float
+            Simulation time in ms.
+        Returns
+        -------
+        """
+        queue = self.queue
+        handlers = self.handlers
+        while queue and queue[0].time < until:
+            event = heappop(queue)
+            self.now = event.time
+            handlers[event.kind](event.target)
+        self.now = until
+
+    def onIdle(self, state):
+        # The inter-packet waiting time. Assumed to be exponential here.
+        self.schedule(state.node.interArrival(), ARRIVAL, state)
+
+    def onArrival(self, state):
+        state.Tcritical = startTransmission(state.node, self.bsDict, self.logDistParams, self.stats, self.airtimes)
+        self.schedule(state.Tcritical, CRITICAL, state)
+
+    def onCritical(self, state):
+        state.Trest = enterCritical(state.node, self.bsDict, state.Tcritical, self.airtimes)
+        self.schedule(state.Trest, END, state)
+
+    def onEnd(self, state):
+        state.bsPos = 0
+        state.ACKrest = 0
+        state.successfulRx = False
+        self.releaseNext(state)
+
+    def onACK(self, state):
+        node = state.node
+        bsid = state.bsids[state.bsPos]
+        node.addACK(self.bsDict[bsid].bsid, node.packet)
+        state.successfulRx = True
+        state.bsPos += 1
+        self.releaseNext(state)
+
+    def releaseNext(self, state):
+        """ Release the packet at the remaining BSs until one sends an ACK."""
+        node = state.node
+        while state.bsPos < len(state.bsids):
+            ACKrest = releasePacket(node, self.bsDict, state.bsids[state.bsPos], self.airtimes)
+            if ACKrest is not None:
+                state.ACKrest = ACKrest
+                self.schedule(ACKrest, ACK, state)
+                return
+            state.bsPos += 1
+        completeTransmission(node, self.algo, state.successfulRx, self.stats)
+        rest = float(node.period)-state.Tcritical-state.Trest-state.ACKrest
+        if state.index is None:
+            self.schedule(rest, IDLE, state)
+        else:
+            self.source.release(state.index, self.now + rest)
+
+    def onSource(self, state):
+        # arrival of the source at the node of state, ignored if the node is busy
+        source = self.source
+        accepted = source.accept(state.index, self.now)
+        gap, i = source.next()
+        self.schedule(gap, SOURCE, self.states[i])
+        if accepted:
+            self.onArrival(state)
+
+    def onBackground(self, e):
+        background = self.background
+        background.inject(self.bsDict, e)
+        if background.isLost[e]: # below the sensitivity, never demodulated
+            self.schedule(background.airtime[e], BACKGROUND_END, (e, False))
+        else:
+            self.schedule(background.tcritical[e], BACKGROUND_CRITICAL, e)
+        gap, e = background.next()
+        self.schedule(gap, BACKGROUND, e)
+
+    def onBackgroundCritical(self, e):
+        held = self.background.demodulate(self.bsDict, e)
+        self.schedule(self.background.trest[e], BACKGROUND_END, (e, held))
+
+    def onBackgroundEnd(self, target):
+        e, held = target
+        self.background.release(self.bsDict, e, held)
+
+    def onPeriodic(self, task):
+        interval, callback = task
+        callback()
+        self.schedule(interval, PERIODIC, task)
@@ -0,0 +1,132 @@
+""" LPWAN Simulator: spatial index
+============================================
+Utilities (:mod:`lora.spatial`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   BSGridIndex              -- Grid hash of the base-station locations.
+   interferenceClusters     -- Groups of nodes and base-stations that never interact.
+"""
+import numpy as np
+
+__all__ = ['BSGridIndex', 'interferenceClusters']
+
+class BSGridIndex():
+    """ LPWAN Simulator: grid index of base stations
+    Buckets the base stations in square cells so that a radius query only
+    computes the distances to the base stations of the cells overlapping the
+    disc. Queries return the base stations in the order of the list and the
+    same distances as a full scan.
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] bsList: array of base stations, one row [id x y] per BS
+    \param [IN] cellSize: side of a cell in m (e.g. the maximum query radius)
+
+    """
+    def __init__(self, bsList, cellSize):
+        self.bsList = bsList
+        self.x = np.asarray(bsList[:, 1], dtype=float)
+        self.y = np.asarray(bsList[:, 2], dtype=float)
+        self.cellSize = float(cellSize)
+        self.cells = {}
+        cx = np.floor(self.x / self.cellSize).astype(np.int64)
+        cy = np.floor(self.y / self.cellSize).astype(np.int64)
+        for i in range(len(self.x)):
+            self.cells.setdefault((cx[i], cy[i]), []).append(i)
+        self.cells = {cell: np.array(rows, dtype=np.int64) for cell, rows in self.cells.items()}
+
+    def __len__(self):
+        return len(self.x)
+
+    def candidates(self, x, y, radius):
+        """ Rows of the base stations in the cells overlapping a disc (in list order)."""
+        x0, x1 = int(np.floor((x - radius) / self.cellSize)), int(np.floor((x + radius) / self.cellSize))
+        y0, y1 = int(np.floor((y - radius) / self.cellSize)), int(np.floor((y + radius) / self.cellSize))
+        if (x1 - x0 + 1) * (y1 - y0 + 1) >= len(self.cells):
+            rows = [r for (cx, cy), r in self.cells.items() if x0 <= cx <= x1 and y0 <= cy <= y1]
+        else:
+            rows = [self.cells[(cx, cy)] for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1) if (cx, cy) in self.cells]
+        if not rows:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(rows))
+
+    def query(self, x, y, radius):
+        """ Base stations within a distance of a point.
+        Parameters
+        ----------
+        x, y: float
+            Location of the point.
+        radius: float
+            Maximum distance in m.
+        Returns
+        -------
+        rows: 1D ndarray of ints
+            Rows of the base stations in the list.
+        dist: 1D ndarray of floats
+            Distance to each of them.
+        """
+        rows = self.candidates(x, y, radius)
+        dist = np.sqrt((self.x[rows] - x)**2 + (self.y[rows] - y)**2)
+        inRange = dist <= radius
+        return rows[inRange], dist[inRange]
+
+    def countWithin(self, x, y, radius):
+        """ Number of base stations at a distance <= radius of a point."""
+        rows = self.candidates(x, y, radius)
+        return int(np.count_nonzero((self.x[rows] - x)**2 + (self.y[rows] - y)**2 <= radius**2))
+
+    def countBeyond(self, x, y, radius):
+        """ Number of base stations at a distance >= radius of a point."""
+        rows = self.candidates(x, y, radius)
+        return len(self.x) - int(np.count_nonzero((self.x[rows] - x)**2 + (self.y[rows] - y)**2 < radius**2))
+
+def interferenceClusters(nodeList, bsList, radius, cellSize=None):
+    """ Split the network into clusters closed under interference.
+    A node only touches the base stations within radius (its proximate BSs,
+    see myNode.generateProximateBS), so the connected components of the
+    node/BS graph evolve independently.
+    Parameters
+    ----------
+    nodeList: array
+        Nodes, one row [id x y ...] per node.
+    bsList: array
+        Base stations, one row [id x y] per BS.
+    radius: float
+        Interference distance of a node in m.
+    cellSize: float
+        Side of a cell of the grid index (radius if None).
+    Returns
+    -------
+    clusters: list of (nodeIds, bsIds)
+        Ids of the nodes and base stations of each cluster, largest first.
+        The nodes without a base station in range interact with nobody and
+        are added to the largest cluster; the base stations out of range of
+        every node receive nothing and are left out.
+    """
+    index = BSGridIndex(bsList, radius if cellSize is None else cellSize)
+    parent = np.arange(len(bsList)) # union-find over the rows of bsList
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    rows = []
+    for x, y in zip(nodeList[:, 1], nodeList[:, 2]):
+        bs, _ = index.query(x, y, radius)
+        rows.append(bs)
+        roots = [find(i) for i in bs]
+        for r in roots[1:]:
+            parent[find(r)] = find(roots[0])
+    roots = np.array([find(i) for i in range(len(bsList))], dtype=np.int64)
+    labels, bsCluster = np.unique(roots, return_inverse=True)
+    nodeCluster = np.array([bsCluster[bs[0]] if len(bs) else -1 for bs in rows], dtype=np.int64)
+    sizes = np.bincount(nodeCluster[nodeCluster >= 0], minlength=len(labels))
+    order = np.argsort(-sizes, kind='stable')
+    order = order[sizes[order] > 0] # clusters of base stations without nodes
+    if len(order):
+        nodeCluster[nodeCluster < 0] = order[0]
+    elif len(nodeList):
+        return [(nodeList[:, 0].astype(np.int64), bsList[:, 0].astype(np.int64))]
+    return [(nodeList[nodeCluster == c, 0].astype(np.int64), bsList[bsCluster == c, 0].astype(np.int64)) for c in order]
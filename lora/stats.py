@@ -0,0 +1,71 @@
+""" LPWAN Simulator: network statistics
+============================================
+Utilities (:mod:`lora.stats`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   NetworkStats             -- Running totals and (SF, channel) occupancy of the network.
+
+The transmission process updates the statistics when a node draws a new
+action and when a packet is completed, so a checkpoint reads the totals in
+O(1) and the normalized traffic in O(|SF|.|F|) instead of scanning the nodes.
+"""
+import numpy as np
+
+__all__ = ['NetworkStats']
+
+class NetworkStats():
+    """ LPWAN Simulator: network statistics
+    Totals of transmitted and received packets and energy, and the number of
+    nodes whose current action uses each (SF, channel).
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] sfSet: set of spreading factors
+    \param [IN] freqSet: set of channels
+    \param [IN] airtimeSF: airtime of a packet at each SF of sfSet
+
+    """
+    def __init__(self, sfSet, freqSet, airtimeSF):
+        self.sfIndex = {sf: i for i, sf in enumerate(sfSet)}
+        self.freqIndex = {freq: j for j, freq in enumerate(freqSet)}
+        self.airtimeSF = np.asarray(airtimeSF, dtype=float)
+        self.occupancy = np.zeros((len(sfSet), len(freqSet)), dtype=np.int64)
+        self.transmitted = 0
+        self.received = 0
+        self.energy = 0.0
+
+    def moveNode(self, old, new):
+        """ Move a node from the (sf, freq) cell old to new (None: no action yet)."""
+        if old == new:
+            return
+        if old[0] is not None and old[1] is not None:
+            self.occupancy[self.sfIndex[old[0]], self.freqIndex[old[1]]] -= 1
+        if new[0] is not None and new[1] is not None:
+            self.occupancy[self.sfIndex[new[0]], self.freqIndex[new[1]]] += 1
+
+    def addPacket(self, energy, received):
+        """ Count a completed packet, its energy and whether it was received (0 or 1)."""
+        self.transmitted += 1
+        self.received += received
+        self.energy += energy
+
+    def traffic(self, lambda_i, lambda_e):
+        """ Normalized traffic and throughput of each (SF, channel).
+        Parameters
+        ----------
+        lambda_i: float
+            packet generation rate of a node
+        lambda_e: array
+            external traffic of each (SF, channel)
+        Returns
+        -------
+        Gsc: array
+            normalized traffic
+        Tsc: array
+            throughput (ALOHA)
+        """
+        Gsc = (lambda_e + lambda_i * self.occupancy) * self.airtimeSF[:, None]
+        Tsc = Gsc * np.exp(-2* Gsc)
+        return Gsc, Tsc
@@ -0,0 +1,158 @@
+""" LPWAN Simulator: parameter sweeps
+============================================
+Utilities (:mod:`lora.sweep`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   loadSpec                 -- Read a sweep specification (JSON or YAML).
+   expandConfigs            -- List the sim() configurations of a specification.
+   runConfig                -- Run one configuration and summarize it.
+   runSweep                 -- Run the configurations on a worker pool.
+
+A specification holds the common sim() arguments in "base" and either a
+"grid" (every combination of the listed values) or a list of "configs"
+(each one overrides the base), e.g.
+
+    {"base": {"nrBS": 1, "initial": "UNIFORM", ..., "logdir": "logs", "exp_name": "sweep"},
+     "grid": {"nrIntNodes": [0, 50, 100], "algo": ["exp3", "exp3s"]}}
+
+In YAML files, quote "NO" (info_mode), otherwise it is read as false.
+
+Run i writes its files to logdir/exp_name/run_i. Runs with the same
+geometry share the scenario saved in logdir (see lora.scenario).
+Usage: python -m lora.sweep spec.json --workers 8 --output results.csv
+"""
+import csv
+import json
+import time
+import argparse
+import itertools
+from os.path import join, splitext
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+from .utils import sim
+
+__all__ = ['loadSpec', 'expandConfigs', 'runConfig', 'runSweep']
+
+def loadSpec(filename):
+    """ Read a sweep specification.
+    Parameters
+    ----------
+    filename: string
+        JSON file, or YAML file (.yaml/.yml, needs PyYAML).
+    Returns
+    -------
+    spec: dict
+    """
+    with open(filename) as f:
+        if splitext(filename)[1] in ['.yaml', '.yml']:
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("PyYAML is required to read YAML sweep specifications.")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+def expandConfigs(spec):
+    """ List the sim() configurations of a specification.
+    Parameters
+    ----------
+    spec: dict
+        Specification with "base" and "grid" or "configs".
+    Returns
+    -------
+    configs: list of dict
+        Keyword arguments of sim().
+    """
+    base = dict(spec.get('base', {}))
+    if 'grid' in spec:
+        keys = list(spec['grid'].keys())
+        return [dict(base, **dict(zip(keys, values))) for values in itertools.product(*spec['grid'].values())]
+    return [dict(base, **config) for config in spec.get('configs', [{}])]
+
+def runConfig(config):
+    """ Run one configuration.
+    Parameters
+    ----------
+    config: dict
+        Keyword arguments of sim().
+    Returns
+    -------
+    metrics: dict
+        transmitted, received, ratio, energy and wall-clock time of the run.
+    """
+    start = time.time()
+    bsDict, nodeDict = sim(plot=False, **config)
+    nTransmitted = sum(node.packetsTransmitted for node in nodeDict.values())
+    nRecvd = sum(node.packetsSuccessful for node in nodeDict.values())
+    return {'transmitted': int(nTransmitted), 'received': int(nRecvd), 'ratio': nRecvd/nTransmitted,
+            'energy': float(sum(node.energy for node in nodeDict.values())), 'runtime': time.time() - start}
+
+def tableValue(value):
+    """ Value of a configuration in the results table (lists as space separated strings)."""
+    if isinstance(value, (list, tuple)):
+        return " ".join(str(v) for v in value)
+    return value
+
+def runSweep(configs, workers=1, output=None):
+    """ Run configurations on a local worker pool.
+    Parameters
+    ----------
+    configs: list of dict
+        Keyword arguments of sim() (see expandConfigs).
+    workers: int
+        Maximum number of runs at the same time (1: run in this process).
+    output: string
+        CSV file, one row is written as soon as a run finishes.
+    Returns
+    -------
+    results: DataFrame
+        One row per run: run index, configuration and metrics.
+    """
+    configs = [dict(config, exp_name=join(config['exp_name'], 'run_' + str(i))) for i, config in enumerate(configs)]
+    ready = list(range(len(configs)))
+
+    columns = ['run'] + list(dict.fromkeys(k for config in configs for k in config.keys())) + ['transmitted', 'received', 'ratio', 'energy', 'runtime']
+    rows = []
+    f = open(output, 'w', newline='') if output is not None else None
+    writer = csv.DictWriter(f, fieldnames=columns) if f is not None else None
+    if writer is not None:
+        writer.writeheader()
+
+    def finish(i, metrics):
+        row = {'run': i}
+        row.update({k: tableValue(v) for k, v in configs[i].items()})
+        row.update(metrics)
+        rows.append(row)
+        if writer is not None:
+            writer.writerow(row)
+            f.flush()
+
+    try:
+        if workers == 1:
+            while ready:
+                i = ready.pop(0)
+                finish(i, runConfig(configs[i]))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                running = {}
+                while ready or running:
+                    while ready and len(running) < workers:
+                        i = ready.pop(0)
+                        running[executor.submit(runConfig, configs[i])] = i
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(running.pop(future), future.result())
+    finally:
+        if f is not None:
+            f.close()
+
+    return pd.DataFrame(rows, columns=columns).sort_values('run').reset_index(drop=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("spec", type=str)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--output", type=str, default="sweep.csv")
+    args = parser.parse_args()
+    print(runSweep(expandConfigs(loadSpec(args.spec)), args.workers, args.output))
@@ -0,0 +1,50 @@
+""" LPWAN Simulator: airtime table
+============================================
+Utilities (:mod:`lora.timing`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   AirtimeTable             -- Airtimes and critical-section delays of every (SF, BW).
+
+All the nodes of a simulation send packets with the same physical layer
+parameters, so the airtime of a packet only depends on its SF and BW. The
+table computes them once (see kernels.packetAirtime) and the transmission
+process looks the durations up instead of recomputing them for every packet.
+"""
+import numpy as np
+from . import kernels
+
+__all__ = ['AirtimeTable']
+
+class AirtimeTable():
+    """ LPWAN Simulator: airtime table
+    Airtime and time to the critical section of a packet for every (SF, BW).
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] phyParams: physical layer parameters (rdd, packetLength, preambleLength, syncLength, headerEnable, crc)
+    \param [IN] sfSet: set of spreading factors
+    \param [IN] bwSet: set of bandwidths
+
+    """
+    def __init__(self, phyParams, sfSet=(7, 8, 9, 10, 11, 12), bwSet=(125, 250, 500)):
+        rdd, packetLength, preambleLength, syncLength, headerEnable, crc = phyParams
+        self.sfSet = list(sfSet)
+        self.bwSet = list(bwSet)
+        sf = np.array(self.sfSet).reshape((-1, 1))
+        bw = np.array(self.bwSet).reshape((1, -1))
+        self.airtime = np.array([[kernels.packetAirtime(s, rdd, b, packetLength, preambleLength, syncLength, headerEnable, crc)
+                                  for b in self.bwSet] for s in self.sfSet], dtype=float)
+        self.tcritical = (2.0**sf/bw)*(preambleLength - 5)
+        self.durations = {(s, b): (float(self.tcritical[i, j]), float(self.airtime[i, j]))
+                          for i, s in enumerate(self.sfSet) for j, b in enumerate(self.bwSet)}
+
+    @classmethod
+    def fromPacket(cls, packet, sfSet=(7, 8, 9, 10, 11, 12), bwSet=(125, 250, 500)):
+        """ Table of the physical layer parameters of a packet."""
+        return cls((packet.rdd, packet.packetLength, packet.preambleLength, packet.syncLength, packet.headerEnable, packet.crc), sfSet, bwSet)
+
+    def lookup(self, sf, bw):
+        """ Time to the critical section and airtime of a packet (in ms)."""
+        return self.durations[(sf, bw)]
@@ -0,0 +1,122 @@
+""" LPWAN Simulator: Poisson traffic source
+============================================
+Utilities (:mod:`lora.traffic`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   PoissonSource            -- Merged arrivals of all the nodes.
+   sourceProcess            -- SimPy process of a Poisson source.
+
+A node waits an Exp(period) time, sends a packet and waits until the end
+of its period before the next wait. Equivalently, a Poisson process with
+rate 1/period knocks on the node and the arrivals that find it busy (from
+the start of a packet to the end of its period) are ignored: by the
+memoryless property the wait from the end of a period to the next accepted
+arrival is again Exp(period). The processes of all the nodes merge into a
+single Poisson stream with the summed rate, in which each arrival picks
+its node with a probability proportional to its rate. A source therefore
+replaces the per-node processes by a single one: only the packets on air
+hold events, so the event queue and the memory of the processes no longer
+grow with the number of nodes. The nodes with the same period form a rate
+class and a node is picked in O(1) with one uniform variate.
+
+The source draws from the network stream (see lora.rng): the packets of a
+node are not the same as with the per-node processes, but they have the
+same distribution.
+"""
+import numpy as np
+from .bsFunctions import sendPacket
+
+__all__ = ['PoissonSource', 'sourceProcess']
+
+class PoissonSource():
+    """ LPWAN Simulator: Poisson traffic source
+    Merged arrivals of the nodes, grouped in rate classes.
+
+    |category /LoRa
+    |keywords lora
+
+    \param [IN] nodes: list of nodes
+    \param [IN] rng: random generator (e.g. the network stream of lora.rng)
+    \param [IN] blockSize: number of variates drawn at once
+
+    """
+    def __init__(self, nodes, rng, blockSize=4096):
+        self.nodes = list(nodes)
+        self.rng = rng
+        self.blockSize = blockSize
+        periods = np.array([node.period for node in self.nodes], dtype=float)
+        classPeriods, inverse = np.unique(periods, return_inverse=True)
+        self.members = [np.flatnonzero(inverse == c) for c in range(len(classPeriods))]
+        classRate = np.array([len(members) for members in self.members])/classPeriods
+        self.cumRate = np.cumsum(classRate)
+        self.rate = self.cumRate[-1] # arrivals per ms
+        self.busyUntil = np.zeros(len(self.nodes)) # end of the period of the last packet of each node
+        self.pos = blockSize
+
+    def refill(self):
+        """ Draw the next block of inter-arrival times and picks."""
+        self.gaps = self.rng.standard_exponential(self.blockSize)/self.rate
+        self.picks = self.rng.random(self.blockSize) * self.rate
+        self.pos = 0
+
+    def next(self):
+        """ Next arrival of the merged stream.
+        Returns
+        -------
+        gap: float
+            Time until the arrival (ms).
+        i: int
+            Index of the picked node in nodes.
+        """
+        if self.pos == self.blockSize:
+            self.refill()
+        gap, x = self.gaps[self.pos], self.picks[self.pos]
+        self.pos += 1
+        c = min(int(self.cumRate.searchsorted(x, side='right')), len(self.members) - 1)
+        members = self.members[c]
+        low = self.cumRate[c - 1] if c > 0 else 0.0
+        k = min(int((x - low)/(self.cumRate[c] - low) * len(members)), len(members) - 1)
+        return gap, int(members[k])
+
+    def accept(self, i, now):
+        """ The node is idle at time now: it sends a packet (busy until it completes)."""
+        if now < self.busyUntil[i]:
+            return False
+        self.busyUntil[i] = np.inf
+        return True
+
+    def release(self, i, until):
+        """ The packet of the node completed, the node is busy until the end of its period."""
+        self.busyUntil[i] = until
+
+def sourceProcess(env, source, bsDict, logDistParams, algo, stats=None, airtimes=None):
+    """ Send the packets of a Poisson source (one SimPy process per packet on air).
+    Parameters
+    ----------
+    env : simpy environement
+        Simulation environment.
+    source: PoissonSource
+        Merged arrivals of the nodes.
+    bsDict: dict
+        list of BSs.
+    logDistParams: list
+        channel params
+    algo: string
+        learning algorithm
+    stats: NetworkStats
+        network statistics to update (see lora.stats)
+    airtimes: AirtimeTable
+        durations of the packets (see lora.timing)
+    Returns
+    -------
+    """
+    def send(i):
+        rest = yield from sendPacket(env, source.nodes[i], bsDict, logDistParams, algo, stats, airtimes)
+        source.release(i, env.now + rest)
+
+    while True:
+        gap, i = source.next()
+        yield env.timeout(gap)
+        if source.accept(i, env.now):
+            env.process(send(i))
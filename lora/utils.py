@@ -5,20 +5,35 @@ Utilities (:mod:`lora.utils`)
 .. autosummary::
    :toctree: generated/
    print_params             -- Print the arguments of the simulation.
+   makeScenario             -- Generate or load the locations.
    sim                      -- Run the simulation
 """    
 import os
+import random
 import numpy as np
 from os.path import join, exists
 from os import makedirs
 import simpy
 from .node import myNode
-from .bs import myBS
-from .bsFunctions import transmitPacket, cuckooClock, saveProb, saveRatio, saveEnergy, saveTraffic
-from .loratools import dBmTomW, getMaxTransmitDistance, placeRandomlyInRange, placeRandomly
+from .population import NodePopulation
+from .rng import RandomStreams
+from .bs import myBS, myLazyBS
+from .kernels import useKernels
+from .bsFunctions import transmitPacket, cuckooClock, saveResults, writeResults
+from .scheduler import EventScheduler
+from .traffic import PoissonSource, sourceProcess
+from .background import BackgroundTraffic, backgroundProcess
+from .vectorized import runVectorized
+from .batched import runBatched, ReplicaBatch
+from .loratools import dBmTomW, getMaxTransmitDistance, placeInRings, placeRandomly
 from .plotting import plotLocations
+from .spatial import BSGridIndex
+from .scenario import scenarioPath, saveScenario, loadScenario
+from .metrics import MetricsSink
+from .stats import NetworkStats
+from .timing import AirtimeTable
 
-def print_params(nrNodes, nrIntNodes, nrBS, initial, radius, distribution, avgSendTime, horTime, packetLength, sfSet, freqSet, powSet, captureEffect, interSFInterference, info_mode, algo):
+def print_params(nrNodes, nrIntNodes, nrBS, initial, radius, distribution, avgSendTime, horTime, packetLength, sfSet, freqSet, powSet, captureEffect, interSFInterference, info_mode, algo, engine="simpy"):
     # print parametters
     print("Simulation Parameters:")
     print ("\t Nodes:",nrNodes)
@@ -37,40 +52,167 @@ def print_params(nrNodes, nrIntNodes, nrBS, initial, radius, distribution, avgSe
     print ("\t Inter-SF Interference:",interSFInterference)
     print ("\t Information mode:",info_mode)
     print ("\t Learning algorithm:", algo)
+    print ("\t Simulation engine:", engine)
         
+# maximum simulation area in m
+GRID = [int(10000), int(10000)]
+
+# Environement parameters (Log-shadowing model)
+LOG_DIST_PARAMS = (2.08, 107.41, 40.0) # (gamma, Lpld0, d0)
+INTERFERENCE_THRESHOLD = -150 # dBm
+
+# sensitivity (sf, 125 kHz, 250 kHz, 500 kHz)
+SENSI = np.array([[7, -123.0,-121.5,-118.5],
+                  [8, -126.0,-124.0,-121.0],
+                  [9, -129.5,-126.5,-123.5],
+                  [10,-132.0,-129.0,-126.0],
+                  [11,-134.5,-131.5,-128.5],
+                  [12,-137.0,-134.0,-131.0]]) # array of sensitivity values
+
+def getPhyParams(packetLength):
+    """ phy parameters (rdd, packetLength, preambleLength, syncLength, headerEnable, crc)"""
+    return (1, packetLength, 8, 4.25, False, True)
+
+def resultName(nrIntNodes, initial, info_mode, captureEffect, interSFInterference):
+    """ Name of the result files of a run (prob_, ratio_, energy_, traffic_ and metrics_ + name)."""
+    return str(nrIntNodes) +'_smartNodes_' + 'initial_' +str(initial) + '_infoMode_' + str(info_mode) + '_captureEffect_' + str(captureEffect) + '_interSFMode_' + str(interSFInterference)
+
+def makeScenario(nrNodes, nrBS, radius, distribution, packetLength, powSet, logdir, seed, grid=GRID):
+    """ Generate the locations of the base-stations and nodes, or load them if they exist.
+    Parameters
+    ----------
+    nrNodes, nrBS, radius, distribution, packetLength, powSet:
+        Parameters of the simulation (see sim).
+    logdir: string
+        Folder of the scenario files (see lora.scenario).
+    seed: int
+        Seed of the locations.
+    grid: list
+        Size of the simulation area in m.
+    Returns
+    -------
+    scenario: dict
+        Locations of the base-stations and nodes (see lora.scenario.loadScenario).
+    """
+    grid = [int(size) for size in grid]
+    maxPtx = max(powSet)
+    phyParams = getPhyParams(packetLength)
+    logDistParams = LOG_DIST_PARAMS
+    sensi = SENSI
+
+    # Location generator
+    print ("======= Generate/Load simulation scenario =======")
+    distMatrix, bestDist, bestSF, bestBW = getMaxTransmitDistance(sensi, maxPtx, logDistParams, phyParams)
+    print ("Max range = {} at SF = {}, BW = {}".format(bestDist, bestSF, bestBW))
+
+    # Generate base station and nodes
+    
+    # Place base-stations randomly
+    if not exists(logdir):
+        makedirs(logdir)
+    scenarioParams = {'nrBS': nrBS, 'nrNodes': nrNodes, 'radius': radius, 'distribution': list(distribution), 'grid': grid,
+                      'phyParams': phyParams, 'maxPtx': maxPtx, 'sensi': sensi, 'logDistParams': logDistParams,
+                      'seed': seed}
+    scenarioFile = scenarioPath(logdir, scenarioParams)
+    
+    if not os.path.exists(scenarioFile):
+        print ("Generated locations for {} base-stations and {} nodes".format(nrBS, nrNodes))
+        # own random stream: the simulation does not depend on whether the scenario was loaded or generated
+        npState, pyState = np.random.get_state(), random.getstate()
+        np.random.seed(scenarioParams['seed'])
+        random.seed(scenarioParams['seed'])
+        BSLoc = np.zeros((nrBS, 3))
+        if nrBS == 1:
+            BSLoc[0] = [0, grid[0]*0.5, grid[1]*0.5]
+        else:
+            placeRandomly(nrBS, BSLoc, [grid[0]*0.1, grid[0]*0.9], [grid[1]*0.1, grid[1]*0.9])
+            
+        # Place nodes randomly
+        nodeLoc = np.zeros((nrNodes, 14))
+        placeInRings(nrNodes, nodeLoc, [0, grid[0]], [0, grid[1]], BSLoc, (bestDist, bestSF, bestBW), radius, phyParams, maxPtx, distribution, distMatrix)
+        np.random.set_state(npState)
+        random.setstate(pyState)
+            
+        # save to file
+        saveScenario(scenarioFile, BSLoc, nodeLoc, distMatrix, bestDist, bestSF, bestBW, scenarioParams)
+    else:
+        # Load =location
+        print ("\t Load locations for {} base-stations and {} nodes".format(nrBS, nrNodes))
+    return loadScenario(scenarioFile) # read-only, shared between processes
+
 def sim(nrNodes, nrIntNodes, nrBS, initial, radius, distribution, avgSendTime, horTime, packetLength, sfSet, freqSet, 
-        powSet, captureEffect, interSFInterference, info_mode, algo, logdir, exp_name) :
+        powSet, captureEffect, interSFInterference, info_mode, algo, logdir, exp_name, engine="simpy", seed=42, plot=True, scenarioSeed=None, metrics="csv", reception="eager", kernels=None, traffic="node", background="node", nodeIds=None, bsIds=None, replicas=None, interferenceThreshold=INTERFERENCE_THRESHOLD, grid=GRID, blockSize=32) :
+    """ Run the simulation.
+    engine selects the event scheduler: "simpy" (one SimPy process per node)
+    or "heap" (lean heap-based scheduler, see lora.scheduler). Both engines
+    give the same results for the same seed. "vectorized" evaluates all the
+    packets in bulk with the initial probabilities, which is much faster for
+    fixed policies but does not learn (see lora.vectorized). "batched"
+    simulates the replications of replicas (a lora.batched.ReplicaBatch, the
+    seed alone if None) together with the same bulk evaluation, with
+    learning; the nodes and the result files are those of the first one and
+    the summaries of all of them are stored in replicas (see lora.batched).
+    seed seeds the random streams of the network and of each node (see
+    lora.rng) and the global generators, plot=False skips the location figure
+    (e.g. in worker processes, see lora.runner). The locations are generated
+    with scenarioSeed (seed if None) and saved in logdir (see lora.scenario).
+    metrics selects how the checkpoints are saved: "csv" (one file per node
+    and per metric, appended at every checkpoint) or "npz" (buffered and
+    written in chunks, see lora.metrics).
+    reception selects the interference evaluation of the base stations:
+    "eager" (at every arrival, see myBS) or "lazy" (once per packet at its
+    end, see myLazyBS). Both give the same results.
+    kernels selects the numeric kernels (see lora.kernels): "numpy", "numba"
+    or None (Numba if it is installed).
+    traffic selects how the packets arrive with the simpy and heap engines:
+    "node" (one arrival process per node) or "poisson" (one merged Poisson
+    source for all the nodes, same law of the packets of a node but the
+    event queue does not grow with the number of nodes, see lora.traffic).
+    background selects how the UNIFORM and RANDOM nodes are simulated with
+    the simpy and heap engines: "node" (packet by packet, as the SMART
+    nodes) or "aggregate" (only the SMART nodes send packets, the others
+    are replaced by their aggregate interference at the BSs, see
+    lora.background); the results then cover the SMART nodes.
+    nodeIds and bsIds restrict the simulation to some nodes and base
+    stations of the scenario, e.g. a cluster closed under interference
+    (see lora.parallel): the nodes keep their ids and random streams.
+    interferenceThreshold (dBm) sets the interference distance of the
+    nodes: the base stations beyond it do not see their packets. grid is
+    the size of the simulation area in m.
+    blockSize is the number of variates of the random streams drawn at once
+    for each node; the results do not depend on it and the blocks take
+    16 * blockSize bytes per node (see lora.rng).
+    """
+    assert engine in ["simpy", "heap", "vectorized", "batched"], "Simulation engine must be simpy, heap, vectorized or batched."
+    assert metrics in ["csv", "npz"], "Metrics format must be csv or npz."
+    assert reception in ["eager", "lazy"], "Reception model must be eager or lazy."
+    assert traffic in ["node", "poisson"], "Traffic model must be node or poisson."
+    assert background in ["node", "aggregate"], "Background model must be node or aggregate."
+    useKernels(kernels)
+
+    np.random.seed(seed) # seed the random generator
+    random.seed(seed)
     
     simtime = horTime * avgSendTime # simulation time in ms
 
-    grid = [int(10000), int(10000)] # maximum simulation area in m
+    grid = [int(size) for size in grid] # maximum simulation area in m
     
     # Node parameters
     ackLength = 8 # length of the ack
-    maxPtx = max(powSet)
     
     # traffic
     lambda_i = (1/avgSendTime) # packet generation rate
-    lambda_e = ((nrNodes-nrIntNodes)/nrNodes) * lambda_i * np.random.rand(len(sfSet), len(freqSet))
-    
-    # phy parameters (rdd, packetLength, preambleLength, syncLength, headerEnable, crc)
-    phyParams = (1, packetLength, 8, 4.25, False, True)
+    streams = RandomStreams(seed, nrNodes if nodeIds is None else len(nodeIds), blockSize) # random streams of the network and of each node
+    lambda_e = ((nrNodes-nrIntNodes)/nrNodes) * lambda_i * streams.network.random((len(sfSet), len(freqSet)))
 
     # Environement parameters (Log-shadowing model)
-    logDistParams=(2.08, 107.41, 40.0) # (gamma, Lpld0, d0)
-    interferenceThreshold = -150 # dBm
+    logDistParams = LOG_DIST_PARAMS # (gamma, Lpld0, d0)
 
     # BS parameters
     nDemodulator = 8 # number of demodulators on base-station
     
     # sensitivity
-    sf7  = np.array([7, -123.0,-121.5,-118.5])
-    sf8  = np.array([8, -126.0,-124.0,-121.0])
-    sf9  = np.array([9, -129.5,-126.5,-123.5])
-    sf10 = np.array([10,-132.0,-129.0,-126.0])
-    sf11 = np.array([11,-134.5,-131.5,-128.5])
-    sf12 = np.array([12,-137.0,-134.0,-131.0])
-    sensi = np.array([sf7,sf8,sf9,sf10,sf11,sf12]) # array of sensitivity values
+    sensi = SENSI # array of sensitivity values
 
     # The spreading factor interaction matrix derived from lab tests and Semtech documentation
     # SFs are not perfectly orthogonal: a signal at SF_m faces interferences from all signals on other SFs
@@ -105,43 +247,15 @@ def sim(nrNodes, nrIntNodes, nrBS, initial, radius, distribution, avgSendTime, h
         else:
             interactionMatrix = np.eye(6, dtype=int)
     
-    # Location generator
-    print ("======= Generate/Load simulation scenario =======")
-    distMatrix, bestDist, bestSF, bestBW = getMaxTransmitDistance(sensi, maxPtx, logDistParams, phyParams)
-    print ("Max range = {} at SF = {}, BW = {}".format(bestDist, bestSF, bestBW))
-
-    # Generate base station and nodes
-    np.random.seed(42) # seed the random generator
-    
-    # Place base-stations randomly
+    # Generate/Load the locations of the base-stations and nodes
     simu_dir = join(logdir, exp_name)
     #make folder
     if not exists(simu_dir):
         makedirs(simu_dir)
-    file_1 = join(logdir, "bsList_bs" + str(nrBS) + "_nodes" + str(nrNodes) + ".npy")
-    file_2 = join(logdir, "nodeList_bs"+ str(nrBS) + "_nodes" + str(nrNodes) + ".npy")
-    
-    if not os.path.exists(file_1):
-        if not os.path.exists(file_2):
-            print ("Generated locations for {} base-stations and {} nodes".format(nrBS, nrNodes))
-            BSLoc = np.zeros((nrBS, 3))
-            if nrBS == 1:
-                BSLoc[0] = [0, grid[0]*0.5, grid[1]*0.5]
-            else:
-                placeRandomly(nrBS, BSLoc, [grid[0]*0.1, grid[0]*0.9], [grid[1]*0.1, grid[1]*0.9])
-            
-            # Place nodes randomly
-            nodeLoc = np.zeros((nrNodes, 14))
-            placeRandomlyInRange(nrNodes, nrIntNodes, nodeLoc, [0, grid[0]], [0, grid[1]], BSLoc, (bestDist, bestSF, bestBW), radius, phyParams, maxPtx, distribution, distMatrix)
-            
-            # save to file
-            np.save(file_1, BSLoc)
-            np.save(file_2, nodeLoc)
-    else:
-        # Load =location
-        print ("\t Load locations for {} base-stations and {} nodes".format(nrBS, nrNodes))
-        BSLoc = np.load(file_1)
-        nodeLoc = np.load(file_2)
+    scenario = makeScenario(nrNodes, nrBS, radius, distribution, packetLength, powSet, logdir, seed if scenarioSeed is None else scenarioSeed, grid)
+    BSLoc = scenario['BSLoc']
+    nodeLoc = scenario['nodeLoc']
+    distMatrix, bestDist = scenario['distMatrix'], scenario['bestDist']
     
     # Simulation
     nTransmitted = 0
@@ -149,43 +263,98 @@ def sim(nrNodes, nrIntNodes, nrBS, initial, radius, distribution, avgSendTime, h
 
     BSList = BSLoc[0:nrBS,:]
     nodeList = nodeLoc[0:nrNodes,:]
-    nodeList[0:nrIntNodes, -1] = 1 # Intelligent nodes
-    nodeList[0:nrNodes, -2] = avgSendTime # avgSendTime
+    if bsIds is not None:
+        BSList = BSList[np.isin(BSList[:,0], bsIds)]
+    if nodeIds is not None:
+        nodeList = nodeList[np.sort(np.asarray(nodeIds, dtype=np.int64))]
+    bsIndex = BSGridIndex(BSList, bestDist) # spatial index of the base-stations
     print ("=============== Setup parameters ================")
-    print ("# base-stations = {}".format(nrBS))
-    print ("# nodes = {}".format(nrNodes))
+    print ("# base-stations = {}".format(len(BSList)))
+    print ("# nodes = {}".format(len(nodeList)))
     
     # Plotting - location
-    plotLocations(BSLoc, nodeLoc, grid[0], grid[1], bestDist, distMatrix)
-
-    env = simpy.Environment()
-    env.process(cuckooClock(env))
+    if plot:
+        plotLoc = np.array(nodeLoc)
+        plotLoc[0:nrIntNodes, -1] = 1 # Intelligent nodes
+        plotLocations(BSLoc, plotLoc, grid[0], grid[1], bestDist, distMatrix)
 
-    fname = str(nrIntNodes) +'_smartNodes_' + 'initial_' +str(initial) + '_infoMode_' + str(info_mode) + '_captureEffect_' + str(captureEffect) + '_interSFMode_' + str(interSFInterference)
+    fname = resultName(nrIntNodes, initial, info_mode, captureEffect, interSFInterference)
 
     bsDict = {} # setup empty dictionary for base-stations  
+    BS = myLazyBS if reception == "lazy" else myBS
     for elem in BSList:
-        bsDict[int(elem[0])] = myBS(int(elem[0]), (elem[1], elem[2]), interactionMatrix, nDemodulator, ackLength, freqSet, sfSet, captureThreshold)
+        bsDict[int(elem[0])] = BS(int(elem[0]), (elem[1], elem[2]), interactionMatrix, nDemodulator, ackLength, freqSet, sfSet, captureThreshold)
         
     nodeDict = {} # setup empty dictionary for nodes
-    for elem in nodeList:
-        node = myNode(int(elem[0]), (elem[1], elem[2]), elem[3:13], initial, sfSet, freqSet, powSet, 
-                    BSList, interferenceThreshold, logDistParams, sensi, elem[13], info_mode, horTime, algo, simu_dir, fname)
+    population = NodePopulation(len(nodeList), len(sfSet)*len(freqSet)*len(powSet), streams) # state of all nodes
+    for i, elem in enumerate(nodeList):
+        transmitParams = np.append(elem[3:12], avgSendTime) # avgSendTime
+        nodeMode = 1 if int(elem[0]) < nrIntNodes else elem[13] # Intelligent nodes
+        node = myNode(int(elem[0]), (elem[1], elem[2]), transmitParams, initial, sfSet, freqSet, powSet, 
+                    BSList, interferenceThreshold, logDistParams, sensi, nodeMode, info_mode, horTime, algo, simu_dir, fname,
+                    population, bsIndex)
         nodeDict[node.nodeid] = node
-        env.process(transmitPacket(env, node, bsDict, logDistParams, algo))
+    if not nodeDict:
+        print ("No node to simulate")
+        return(bsDict, nodeDict)
     
-    # save results
-    env.process(saveProb(env, nodeDict, fname, simu_dir))
-    env.process(saveRatio(env, nodeDict, fname, simu_dir))
-    env.process(saveEnergy(env, nodeDict, fname, simu_dir))
-    env.process(saveTraffic(env, nodeDict, fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e))
+    sink = MetricsSink(simu_dir, fname) if metrics == "npz" else None
+    # durations of the packets, running totals and (SF, channel) occupancy read by the checkpoints
+    pkt = next(iter(nodeDict.values())).packet
+    airtimes = AirtimeTable.fromPacket(pkt)
+    stats = NetworkStats(sfSet, freqSet, [airtimes.lookup(sf, pkt.bw)[1] for sf in sfSet])
+    # nodes sending packets (the others are aggregated, see lora.background)
+    if background == "aggregate" and engine in ["simpy", "heap"]:
+        senders = [node for node in nodeDict.values() if node.node_mode == "SMART"]
+        assert senders, "The aggregate background model needs SMART nodes."
+        backgroundTraffic = BackgroundTraffic([node for node in nodeDict.values() if node.node_mode != "SMART"],
+                                              bsDict, logDistParams, airtimes, streams.background)
+    else:
+        senders = list(nodeDict.values())
+        backgroundTraffic = None
+    if engine == "simpy":
+        env = simpy.Environment()
+        env.process(cuckooClock(env))
+        if traffic == "poisson":
+            env.process(sourceProcess(env, PoissonSource(senders, streams.network), bsDict, logDistParams, algo, stats, airtimes))
+        else:
+            for node in senders:
+                env.process(transmitPacket(env, node, bsDict, logDistParams, algo, stats, airtimes))
+        if backgroundTraffic is not None:
+            env.process(backgroundProcess(env, backgroundTraffic, bsDict))
     
-    env.run(until=simtime)
+        # save results
+        env.process(saveResults(env, nodeDict, fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e, sink, stats))
+
+        env.run(until=simtime)
+    elif engine == "heap":
+        scheduler = EventScheduler(bsDict, logDistParams, algo, stats, airtimes)
+        scheduler.addPeriodic(1000 * 3600000, lambda: print("Running {} kHrs".format(scheduler.now/(1000 * 3600000))))
+        if traffic == "poisson":
+            scheduler.addSource(PoissonSource(senders, streams.network))
+        else:
+            for node in senders:
+                scheduler.addNode(node)
+        if backgroundTraffic is not None:
+            scheduler.addBackground(backgroundTraffic)
+
+        # save results
+        scheduler.addPeriodic(100 * 3600000, lambda: writeResults(nodeDict, fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e, sink, stats))
+
+        scheduler.run(until=simtime)
+    elif engine == "vectorized":
+        runVectorized(nodeDict, bsDict, simtime, logDistParams,
+                      checkpoint={'fname': fname, 'simu_dir': simu_dir, 'sfSet': sfSet, 'freqSet': freqSet, 'lambda_i': lambda_i, 'lambda_e': lambda_e, 'sink': sink})
+    elif engine == "batched":
+        runBatched(nodeDict, bsDict, simtime, logDistParams, algo, replicas if replicas is not None else ReplicaBatch([seed]),
+                   checkpoint={'fname': fname, 'simu_dir': simu_dir, 'sfSet': sfSet, 'freqSet': freqSet, 'lambda_i': lambda_i, 'lambda_e': lambda_e, 'sink': sink})
+    if sink is not None:
+        sink.close()
     
     # reception
     nTransmitted = sum(node.packetsTransmitted for nodeid, node in nodeDict.items())
     nRecvd = sum(node.packetsSuccessful for nodeid, node in nodeDict.items())
-    PacketReceptionRatio = nRecvd/nTransmitted
+    PacketReceptionRatio = nRecvd/nTransmitted if nTransmitted else 0.0
 
     # print results        
     print ("================== Results ==================")
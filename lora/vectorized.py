@@ -0,0 +1,453 @@
+""" LPWAN Simulator: vectorized Monte Carlo engine
+============================================
+Utilities (:mod:`lora.vectorized`)
+============================================
+.. autosummary::
+   :toctree: generated/
+   linkTables               -- Per-action airtimes and per (node, BS) link budgets.
+   bucketMaxima             -- Signal seen by the packets of a frequency bucket.
+   groupMaxima              -- Signal seen by the packets of all the frequency buckets.
+   evaluateRows             -- Capture-effect and inter-SF rules for a set of packets.
+   windowStep               -- Evaluate the packets of a window.
+   runVectorized            -- Simulate fixed policies without discrete events.
+
+For fixed policies (UNIFORM/RANDOM nodes, frozen smart nodes) the outcome of a
+packet only depends on arrival times, actions and geometry. The engine draws
+them as arrays, window by window, and evaluates every (packet, BS) pair of a
+frequency bucket with a sort-and-sweep over start/end times:
+
+* the signal level at a BS only grows when a packet arrives, so the worst
+  interference during the critical section of a packet is the largest of
+  the levels at the start of its critical section and at each arrival in
+  the bucket before its end. The rules of myBS.evaluatePacket are applied
+  to these maxima;
+* a packet takes a demodulator at the start of its critical section as in
+  myBS.makeCritical: only if it passes the evaluation, a demodulator is free
+  and no other packet holds the same (frequency, SF).
+
+Differences with the discrete-event engines: the probabilities are never
+updated and the inter-packet time is period + Exp(period) (the ACK time is
+not added).
+"""
+import heapq
+import numpy as np
+from .loratools import packetEnergy
+from .bsFunctions import writeResults
+from .stats import NetworkStats
+from .timing import AirtimeTable
+
+__all__ = ['linkTables', 'bucketMaxima', 'groupMaxima', 'evaluateRows', 'windowStep', 'runVectorized']
+
+def linkTables(nodes, bsList, logDistParams):
+    """ Per-action airtimes and per (node, BS) link budgets of the nodes.
+    Parameters
+    ----------
+    nodes: list
+        list of nodes.
+    bsList: list
+        list of BSs.
+    logDistParams: list
+        channel params
+    Returns
+    -------
+    tables: dict
+        Node arrays (N x K): sf index, frequency, pTX, airtime, time to the critical section.
+        Pair arrays (P x K): bucket group (bs x bucket, -1 if none), received mW, above sensitivity.
+        pairPtr (N + 1): pairs of node n are pairPtr[n]:pairPtr[n+1].
+        nBuckets, nrBS: number of buckets per BS and of BSs.
+    """
+    N = len(nodes)
+    K = max(node.nrActions for node in nodes)
+    bsIndex = {bs.bsid: i for i, bs in enumerate(bsList)}
+    nBuckets = max(len(bs.freqBuckets) for bs in bsList)
+
+    sfIdx = np.zeros((N, K), dtype=np.int64)
+    freq = np.zeros((N, K))
+    pTX = np.zeros((N, K))
+    air = np.ones((N, K))
+    tcrit = np.zeros((N, K))
+    rectime = np.zeros(N)
+    pairNode, pairBS, pairOrder, group, power, aboveSens = [], [], [], [], [], []
+    pairPtr = np.zeros(N + 1, dtype=np.int64)
+    airtimes = AirtimeTable.fromPacket(nodes[0].packet)
+    bsDict = {bs.bsid: bs for bs in bsList}
+    for n, node in enumerate(nodes):
+        pkt = node.packet
+        rectime[n] = pkt.rectime
+        K_n = node.nrActions
+        sfIdx[n, :K_n] = node.actions['sf'] - 7
+        freq[n, :K_n] = node.actions['freq']
+        pTX[n, :K_n] = node.actions['pTX']
+        for k, sf in enumerate(node.actions['sf'].tolist()):
+            tcrit[n, k], air[n, k] = airtimes.lookup(sf, pkt.bw)
+        if pkt.links is None:
+            pkt.links = pkt.linkTable(bsDict, logDistParams)
+        actionLinks, bucketIdx, powermW, pRX, lost = pkt.links
+        sfI = np.array([link[2] for link in actionLinks], dtype=np.int64)
+        pI = np.array([link[3] for link in actionLinks], dtype=np.int64)
+        for order, bsid in enumerate(pkt.bsids):
+            b = bucketIdx[:, order].astype(np.int64)
+            g = np.full(K, -1, dtype=np.int64)
+            mW = np.zeros(K)
+            sens = np.zeros(K, dtype=bool)
+            g[:K_n] = np.where(b >= 0, bsIndex[bsid]*nBuckets + b, -1)
+            mW[:K_n] = np.where(b >= 0, powermW[pI, order], 0.0)
+            sens[:K_n] = ~lost[pI, sfI, order]
+            pairNode.append(n)
+            pairBS.append(bsIndex[bsid])
+            pairOrder.append(order)
+            group.append(g)
+            power.append(mW)
+            aboveSens.append(sens)
+        pairPtr[n + 1] = len(pairNode)
+    return {'sfIdx': sfIdx, 'freq': freq, 'pTX': pTX, 'air': air, 'tcrit': tcrit, 'rectime': rectime,
+            'pairPtr': pairPtr, 'pairNode': np.array(pairNode, dtype=np.int64),
+            'pairBS': np.array(pairBS, dtype=np.int64), 'pairOrder': np.array(pairOrder, dtype=np.int64),
+            'group': np.array(group, dtype=np.int64).reshape(-1, K), 'power': np.array(power).reshape(-1, K),
+            'aboveSens': np.array(aboveSens, dtype=bool).reshape(-1, K), 'nBuckets': nBuckets, 'nrBS': len(bsList)}
+
+def bucketMaxima(start, crit, end, sfIdx, power, interactionMatrix):
+    """ Signal seen by the packets of one frequency bucket of a BS.
+    Parameters
+    ----------
+    start, crit, end : 1D ndarray of floats
+        Start, start of critical section and end of each packet, sorted by start.
+    sfIdx : 1D ndarray of ints
+        SF index of each packet.
+    power : 1D ndarray of floats
+        Received power of each packet in mW.
+    interactionMatrix: 2D ndarray
+        SF interaction matrix.
+    Returns
+    -------
+    critSignal, critInter: 1D ndarray of floats
+        Total power at the SF of the packet and inter-SF power when its critical section starts.
+    maxSignal, maxInter: 1D ndarray of floats
+        Largest values of the same quantities until the end of the packet.
+    """
+    n = len(start)
+    rows = np.arange(n)
+    maxAir = np.max(end - start)
+
+    # signal level just after each arrival (sum of the packets still on air)
+    signal = np.zeros((n, 6))
+    lo = np.searchsorted(start, start - maxAir, side='left')
+    for d in range(int(np.max(rows - lo)) + 1):
+        j = rows - d
+        valid = (j >= 0) & (end[np.maximum(j, 0)] > start)
+        signal[rows[valid], sfIdx[j[valid]]] += power[j[valid]]
+
+    # signal level when the critical section starts
+    critLevel = np.zeros((n, 6))
+    hi = np.searchsorted(start, crit, side='right')
+    lo = np.searchsorted(start, crit - maxAir, side='left')
+    for d in range(1, int(np.max(hi - lo)) + 1):
+        j = hi - d
+        valid = (j >= 0) & (end[np.maximum(j, 0)] > crit)
+        critLevel[rows[valid], sfIdx[j[valid]]] += power[j[valid]]
+    critSignal = critLevel[rows, sfIdx]
+    critInter = np.sum(critLevel * interactionMatrix[sfIdx], axis=1)
+
+    # largest level at the arrivals during the critical section
+    inter = np.dot(signal, np.transpose(interactionMatrix))
+    maxSignal = critSignal.copy()
+    maxInter = critInter.copy()
+    last = np.searchsorted(start, end, side='left')
+    for d in range(int(np.max(last - hi, initial=0))):
+        j = hi + d
+        valid = j < last
+        maxSignal[valid] = np.maximum(maxSignal[valid], signal[j[valid], sfIdx[valid]])
+        maxInter[valid] = np.maximum(maxInter[valid], inter[j[valid], sfIdx[valid]])
+    return critSignal, critInter, maxSignal, maxInter
+
+def groupMaxima(group, start, crit, end, sfIdx, power, interactionMatrix):
+    """ Signal seen by the packets of all the bucket groups (see bucketMaxima).
+    The groups are laid one after the other on the time axis, far enough
+    apart that their packets never overlap, and swept in a single call.
+    Parameters
+    ----------
+    group : 1D ndarray of ints
+        Bucket group of each packet (-1: outside the buckets, not evaluated).
+    start, crit, end : 1D ndarray of floats
+        Start, start of critical section and end of each packet.
+    sfIdx : 1D ndarray of ints
+        SF index of each packet.
+    power : 1D ndarray of floats
+        Received power of each packet in mW.
+    interactionMatrix: 2D ndarray
+        SF interaction matrix.
+    Returns
+    -------
+    critSignal, critInter, maxSignal, maxInter: 1D ndarray of floats
+        See bucketMaxima (0 outside the buckets).
+    """
+    critSignal, critInter, maxSignal, maxInter = [np.zeros(len(group)) for k in range(4)]
+    idx = np.flatnonzero(group >= 0)
+    if len(idx) == 0:
+        return critSignal, critInter, maxSignal, maxInter
+    idx = idx[np.lexsort((start[idx], group[idx]))]
+    _, rank = np.unique(group[idx], return_inverse=True)
+    base = np.min(start[idx])
+    maxAir = np.max(end[idx] - start[idx])
+    span = np.max(end[idx]) - base + maxAir + 1.0
+    shift = rank * span - base # window-relative times keep the precision
+    critSignal[idx], critInter[idx], maxSignal[idx], maxInter[idx] = bucketMaxima(
+        start[idx] + shift, crit[idx] + shift, end[idx] + shift, sfIdx[idx], power[idx], interactionMatrix)
+    return critSignal, critInter, maxSignal, maxInter
+
+def evaluateRows(own, signal, inter, captureThreshold):
+    """ Capture-effect and inter-SF rules of myBS.evaluatePacket for many packets.
+    Parameters
+    ----------
+    own : 1D ndarray of floats
+        Received power of each packet in mW.
+    signal, inter : 1D ndarray of floats
+        Total power at the SF of the packet and inter-SF power.
+    captureThreshold: float
+        Capture threshold (0 without capture effect).
+    Returns
+    -------
+    lost, collision: 1D ndarray of bools
+    """
+    if captureThreshold != 0:
+        lost = ((1 + captureThreshold)*own < captureThreshold * signal) | ((1 + captureThreshold)*own < inter)
+        collision = own < signal
+    else:
+        collision = own < signal
+        lost = collision | (own < inter)
+    return lost, collision
+
+def windowStep(tables, carry, tx, holders, nrDemodulators, interactionMatrix, captureThreshold, previous, frontier):
+    """ Evaluate the packets on air during a window and return those completely sent in it.
+    The packets of several replications can be evaluated together (see
+    lora.batched): the base stations and bucket groups of replication r are
+    offset by r, so that its packets never meet those of the others.
+    Parameters
+    ----------
+    tables: dict
+        Link tables of the nodes (see linkTables).
+    carry: dict
+        Rows of the previous windows which can still interfere (None for the first window).
+    tx: dict
+        Packets starting in the window, sorted by start: id, node (its counters), base (its row
+        in the tables), replica, start and action.
+    holders: list
+        (end, bucket group, sf) of the packets using a demodulator, a heap per replication and BS (updated).
+    nrDemodulators: list
+        Number of demodulators of each replication and BS.
+    interactionMatrix: 2D ndarray
+        SF interaction matrix.
+    captureThreshold: float
+        Capture threshold (0 without capture effect).
+    previous, frontier: float
+        Bounds of the window.
+    Returns
+    -------
+    carry: dict
+        Rows which can still interfere with a packet of the next windows.
+    done: dict
+        Packets completely sent in the window: node, action, success, clean (no collision at the
+        first BS which received it), completion (end of the ACK if received) and energy.
+    """
+    # one row per (packet, BS in range)
+    pairPtr = tables['pairPtr']
+    nrBS = tables['nrBS']
+    base = tx['base']
+    counts = pairPtr[base + 1] - pairPtr[base]
+    rowTx = np.repeat(np.arange(len(base)), counts)
+    rowPair = np.repeat(pairPtr[base], counts) + np.arange(len(rowTx)) - np.repeat(np.cumsum(counts) - counts, counts)
+    n, a, r = base[rowTx], tx['action'][rowTx], tx['replica'][rowTx]
+    start = tx['start'][rowTx]
+    group = tables['group'][rowPair, a]
+    new = {'tx': tx['id'][rowTx], 'node': tx['node'][rowTx], 'bs': r * nrBS + tables['pairBS'][rowPair],
+           'order': tables['pairOrder'][rowPair], 'group': np.where(group >= 0, r * nrBS * tables['nBuckets'] + group, -1),
+           'sf': tables['sfIdx'][n, a], 'power': tables['power'][rowPair, a], 'sens': tables['aboveSens'][rowPair, a],
+           'start': start, 'crit': start + tables['tcrit'][n, a], 'end': start + tables['air'][n, a], 'air': tables['air'][n, a],
+           'energy': packetEnergy(tables['rectime'][n], tables['pTX'][n, a]), 'action': a, 'critical': np.zeros(len(rowTx), dtype=bool)}
+    if carry is None:
+        carry = {f: new[f][:0] for f in new}
+    rows = {f: np.concatenate((carry[f], new[f])) for f in new}
+
+    # signal levels of all the buckets
+    critSignal, critInter, maxSignal, maxInter = groupMaxima(rows['group'], rows['start'], rows['crit'], rows['end'],
+                                                             rows['sf'], rows['power'], interactionMatrix)
+    lostAtCrit, collisionAtCrit = evaluateRows(rows['power'], critSignal, critInter, captureThreshold)
+    lostLater, collision = evaluateRows(rows['power'], maxSignal, maxInter, captureThreshold)
+
+    # demodulators, in the order of the critical sections
+    candidates = np.flatnonzero((rows['crit'] >= previous) & (rows['crit'] < frontier) & rows['sens'] & ~lostAtCrit)
+    candidates = candidates[np.argsort(rows['crit'][candidates], kind='stable')]
+    for i, b, t, e, g, sf in zip(candidates.tolist(), rows['bs'][candidates].tolist(), rows['crit'][candidates].tolist(),
+                                 rows['end'][candidates].tolist(), rows['group'][candidates].tolist(), rows['sf'][candidates].tolist()):
+        busy = holders[b]
+        while busy and busy[0][0] <= t:
+            heapq.heappop(busy)
+        if len(busy) <= nrDemodulators[b] and not any(h[1] == g and h[2] == sf for h in busy):
+            heapq.heappush(busy, (e, g, sf))
+            rows['critical'][i] = True
+
+    # packets completely sent in the window
+    done = (rows['end'] <= frontier) & (rows['end'] > previous)
+    received = done & rows['critical'] & ~lostLater
+    doneTx, doneIdx, doneInv = np.unique(rows['tx'][done], return_index=True, return_inverse=True)
+    success = np.bincount(doneInv, weights=received[done], minlength=len(doneTx)) > 0
+    # collision flag of the first BS which received the packet
+    firstRx = np.flatnonzero(received)
+    firstRx = firstRx[np.lexsort((rows['order'][firstRx], rows['tx'][firstRx]))]
+    rxTx, rxFirst = np.unique(rows['tx'][firstRx], return_index=True)
+    clean = np.ones(len(doneTx), dtype=bool)
+    clean[np.searchsorted(doneTx, rxTx)] = ~collision[firstRx[rxFirst]]
+    doneRows = np.flatnonzero(done)[doneIdx]
+    finished = {'node': rows['node'][doneRows], 'action': rows['action'][doneRows], 'success': success, 'clean': clean,
+                'completion': rows['end'][doneRows] + np.where(success, rows['air'][doneRows], 0),
+                'energy': rows['energy'][doneRows]}
+
+    # keep the packets which can still interfere with an unfinished one
+    pending = rows['end'] > frontier
+    if np.any(pending):
+        keep = rows['end'] > np.min(rows['start'][pending])
+    else:
+        keep = pending
+    return {f: rows[f][keep] for f in rows}, finished
+
+def runVectorized(nodeDict, bsDict, simtime, logDistParams, checkpoint=None, windowPackets=200000):
+    """ Simulate the nodes with their current (frozen) probabilities.
+    Parameters
+    ----------
+    nodeDict: dict
+        list of nodes (their counters are updated).
+    bsDict: dict
+        list of BSs.
+    simtime: float
+        Simulation time in ms.
+    logDistParams: list
+        channel params
+    checkpoint: dict
+        Results to save every 100 hours: fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e, sink.
+    windowPackets: int
+        Approximate number of packets drawn at once.
+    Returns
+    -------
+    """
+    # nodes without a BS in range cannot send anything
+    nodes = [node for node in nodeDict.values() if node.proximateBS]
+    if not nodes:
+        return
+    bsList = list(bsDict.values())
+    bs0 = bsList[0]
+    interactionMatrix = np.asarray(bs0.interactionMatrix, dtype=float)
+    tables = linkTables(nodes, bsList, logDistParams)
+    N = len(nodes)
+    K = tables['sfIdx'].shape[1]
+
+    period = np.array([node.period for node in nodes])
+    nrActions = np.array([node.nrActions for node in nodes])
+    cumProb = np.zeros((N, K))
+    for n, node in enumerate(nodes):
+        cumProb[n, :node.nrActions] = np.cumsum(node.prob)
+        cumProb[n, node.nrActions:] = np.inf
+
+    interval = 100 * 3600000
+    nCheckpoints = int(np.ceil(simtime / interval)) - 1 # checkpoints strictly before simtime
+    ckTransmitted = np.zeros(nCheckpoints + 1)
+    ckReceived = np.zeros(nCheckpoints + 1)
+    ckEnergy = np.zeros(nCheckpoints + 1)
+    ckAction = np.full((nCheckpoints + 1, N), -1, dtype=np.int64)
+    lastAction = np.full(N, -1, dtype=np.int64)
+
+    packetsTransmitted = np.zeros(N, dtype=np.int64)
+    packetsSuccessful = np.zeros(N, dtype=np.int64)
+    energy = np.zeros(N)
+    transmitTime = np.zeros(N)
+
+    # window length: about windowPackets packets (a node sends one packet per 2 periods on average)
+    window = max(np.min(period), windowPackets / np.sum(1/(2*period)))
+    streams = nodes[0].population.streams # random streams of the nodes (see lora.rng)
+    rows = np.array([node.row for node in nodes], dtype=np.int64)
+    nextStart = period * streams.exponentialArray(rows)
+
+    carry = None
+    nTx = 0
+    holders = [[] for _ in bsList] # (end, bucket group, sf) of packets using a demodulator
+    nrDemodulators = [bs.nDemodulator for bs in bsList]
+    fullMode = np.array([node.info_mode == "FULL" for node in nodes], dtype=bool)
+    frontier = 0.0
+    while frontier < simtime:
+        previous, frontier = frontier, min(frontier + window, simtime)
+
+        # draw the packets starting in the window
+        txNode, txStart, txUniform = [], [], []
+        while True:
+            active = np.flatnonzero(nextStart < frontier)
+            if len(active) == 0:
+                break
+            txNode.append(active)
+            txStart.append(nextStart[active])
+            txUniform.append(streams.uniformArray(rows[active]))
+            nextStart[active] += period[active] * (1 + streams.exponentialArray(rows[active]))
+        txNode = np.concatenate(txNode) if txNode else np.zeros(0, dtype=np.int64)
+        txStart = np.concatenate(txStart) if txStart else np.zeros(0)
+        txUniform = np.concatenate(txUniform) if txUniform else np.zeros(0)
+        order = np.argsort(txStart, kind='stable')
+        txNode, txStart, txUniform = txNode[order], txStart[order], txUniform[order]
+        # inverse CDF (as ActionSampler for supports smaller than ALIAS_SUPPORT)
+        total = cumProb[txNode, nrActions[txNode] - 1]
+        txAction = np.sum((txUniform * total)[:, None] >= cumProb[txNode], axis=1)
+        txAction = np.minimum(txAction, nrActions[txNode] - 1)
+        txId = nTx + np.arange(len(txNode))
+        nTx += len(txNode)
+
+        # last action of each node at the checkpoints of the window
+        for c in range(int(previous // interval) + 1, min(int(frontier // interval), nCheckpoints) + 1):
+            before = txStart < c * interval
+            lastAction[txNode[before]] = txAction[before]
+            ckAction[c] = lastAction
+        lastAction[txNode] = txAction
+
+        tx = {'id': txId, 'node': txNode, 'base': txNode, 'replica': np.zeros(len(txNode), dtype=np.int64), 'start': txStart, 'action': txAction}
+        carry, done = windowStep(tables, carry, tx, holders, nrDemodulators, interactionMatrix, bs0.captureThreshold, previous, frontier)
+
+        # packets completely sent in the window
+        dNode, completion, success, dEnergy = done['node'], done['completion'], done['success'], done['energy']
+        inTime = completion < simtime
+        counted = success & inTime & (done['clean'] | ~fullMode[dNode])
+        np.add.at(packetsTransmitted, dNode[inTime], 1)
+        np.add.at(packetsSuccessful, dNode[counted], 1)
+        np.add.at(energy, dNode[inTime], dEnergy[inTime])
+        np.add.at(transmitTime, dNode[counted], tables['rectime'][dNode[counted]])
+        ck = np.minimum((completion[inTime] // interval).astype(np.int64), nCheckpoints)
+        ckTransmitted += np.bincount(ck, minlength=nCheckpoints + 1)
+        ckReceived += np.bincount(ck, weights=counted[inTime], minlength=nCheckpoints + 1)
+        ckEnergy += np.bincount(ck, weights=dEnergy[inTime], minlength=nCheckpoints + 1)
+
+    # final state of the nodes
+    for n, node in enumerate(nodes):
+        node.packetsTransmitted = packetsTransmitted[n]
+        node.packetsSuccessful = packetsSuccessful[n]
+        node.energy = energy[n]
+        node.transmitTime = transmitTime[n]
+        node.packetNumber = packetsTransmitted[n]
+        if lastAction[n] >= 0:
+            node.packet.choosenAction = lastAction[n]
+            node.packet.sf, node.packet.freq, node.packet.pTX = node.setActions[lastAction[n]]
+
+    if checkpoint is not None:
+        saveCheckpoints(nodeDict, nodes, tables, ckTransmitted, ckReceived, ckEnergy, ckAction, **checkpoint)
+
+def saveCheckpoints(nodeDict, nodes, tables, ckTransmitted, ckReceived, ckEnergy, ckAction,
+                    fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e, sink=None):
+    """ Write the results of every 100 hours in the files of the save* processes."""
+    nTransmitted = np.cumsum(ckTransmitted).astype(np.int64)
+    nRecvd = np.cumsum(ckReceived).astype(np.int64)
+    totalEnergy = np.cumsum(ckEnergy)
+    pkt = nodes[0].packet
+    airtimes = AirtimeTable.fromPacket(pkt)
+    airtimeSF = np.array([airtimes.lookup(sf, pkt.bw)[1] for sf in sfSet])
+    for c in range(1, len(ckTransmitted)):
+        # statistics of the network at the checkpoint
+        stats = NetworkStats(sfSet, freqSet, airtimeSF)
+        stats.transmitted, stats.received, stats.energy = nTransmitted[c-1], nRecvd[c-1], totalEnergy[c-1]
+        for n in np.flatnonzero(ckAction[c] >= 0):
+            sf, freq, pTX = nodes[n].setActions[ckAction[c, n]]
+            stats.moveNode((None, None), (sf, freq))
+        writeResults(nodeDict, fname, simu_dir, sfSet, freqSet, lambda_i, lambda_e, sink, stats)
@@ -0,0 +1,42 @@
+""" The batched engine against the heap engine, seed by seed."""
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+from lora.runner import runReplication, runBatch
+from lora.batched import ReplicaBatch, runBatched
+from lora.utils import LOG_DIST_PARAMS
+
+def config(logdir, engine, info_mode="NO", algo="exp3", nrBS=1):
+    return dict(nrNodes=60, nrIntNodes=30, nrBS=nrBS, initial="RANDOM", radius=4500, distribution=[0.1, 0.1, 0.3, 0.4, 0.05, 0.05],
+                avgSendTime=60000, horTime=9000, packetLength=50, sfSet=[7, 8, 9, 10, 11, 12], freqSet=[868100], powSet=[14],
+                captureEffect=True, interSFInterference=True, info_mode=info_mode, algo=algo, logdir=str(logdir),
+                exp_name=engine, engine=engine, metrics="npz", scenarioSeed=42)
+
+def compare(logdir, seeds, **kw):
+    batched = runBatch(config(logdir, "batched", **kw), seeds)
+    for seed, summary in zip(seeds, batched):
+        heap = runReplication(config(logdir, "heap", **kw), seed)
+        for key in ['ratio', 'transmitted', 'received', 'final']:
+            np.testing.assert_allclose(summary[key], heap[key], rtol=1e-12, err_msg="{} (seed {})".format(key, seed))
+        np.testing.assert_allclose(summary['prob'], heap['prob'], atol=1e-12, err_msg="prob (seed {})".format(seed))
+
+def test_prob_no_exp3(tmp_path):
+    compare(tmp_path, [42, 49]) # seed 49: a packet ends before the checkpoint and its ACK after it
+
+def test_prob_full_exp3s(tmp_path):
+    compare(tmp_path, [44], info_mode="FULL", algo="exp3s")
+
+def test_three_bs(tmp_path):
+    # the bulk evaluation frees a packet at all its BSs at once: slightly higher reception ratio
+    summary, = runBatch(config(tmp_path, "batched", nrBS=3), [42])
+    heap = runReplication(config(tmp_path, "heap", nrBS=3), 42)
+    np.testing.assert_allclose(summary['final'][0], heap['final'][0], rtol=0.01)
+    assert 0 <= summary['prr'] - heap['prr'] < 0.02
+
+def test_no_node():
+    batch = ReplicaBatch([42, 43])
+    runBatched({}, {}, 250 * 3600000, LOG_DIST_PARAMS, "exp3", batch)
+    assert len(batch.summaries) == 2
+    for summary in batch.summaries:
+        np.testing.assert_array_equal(summary['transmitted'], [0, 0])
+        np.testing.assert_array_equal(summary['final'], [0, 0, 0])
@@ -0,0 +1,47 @@
+""" The engines which give the same results for the same seed, replication by replication."""
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+from lora.runner import runReplication
+
+def config(logdir, exp_name, **kw):
+    base = dict(nrNodes=40, nrIntNodes=20, nrBS=1, initial="RANDOM", radius=4500, distribution=[0.1, 0.1, 0.3, 0.4, 0.05, 0.05],
+                avgSendTime=60000, horTime=7000, packetLength=50, sfSet=[7, 8, 9, 10, 11, 12], freqSet=[868100], powSet=[14],
+                captureEffect=True, interSFInterference=True, info_mode="NO", algo="exp3", logdir=str(logdir),
+                exp_name=exp_name, metrics="npz", scenarioSeed=42)
+    base.update(kw)
+    return base
+
+def compare(logdir, seed, first, second, **kw):
+    """ Summaries of a replication run with two sets of arguments of sim()."""
+    a = runReplication(config(logdir, "first", **dict(kw, **first)), seed)
+    b = runReplication(config(logdir, "second", **dict(kw, **second)), seed)
+    for key in ['ratio', 'transmitted', 'received', 'final', 'prr']:
+        np.testing.assert_allclose(a[key], b[key], rtol=1e-12, err_msg=key)
+    np.testing.assert_allclose(a['prob'], b['prob'], atol=1e-12, err_msg="prob")
+
+def test_simpy_heap(tmp_path):
+    compare(tmp_path, 42, {'engine': "simpy"}, {'engine': "heap"})
+
+def test_simpy_heap_three_bs(tmp_path):
+    compare(tmp_path, 43, {'engine': "simpy"}, {'engine': "heap"}, nrBS=3, nrNodes=60, algo="exp3s")
+
+def test_negative_delay():
+    from lora.scheduler import EventScheduler, PERIODIC
+    scheduler = EventScheduler({}, None, "exp3")
+    with np.testing.assert_raises(ValueError):
+        scheduler.schedule(-1.0, PERIODIC, None)
+
+def test_vectorized_heap(tmp_path):
+    # fixed policies: the UNIFORM nodes never change their probabilities; two windows of packets
+    compare(tmp_path, 44, {'engine': "vectorized"}, {'engine': "heap"}, nrIntNodes=0, initial="UNIFORM", horTime=12000)
+
+def test_eager_lazy(tmp_path):
+    compare(tmp_path, 45, {'reception': "eager"}, {'reception': "lazy"}, engine="heap")
+
+def test_eager_lazy_three_bs(tmp_path):
+    compare(tmp_path, 46, {'reception': "eager"}, {'reception': "lazy"}, engine="heap", nrBS=3, nrNodes=60, algo="exp3s")
+
+def test_block_size(tmp_path):
+    # the variates of a stream do not depend on the size of its blocks
+    compare(tmp_path, 47, {'blockSize': 3}, {'blockSize': 32}, engine="heap")
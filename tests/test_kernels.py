@@ -0,0 +1,38 @@
+""" The NumPy and the Numba kernels, and the batch learning kernels, give the same bits."""
+import numpy as np
+import pytest
+from lora import kernels
+from lora.learning import exp3Prob
+
+def logWeights(seed, nrNodes=20, width=48):
+    rng = np.random.default_rng(seed)
+    K = rng.integers(8, width + 1, size=nrNodes)
+    logWeight = np.where(np.arange(width) < K[:, None], rng.normal(0, 3, size=(nrNodes, width)), -np.inf)
+    logWeight -= np.max(logWeight, axis=1, keepdims=True)
+    return logWeight, K, rng.uniform(0.01, 0.2, size=nrNodes), rng.uniform(0, 0.01, size=nrNodes)
+
+def test_exp3_prob_batch():
+    logWeight, K, learningRate, _ = logWeights(1)
+    batch = exp3Prob(logWeight, K, np.arange(len(K)), learningRate)
+    for row in range(len(K)):
+        prob = kernels.NUMPY_KERNELS['exp3RowProb'](logWeight, row, K[row], learningRate[row])
+        np.testing.assert_array_equal(prob, batch[row, :K[row]])
+
+def test_numpy_numba():
+    pytest.importorskip("numba")
+    numpy, numba = kernels.NUMPY_KERNELS, kernels.NUMBA_KERNELS
+    logWeight, K, learningRate, alpha = logWeights(2)
+    rng = np.random.default_rng(3)
+    first, second = logWeight.copy(), logWeight.copy()
+    for step in range(200):
+        row = rng.integers(len(K))
+        action, reward = rng.integers(K[row]), rng.uniform(1, 50)
+        if step % 2:
+            numpy['exp3RowUpdate'](first, row, K[row], action, reward, learningRate[row])
+            numba['exp3RowUpdate'](second, row, K[row], action, reward, learningRate[row])
+        else:
+            numpy['exp3sRowUpdate'](first, row, K[row], action, reward, learningRate[row], alpha[row])
+            numba['exp3sRowUpdate'](second, row, K[row], action, reward, learningRate[row], alpha[row])
+        np.testing.assert_array_equal(first, second)
+        np.testing.assert_array_equal(numpy['exp3RowProb'](first, row, K[row], learningRate[row]),
+                                      numba['exp3RowProb'](second, row, K[row], learningRate[row]))
@@ -0,0 +1,25 @@
+""" Summaries of the replications read from the result files."""
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+from lora.runner import runReplication
+
+def config(logdir, metrics, info_mode):
+    return dict(nrNodes=40, nrIntNodes=20, nrBS=1, initial="RANDOM", radius=4500, distribution=[0.1, 0.1, 0.3, 0.4, 0.05, 0.05],
+                avgSendTime=60000, horTime=7000, packetLength=50, sfSet=[7, 8, 9, 10, 11, 12], freqSet=[868100], powSet=[14],
+                captureEffect=True, interSFInterference=True, info_mode=info_mode, algo="exp3", logdir=str(logdir),
+                exp_name="exp", engine="heap", metrics=metrics, scenarioSeed=42)
+
+def sharedFolder(tmp_path, metrics):
+    """ A run in a folder which holds the results of a run with other parameters is read back alone."""
+    alone = runReplication(config(tmp_path / "alone", metrics, "NO"), 42)
+    runReplication(config(tmp_path / "shared", metrics, "FULL"), 42) # its files sort first
+    shared = runReplication(config(tmp_path / "shared", metrics, "NO"), 42)
+    for key in alone:
+        np.testing.assert_array_equal(shared[key], alone[key], err_msg=key)
+
+def test_shared_folder_csv(tmp_path):
+    sharedFolder(tmp_path, "csv")
+
+def test_shared_folder_npz(tmp_path):
+    sharedFolder(tmp_path, "npz")